@@ -7,26 +7,61 @@
 // @run-at       document-end
 // @grant        GM_info
 // @grant        unsafeWindow
-// @version      0.3.0
+// @version      0.6.1
 // ==/UserScript==
 
 let slither_xt = 0;
 let slither_yt = 0;
 let slither_acceleration = 0;
+// Negotiated with the server on connect; 'json' until it answers
+let wire_protocol = 'json';
+// What to compute and send, set by the server's 'control' messages (see
+// control() in gym/src/protocol.py)
+const client_config = {
+    send_every: 10,     // game frames between two states
+    view_radius: null,  // null: each category's own default distance
+    caps: {},           // most entities per category, nearest first
+    fields: null,       // Set of the sections the server reads; null: all
+};
+
+const applyControl = (payload) => {
+    if (payload.send_every !== undefined) client_config.send_every = Math.max(1, payload.send_every);
+    if (payload.view_radius !== undefined) client_config.view_radius = payload.view_radius;
+    if (payload.caps !== undefined) client_config.caps = { ...client_config.caps, ...payload.caps };
+    if (payload.fields !== undefined) client_config.fields = payload.fields && new Set(payload.fields);
+    console.log('Client settings:', client_config);
+};
+const wants = (field) => client_config.fields === null || client_config.fields.has(field);
+const viewRadius = (fallback) => client_config.view_radius ?? fallback;
+const cap = (category, fallback = Infinity) => client_config.caps[category] ?? fallback;
 
 // --- WebSocket Initialization ---
 (function () {
     const socket = new WebSocket('ws://127.0.0.1:10043');
+    socket.binaryType = 'arraybuffer';
 
     // WebSocket Handlers
     socket.addEventListener('open', () => {
         console.log('Connected to WebSocket server');
-        socket.send(JSON.stringify({ type: 'init', message: 'Hello Server!' }));
+        socket.send(JSON.stringify({
+            type: 'init',
+            message: 'Hello Server!',
+            payload: { protocols: ['delta-v1', 'binary-v1', 'json'] },
+        }));
     });
 
     socket.addEventListener('message', (event) => {
         const data = JSON.parse(event.data);
-        if (data.type === 'update') {
+        if (data.type === 'init') {
+            wire_protocol = data.payload.protocol;
+            delta_sent = null;
+            console.log('Using wire protocol:', wire_protocol);
+        } else if (data.type === 'keyframe') {
+            // The server lost track of our deltas
+            keyframe_requested = true;
+        } else if (data.type === 'control') {
+            applyControl(data.payload);
+        } else if (data.type === 'update') {
             slither_xt = data.payload.xt;
             slither_yt = data.payload.yt;
             slither_acceleration = data.payload.acceleration;
@@ -43,8 +78,225 @@ let slither_acceleration = 0;
             console.error('WebSocket is not open. Ready state: ', socket.readyState);
         }
     };
+
+    window.sendState = (state, dead) => {
+        if (wire_protocol === 'json' || !state.slither) {
+            window.sendMessage('update', dead ? { dead: true, ...state } : state);
+        } else if (socket.readyState === WebSocket.OPEN) {
+            if (wire_protocol === 'delta-v1') {
+                encodeDelta(state, dead).forEach((message) => socket.send(message));
+            } else {
+                socket.send(packState(state, dead));
+            }
+        } else {
+            console.error('WebSocket is not open. Ready state: ', socket.readyState);
+        }
+    };
 })();
 
+// --- Binary Wire Protocol (binary-v1, see gym/src/protocol.py) ---
+const HEADER_BYTES = 68;
+
+const packState = (state, dead) => {
+    const s = state.slither;
+    const t = state.target_slither || {};
+    const targetParts = t.parts || [];
+    let otherParts = 0;
+    state.others.forEach((o) => { otherParts += o.parts.length; });
+    const counts = [
+        state.foods.length, s.parts.length, state.top_body_parts.length,
+        targetParts.length, state.preys.length, state.others.length, otherParts,
+    ];
+    const words = 3 * (counts[0] + counts[1] + counts[2] + counts[3] + counts[6])
+        + 2 * counts[4] + 6 * counts[5];
+
+    const buffer = new ArrayBuffer(HEADER_BYTES + 4 * words);
+    const view = new DataView(buffer);
+    view.setUint8(0, 0x53); // 'S'
+    view.setUint8(1, 0x4c); // 'L'
+    view.setUint8(2, 0x47); // 'G'
+    view.setUint8(3, 1);    // version
+    view.setUint32(4, dead ? 1 : 0, true);
+    const scalars = [s.x, s.y, s.ang, s.size, s.food_eaten, t.x ?? NaN, t.y ?? NaN, t.ang ?? 0];
+    scalars.forEach((v, i) => view.setFloat32(8 + 4 * i, v, true));
+    counts.forEach((v, i) => view.setUint32(40 + 4 * i, v, true));
+
+    // Typed arrays use platform byte order, which is little-endian in every browser we run in
+    const f32 = new Float32Array(buffer);
+    const u32 = new Uint32Array(buffer);
+    let i = HEADER_BYTES / 4;
+    const putParts = (parts, defaultSize) => {
+        for (const p of parts) {
+            f32[i++] = p.x ?? 0;
+            f32[i++] = p.y ?? 0;
+            f32[i++] = p.size ?? defaultSize;
+        }
+    };
+    for (const f of state.foods) {
+        f32[i++] = f.x;
+        f32[i++] = f.y;
+        f32[i++] = f.value ?? 1;
+    }
+    putParts(s.parts, 10);
+    putParts(state.top_body_parts, 10);
+    putParts(targetParts, 10);
+    for (const p of state.preys) {
+        f32[i++] = p.x;
+        f32[i++] = p.y;
+    }
+    for (const o of state.others) {
+        f32[i++] = o.x;
+        f32[i++] = o.y;
+        f32[i++] = o.ang ?? 0;
+        f32[i++] = o.size ?? 0;
+        f32[i++] = o.dead ? 1 : 0;
+    }
+    for (const o of state.others) u32[i++] = o.parts.length;
+    for (const o of state.others) putParts(o.parts, 10);
+    return buffer;
+};
+
+// --- Delta Wire Protocol (delta-v1, see gym/src/protocol.py) ---
+const DELTA_HEADER_BYTES = 100;
+const KEYFRAME_INTERVAL = 30;
+
+// Stable IDs for game objects, so that the server can match entities across frames
+const entity_ids = new WeakMap();
+let next_entity_id = 1;
+const entityId = (obj) => {
+    let id = entity_ids.get(obj);
+    if (id === undefined) {
+        id = next_entity_id++;
+        entity_ids.set(obj, id);
+    }
+    return id;
+};
+
+let delta_seq = 0;
+// Per section, the entry ({ id, owner, row }) the server has for each key: the ID, or
+// "owner:id" for other slithers' parts, since IDs share one counter and owner * 2^32 + id
+// would pass Number.MAX_SAFE_INTEGER
+let delta_sent = null;
+let keyframe_requested = false;
+
+const deltaSections = (state) => {
+    const s = state.slither;
+    const t = state.target_slither || {};
+    const part = (p) => [p.x ?? 0, p.y ?? 0, p.size ?? 10];
+    const section = (items, row, width, owners = null) => ({
+        ids: items.map((e) => e.id ?? entityId(e)), owners, rows: items.map(row), width,
+    });
+    const otherParts = [];
+    const owners = [];
+    for (const o of state.others) {
+        for (const p of o.parts) {
+            otherParts.push(p);
+            owners.push(o.id);
+        }
+    }
+    return [
+        section(state.foods, (f) => [f.x, f.y, f.value ?? 1], 3),
+        section(s.parts, part, 3),
+        section(state.top_body_parts, part, 3),
+        section(t.parts || [], part, 3),
+        section(state.preys, (p) => [p.x, p.y], 2),
+        section(state.others, (o) => [o.x, o.y, o.ang ?? 0, o.size ?? 0, o.dead ? 1 : 0], 5),
+        section(otherParts, part, 3, owners),
+    ];
+};
+
+// Rows that are new or moved since `sent`, and keys that are gone; everything when `sent` is null
+const diffSection = (section, sent) => {
+    const current = new Map();
+    const changed = [];
+    section.ids.forEach((id, k) => {
+        const owner = section.owners ? section.owners[k] : 0;
+        const key = section.owners ? `${owner}:${id}` : id;
+        const row = section.rows[k].map(Math.fround);
+        current.set(key, { id, owner, row });
+        const last = sent && sent.get(key);
+        if (!last || row.some((v, j) => !Object.is(v, last.row[j]))) changed.push(k);
+    });
+    // Entries the server has that are gone, with their ID and owner
+    const removed = [];
+    if (sent) {
+        for (const [key, entry] of sent) {
+            if (!current.has(key)) removed.push(entry);
+        }
+    }
+    return { current, changed, removed };
+};
+
+const deltaBytes = (sections, diffs) => {
+    let words = DELTA_HEADER_BYTES / 4;
+    sections.forEach((section, k) => {
+        const keyWords = section.owners ? 2 : 1;
+        words += keyWords * (diffs[k].removed.length + diffs[k].changed.length);
+        words += section.width * diffs[k].changed.length;
+    });
+    return 4 * words;
+};
+
+const packDelta = (state, dead, sections, diffs, keyframe) => {
+    const s = state.slither;
+    const t = state.target_slither || {};
+    const buffer = new ArrayBuffer(deltaBytes(sections, diffs));
+    const view = new DataView(buffer);
+    view.setUint8(0, 0x53); // 'S'
+    view.setUint8(1, 0x4c); // 'L'
+    view.setUint8(2, 0x44); // 'D'
+    view.setUint8(3, 1);    // version
+    view.setUint32(4, (dead ? 1 : 0) | (keyframe ? 2 : 0), true);
+    view.setUint32(8, delta_seq, true);
+    const scalars = [s.x, s.y, s.ang, s.size, s.food_eaten, t.x ?? NaN, t.y ?? NaN, t.ang ?? 0];
+    scalars.forEach((v, i) => view.setFloat32(12 + 4 * i, v, true));
+    diffs.forEach((diff, k) => {
+        view.setUint32(44 + 8 * k, diff.removed.length, true);
+        view.setUint32(48 + 8 * k, diff.changed.length, true);
+    });
+
+    const f32 = new Float32Array(buffer);
+    const u32 = new Uint32Array(buffer);
+    let i = DELTA_HEADER_BYTES / 4;
+    sections.forEach((section, k) => {
+        const { removed, changed } = diffs[k];
+        for (const entry of removed) u32[i++] = entry.id;
+        if (section.owners) {
+            for (const entry of removed) u32[i++] = entry.owner;
+        }
+        for (const c of changed) u32[i++] = section.ids[c];
+        if (section.owners) {
+            for (const c of changed) u32[i++] = section.owners[c];
+        }
+        for (const c of changed) {
+            for (const v of section.rows[c]) f32[i++] = v;
+        }
+    });
+    return buffer;
+};
+
+// A keyframe when starting or asked to, otherwise a delta, followed every
+// KEYFRAME_INTERVAL frames by a keyframe the server checks its mirror against
+const encodeDelta = (state, dead) => {
+    const sections = deltaSections(state);
+    const full = sections.map((section) => diffSection(section, null));
+    delta_seq++;
+    let messages = null;
+    if (delta_sent && !keyframe_requested) {
+        const diffs = sections.map((section, k) => diffSection(section, delta_sent[k]));
+        // When most entities moved the keyframe is the smaller message
+        if (deltaBytes(sections, diffs) < deltaBytes(sections, full)) {
+            messages = [packDelta(state, dead, sections, diffs, false)];
+            if (delta_seq % KEYFRAME_INTERVAL === 0) {
+                messages.push(packDelta(state, dead, sections, full, true));
+            }
+        }
+    }
+    keyframe_requested = false;
+    delta_sent = full.map((diff) => diff.current);
+    return messages || [packDelta(state, dead, sections, full, true)];
+};
+
 // --- Game State Variables ---
 let frame = 0;
 let sent_death = false;
@@ -59,30 +311,70 @@ let marked_dead_slithers = [];
 // --- Utility Functions ---
 const calculateDistance = (x1, y1, x2, y2) => Math.sqrt(Math.pow(x2 - x1, 2) + Math.pow(y2 - y1, 2));
 
+const byDist = (a, b) => a.dist - b.dist;
+
+// Keeps the k items with the smallest `dist`, nearest first. Quickselect
+// moves them to the front in linear time on average, so only those k are
+// sorted instead of every item.
+const selectNearest = (items, k) => {
+    if (k < items.length) {
+        const target = k - 1;
+        let left = 0;
+        let right = items.length - 1;
+        while (left < right) {
+            const pivot = items[(left + right) >> 1].dist;
+            let i = left;
+            let j = right;
+            while (i <= j) {
+                while (items[i].dist < pivot) i++;
+                while (items[j].dist > pivot) j--;
+                if (i <= j) {
+                    const item = items[i];
+                    items[i++] = items[j];
+                    items[j--] = item;
+                }
+            }
+            // items[left..j] <= pivot <= items[i..right]
+            if (target <= j) right = j;
+            else if (target >= i) left = i;
+            else break;
+        }
+        items.length = Math.max(k, 0);
+    }
+    return items.sort(byDist);
+};
+
 // Process the top N closest body parts across all snakes
-const processTopBodyParts = (slithers, referenceX, referenceY, topN = 100) => {
+const processTopBodyParts = (slithers, referenceX, referenceY, topN = 100, maxDistance = Infinity) => {
     let allParts = [];
+    const maxSquared = maxDistance * maxDistance;
 
     slithers.forEach((o_slither) => {
         if (o_slither.id === slither.id) return;
         o_slither.gptz.forEach((part) => {
-            const dist = calculateDistance(part.xx, part.yy, referenceX, referenceY);
-            allParts.push({ x: part.xx, y: part.yy, dist, size: o_slither.size });
+            const dx = part.xx - referenceX;
+            const dy = part.yy - referenceY;
+            const squared = dx * dx + dy * dy;
+            if (squared < maxSquared) {
+                allParts.push({ part, dist: squared, size: o_slither.size });
+            }
         });
     });
 
-    // Sort parts by distance and select the top N
-    allParts.sort((a, b) => a.dist - b.dist);
-    return allParts.slice(0, topN);
+    // Select the top N by squared distance, then build only their entries
+    return selectNearest(allParts, topN).map(({ part, dist, size }) => (
+        { id: entityId(part), x: part.xx, y: part.yy, dist: Math.sqrt(dist), size }
+    ));
 };
 
 // Process food locations
-const processFood = (foods, referenceX, referenceY, maxDistance = 1000) => {
+const processFood = (foods, referenceX, referenceY, maxDistance = 1000, maxCount = Infinity) => {
     food_locations = [];
     for (let i = 0; i < foods_c; i++) {
         const dist = Math.sqrt(Math.pow(foods[i].xx - referenceX, 2) + Math.pow(foods[i].yy - referenceY, 2));
         if (dist < maxDistance) {
             food_locations.push({
+                id: entityId(foods[i]),
                 x: foods[i].xx,
                 y: foods[i].yy,
                 value: foods[i].gr,
@@ -90,28 +382,30 @@ const processFood = (foods, referenceX, referenceY, maxDistance = 1000) => {
             });
         }
     }
-    return food_locations;
+    return maxCount < food_locations.length ? selectNearest(food_locations, maxCount) : food_locations;
 };
 
 // Process preys
-const processPreys = (preys, referenceX, referenceY, maxDistance = 1000) => {
+const processPreys = (preys, referenceX, referenceY, maxDistance = 1000, maxCount = Infinity) => {
     preys_locations = [];
     for (let i = 0; i < preys.length; i++) {
         const dist = calculateDistance(preys[i].xx, preys[i].yy, referenceX, referenceY);
         if (dist < maxDistance) {
-            preys_locations.push({ x: preys[i].xx, y: preys[i].yy, dist });
+            preys_locations.push({ id: entityId(preys[i]), x: preys[i].xx, y: preys[i].yy, dist });
         }
     }
-    return preys_locations;
+    return maxCount < preys_locations.length ? selectNearest(preys_locations, maxCount) : preys_locations;
 };
 
-// Process other slithers
-const processOtherSlithers = (slithers, currentSnakeId, referenceX, referenceY, maxDistance = 1000) => {
+// Process other slithers, keeping the nearest maxSlithers heads and the
+// nearest maxParts of their parts in total
+const processOtherSlithers = (slithers, currentSnakeId, referenceX, referenceY, maxDistance = 1000,
+                              maxSlithers = Infinity, maxParts = Infinity) => {
     // Decrement TTL for each marked dead slither
     marked_dead_slithers.forEach((item) => item.ttl -= 1);
     marked_dead_slithers = marked_dead_slithers.filter((item) => item.ttl > 0);
 
-    return slithers
+    let nearby = slithers
         .filter((slither) => slither.id !== currentSnakeId)
         .map((other_slither) => {
             if (marked_dead_slithers.some((item) => item.id === other_slither.id && item.ttl > 0)) {
@@ -121,27 +415,51 @@ const processOtherSlithers = (slithers, currentSnakeId, referenceX, referenceY,
                 marked_dead_slithers.push({ id: other_slither.id, ttl: 60 });
             }
             const dist = calculateDistance(other_slither.xx, other_slither.yy, referenceX, referenceY);
-            if (dist < maxDistance) {
-                parts = other_slither.gptz.map((part) => ({
-                    x: part.xx,
-                    y: part.yy,
-                    dist: calculateDistance(part.xx, part.yy, referenceX, referenceY)
-                }));
-                var sct = other_slither.sct + other_slither.rsc;
-                let score = Math.floor((fpsls[sct] + other_slither.fam / fmlts[sct] - 1) * 15 - 5) / 1;
-                return {
-                    x: other_slither.xx,
-                    y: other_slither.yy,
-                    ang: other_slither.ang,
-                    parts,
-                    size: score,
-                    dist,
-                    dead: other_slither.dead,
-                };
-            }
-            return null;
+            return dist < maxDistance ? { other_slither, dist } : null;
         })
-        .filter((slither) => slither !== null);
+        .filter((item) => item !== null);
+    if (maxSlithers < nearby.length) nearby = selectNearest(nearby, maxSlithers);
+
+    const others = nearby.map(({ other_slither, dist }) => {
+        var sct = other_slither.sct + other_slither.rsc;
+        let score = Math.floor((fpsls[sct] + other_slither.fam / fmlts[sct] - 1) * 15 - 5) / 1;
+        return {
+            id: entityId(other_slither),
+            x: other_slither.xx,
+            y: other_slither.yy,
+            ang: other_slither.ang,
+            parts: [],
+            size: score,
+            dist,
+            dead: other_slither.dead,
+        };
+    });
+    if (maxParts === Infinity) {
+        nearby.forEach(({ other_slither }, k) => {
+            others[k].parts = other_slither.gptz.map((part) => ({
+                id: entityId(part),
+                x: part.xx,
+                y: part.yy,
+                dist: calculateDistance(part.xx, part.yy, referenceX, referenceY)
+            }));
+        });
+        return others;
+    }
+
+    // Select across every slither by squared distance, then hand the
+    // survivors back to their owners
+    const candidates = [];
+    nearby.forEach(({ other_slither }, owner) => {
+        for (const part of other_slither.gptz) {
+            const dx = part.xx - referenceX;
+            const dy = part.yy - referenceY;
+            candidates.push({ part, owner, dist: dx * dx + dy * dy });
+        }
+    });
+    for (const { part, owner, dist } of selectNearest(candidates, maxParts)) {
+        others[owner].parts.push({ id: entityId(part), x: part.xx, y: part.yy, dist: Math.sqrt(dist) });
+    }
+    return others;
 };
 
 const processClosestEnemyByPartsToHead = (slithers, referenceX, referenceY, maxDistance = 2000) => {
@@ -183,7 +501,7 @@ const hk_redraw = () => {
     last_yy = slither.yy;
 
     if (inferred_death && !sent_death) {
-        window.sendMessage('update', { dead: true, ...last_state });
+        window.sendState(last_state, true);
         sent_death = true;
         inferred_death = false;
         last_size = 11;
@@ -193,10 +511,11 @@ const hk_redraw = () => {
     }
 
     // Update game state
-    if (++frame % 10 === 0) {
+    if (++frame >= client_config.send_every) {
         frame = 0;
 
-        parts = slither.gptz.map((part) => ({
+        const parts = slither.gptz.map((part) => ({
+            id: entityId(part),
             x: part.xx,
             y: part.yy,
             dist: calculateDistance(part.xx, part.yy, slither.xx, slither.yy),
@@ -217,21 +536,34 @@ const hk_redraw = () => {
         food_eaten = score - last_size;
         last_size = score;
 
-        const other_slithers = processOtherSlithers(slithers, slither.id, slither.xx, slither.yy, 2000);
-        const food_locations = processFood(foods, slither.xx, slither.yy);
-        const preys_locations = processPreys(preys, slither.xx, slither.yy);
-
-        // Get top 100 closest body parts
-        const top_body_parts = processTopBodyParts(slithers, slither.xx, slither.yy, 200);
-
-        const target_slither = processClosestEnemyByPartsToHead(slithers, slither.xx, slither.yy, 200);
-        const target_slither_details = {
-            x: target_slither.xx,
-            y: target_slither.yy,
-            parts: target_slither.gptz,
-            ang: target_slither.ang,
-            size: target_slither.size,
-        };
+        // Sections the server does not read are sent empty, without computing them
+        const other_slithers = wants('others')
+            ? processOtherSlithers(slithers, slither.id, slither.xx, slither.yy, viewRadius(2000),
+                cap('others'), cap('other_parts'))
+            : [];
+        const food_locations = wants('foods')
+            ? processFood(foods, slither.xx, slither.yy, viewRadius(1000), cap('foods'))
+            : [];
+        const preys_locations = wants('preys')
+            ? processPreys(preys, slither.xx, slither.yy, viewRadius(1000), cap('preys'))
+            : [];
+
+        // Get the closest body parts, 200 unless the server caps them
+        const top_body_parts = wants('top_body_parts')
+            ? processTopBodyParts(slithers, slither.xx, slither.yy, cap('top_body_parts', 200), viewRadius(Infinity))
+            : [];
+
+        let target_slither_details = {};
+        if (wants('target_slither')) {
+            const target_slither = processClosestEnemyByPartsToHead(slithers, slither.xx, slither.yy, 200);
+            target_slither_details = {
+                x: target_slither.xx,
+                y: target_slither.yy,
+                parts: target_slither.gptz,
+                ang: target_slither.ang,
+                size: target_slither.size,
+            };
+        }
 
         const gameState = {
             slither: slither_details,
@@ -242,7 +574,7 @@ const hk_redraw = () => {
             top_body_parts, // Add top 100 closest body parts
         };
 
-        window.sendMessage('update', gameState);
+        window.sendState(gameState, false);
         last_state = gameState;
     }
 
@@ -1,59 +1,219 @@
 import argparse
 import asyncio
-from slither_env import GameConnection, SlitherEnv
+import itertools
+import time
+from slither_env import GRID, OBSERVATIONS, ClientPool, GameConnection, SlitherEnv, is_terminal
 from websocket_server import start_server
-from renderer import render
-from stable_baselines3 import PPO
+import metrics
+from metrics import METRICS
+from protocol import WorldMirror, control, decode_message, handshake, keyframe_request
+from recording import TraceRecorder
+from inference import DecisionInterval, ExportedPolicy, InferenceScheduler
+from state_buffer import LATEST
+from utils import add_client_arguments, client_settings
 from websockets.asyncio.server import ServerProtocol
 
 import json
 import websockets
 
 GRID_SIZE = 128
+# Grid size per level for models trained with --levels, as in train.py
+FOVEA_GRID_SIZE = 32
+EXPORT_SUFFIXES = (".pt", ".onnx")
 
 
-async def handle_client(websocket: ServerProtocol, connection: GameConnection, model: PPO, env: SlitherEnv):
+async def handle_client(websocket: ServerProtocol, connection: GameConnection, scheduler: InferenceScheduler,
+                        settings=None, interval_options=None):
     print(f"Client connected from {websocket.remote_address}")
+    # Server-side copy of the client's world for delta-v1 clients
+    mirror = WorldMirror()
+    # Which states the policy acts on; see DecisionInterval
+    interval = DecisionInterval(**(interval_options or {}))
+    # The decision being computed, if any. States keep being received
+    # meanwhile, so actions are never computed for states that went stale
+    # in the socket
+    pending = None
+
+    async def act(payload):
+        started = time.perf_counter()
+        try:
+            with METRICS.timer("predict"):
+                action = await scheduler.predict(payload)
+        except Exception as e:
+            # E.g. a broken hot-reloaded policy: keep serving, and act on
+            # the next state instead of waiting out the interval
+            print(f"Prediction failed for {websocket.remote_address}: {e!r}")
+            METRICS.count("predict_errors")
+            interval.restart()
+            return
+        interval.decided(time.perf_counter() - started)
+        connection.set_action(action)
+
+        accelerate = 1 if action[2] > 0.9 else 0
+
+        action_message = {
+            "type": "update",
+            "payload": {
+                "xt": float(action[0]),
+                "yt": float(action[1]),
+                "acceleration": accelerate
+            }
+        }
+        with METRICS.timer("send"):
+            try:
+                await websocket.send(json.dumps(action_message))
+            except websockets.exceptions.ConnectionClosed:
+                pass
+
     try:
         while True:
-            message = await websocket.recv()
-            data = json.loads(message)
-            if data["type"] == "update":
-                payload = data["payload"]
-                connection.put_state(payload)
-                obs = env.encode_state(connection.latest_state)
-                action, _ = model.predict(obs, deterministic=False)
-
-                accelerate = 1 if action[2] > 0.9 else 0
-
-                action_message = {
-                    "type": "update",
-                    "payload": {
-                        "xt": float(action[0]),
-                        "yt": float(action[1]),
-                        "acceleration": accelerate
-                    }
-                }
-                await websocket.send(json.dumps(action_message))
+            with METRICS.timer("recv_wait"):
+                message = await websocket.recv()
+            with METRICS.timer("decode"):
+                kind, payload = decode_message(message, mirror)
+            METRICS.count("messages")
+            if kind == "init":
+                await websocket.send(json.dumps(handshake(payload)))
+                if settings:
+                    await websocket.send(json.dumps(control(**settings)))
+            elif kind == "resync":
+                await websocket.send(json.dumps(keyframe_request()))
+            elif kind == "update":
+                with METRICS.timer("put_state"):
+                    await connection.put_state_async(payload)
+                if is_terminal(payload):
+                    # Act on the first state of the next life
+                    interval.restart()
+                    continue
+                if not interval.arrive(busy=pending is not None and not pending.done()):
+                    # No encode or forward pass; the client keeps its last action
+                    METRICS.count("repeated_states")
+                    continue
+                pending = asyncio.create_task(act(payload))
     except websockets.exceptions.ConnectionClosed:
-        print("Client disconnected")
+        print(f"Client disconnected after {interval.decisions} decisions and {interval.repeats} repeated states "
+              f"(decision interval {interval.k})")
+    finally:
+        if pending is not None:
+            pending.cancel()
+
 
+def load_policy(model_path: str, env: SlitherEnv):
+    """
+    Batched obs -> actions callable. Artifacts from export.py are served
+    without importing stable-baselines3.
+    """
+    if model_path.endswith(EXPORT_SUFFIXES):
+        return ExportedPolicy(model_path)
+
+    from stable_baselines3 import PPO
 
-async def main_async(model_path: str):
-    connection = GameConnection()
-    env = SlitherEnv(connection=connection, grid_size=GRID_SIZE)
     model = PPO.load(model_path, env=env, verbose=1)
+
+    def policy(obs):
+        actions, _ = model.predict(obs, deterministic=False)
+        return actions
+    return policy
+
+
+async def main_async(
+    model_path: str,
+    record: str = None,
+    max_clients: int = 8,
+    max_batch_size: int = 16,
+    max_wait_ms: float = 5.0,
+    stats_interval: float = 10.0,
+    levels: int = 1,
+    headless: bool = False,
+    watch: bool = False,
+    watch_interval: float = 2.0,
+    observation: str = GRID,
+    send_every: int = None,
+    view_radius: float = None,
+    client_fields: list = None,
+    decision_interval: int = 1,
+    adaptive_interval: bool = False,
+    max_decision_interval: int = 8,
+):
+    recorder_factory = None
+    if record:
+        # One trace per client session: <record>.0, <record>.1, ...
+        sessions = itertools.count()
+        recorder_factory = lambda: TraceRecorder(f"{record}.{next(sessions)}")
+    # Actions come from the scheduler and nothing consumes the state buffers,
+    # so keep only the newest state per client
+    pool = ClientPool(max_clients, recorder_factory=recorder_factory, policy=LATEST)
+    grid_size = GRID_SIZE if levels == 1 else FOVEA_GRID_SIZE
+    env = SlitherEnv(connection=pool, grid_size=grid_size, levels=levels, observation=observation)
+    policy = load_policy(model_path, env)
+
+    viewer = None
+    if not headless:
+        from renderer import Renderer
+
+        viewer = Renderer().start()
+    scheduler = InferenceScheduler(
+        env.encode_state, policy, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms,
+        viewer=viewer)
+    tasks = [
+        start_server(pool, handle_client=handle_client, scheduler=scheduler,
+                     settings=client_settings(observation, send_every, view_radius, client_fields),
+                     interval_options=dict(k=decision_interval, adaptive=adaptive_interval,
+                                           max_k=max_decision_interval)),
+        scheduler.run(),
+        scheduler.report(stats_interval),
+    ]
+    if watch:
+        # Pick up new checkpoints or exports without dropping clients
+        tasks.append(scheduler.watch(model_path, lambda path: load_policy(path, env), watch_interval))
     # Start the WebSocket server and handle client connections
-    await asyncio.gather(
-        start_server(connection, handle_client=handle_client, model=model, env=env),
-        render(connection, env)
-    )
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        scheduler.close()
+        if viewer is not None:
+            viewer.close()
+        pool.close()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Load a model and start the server.")
     parser.add_argument("model_path", type=str,
-                        help="Path to the model file to load.")
+                        help="Path to the SB3 model, or a .pt/.onnx policy from export.py.")
+    parser.add_argument("--record", type=str, default=None, metavar="PATH",
+                        help="Record each client session's states and actions to PATH.<n>.")
+    parser.add_argument("--max-clients", type=int, default=8,
+                        help="Maximum number of game clients served at once.")
+    parser.add_argument("--max-batch-size", type=int, default=16,
+                        help="Largest number of observations evaluated in one forward pass.")
+    parser.add_argument("--max-wait-ms", type=float, default=5.0,
+                        help="Longest an observation waits for its batch to fill.")
+    parser.add_argument("--stats-interval", type=float, default=10.0,
+                        help="Seconds between action latency reports.")
+    parser.add_argument("--levels", type=int, default=1,
+                        help="Concentric observation grids the model was trained with.")
+    parser.add_argument("--observation", choices=OBSERVATIONS, default=GRID,
+                        help="Observation mode the model was trained with.")
+    parser.add_argument("--headless", action="store_true",
+                        help="Serve without the observation window; pygame is never loaded.")
+    parser.add_argument("--watch", action="store_true",
+                        help="Reload the model whenever its file changes, without restarting.")
+    parser.add_argument("--watch-interval", type=float, default=2.0,
+                        help="Seconds between checks of the model file with --watch.")
+    parser.add_argument("--decision-interval", type=int, default=1, metavar="K",
+                        help="Act on every K-th state of a client; it keeps its last action in between.")
+    parser.add_argument("--adaptive-interval", action="store_true",
+                        help="Adapt each client's decision interval to its inference latency.")
+    parser.add_argument("--max-decision-interval", type=int, default=8, metavar="K",
+                        help="Largest decision interval --adaptive-interval may pick.")
+    add_client_arguments(parser)
+    metrics.add_arguments(parser)
     args = parser.parse_args()
+    metrics.configure(args.metrics_port, args.metrics_dump, args.metrics_interval)
 
-    asyncio.run(main_async(args.model_path))
+    asyncio.run(main_async(
+        args.model_path, args.record, args.max_clients,
+        args.max_batch_size, args.max_wait_ms, args.stats_interval, args.levels,
+        args.headless, args.watch, args.watch_interval,
+        args.observation, args.send_every, args.view_radius, args.client_fields,
+        args.decision_interval, args.adaptive_interval, args.max_decision_interval))
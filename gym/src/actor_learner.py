@@ -0,0 +1,175 @@
+import copy
+import numpy as np
+import torch as th
+from concurrent.futures import ThreadPoolExecutor
+from gymnasium import spaces
+from stable_baselines3 import PPO
+from stable_baselines3.common.utils import obs_as_tensor
+
+
+class OverlappedPPO(PPO):
+    """
+    PPO with rollout collection and optimization running side by side.
+
+    An actor thread keeps stepping the env with a snapshot of the policy
+    and fills the next rollout buffer, while the learner runs its gradient
+    epochs on the buffer collected before it. When an update finishes the
+    new weights are loaded into a spare snapshot, and the actor switches to
+    it between two env steps by a single reference swap. The actor never
+    acts with a half-written policy, and the game never waits for the
+    optimizer unless an update takes longer than a whole rollout.
+
+    Each rollout stores the log-probs and values of whichever snapshot took
+    each action, so PPO's clipped ratio accounts for the data being up to
+    one update old.
+    """
+
+    def _setup_model(self):
+        super()._setup_model()
+        # The learner trains on self.rollout_buffer while the actor fills this one
+        self._next_buffer = self.rollout_buffer_class(
+            self.n_steps,
+            self.observation_space,
+            self.action_space,
+            device=self.device,
+            gamma=self.gamma,
+            gae_lambda=self.gae_lambda,
+            n_envs=self.n_envs,
+            **self.rollout_buffer_kwargs,
+        )
+        # Two snapshots: the one the actor is using and the one to load next
+        self._snapshots = [copy.deepcopy(self.policy) for _ in range(2)]
+        for snapshot in self._snapshots:
+            snapshot.set_training_mode(False)
+            snapshot.requires_grad_(False)
+        self._actor_policy = self._snapshots[0]
+        self._publish()
+        self.weight_swaps = 0
+
+    def _excluded_save_params(self):
+        return super()._excluded_save_params() + ["_next_buffer", "_snapshots", "_actor_policy"]
+
+    def _publish(self):
+        """
+        Copies the learner's weights into the idle snapshot and hands it to
+        the actor. Only called once per actor rollout, so the idle snapshot
+        is never the one the actor is still using.
+
+        The snapshot's optimizer is never stepped, but it gets a copy of the
+        learner's optimizer state too, so that checkpoints taken from the
+        snapshot resume with the Adam moments that go with its weights.
+        """
+        idle = self._snapshots[1] if self._actor_policy is self._snapshots[0] else self._snapshots[0]
+        idle.load_state_dict(self.policy.state_dict())
+        # load_state_dict keeps the tensors it is given, and the learner
+        # updates its own in place
+        idle.optimizer.load_state_dict(copy.deepcopy(self.policy.optimizer.state_dict()))
+        self._actor_policy = idle
+
+    def learn(
+        self,
+        total_timesteps,
+        callback=None,
+        log_interval=1,
+        tb_log_name="OverlappedPPO",
+        reset_num_timesteps=True,
+        progress_bar=False,
+    ):
+        total_timesteps, callback = self._setup_learn(
+            total_timesteps, callback, reset_num_timesteps, tb_log_name, progress_bar)
+        callback.on_training_start(locals(), globals())
+        # Weights may have changed since setup, e.g. through load()
+        self._publish()
+
+        # The first rollout has no update to overlap with
+        continue_training = self.collect_rollouts(self.env, callback, self.rollout_buffer, self.n_steps)
+        iteration = 0
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="actor") as actor:
+            while continue_training:
+                iteration += 1
+                self._update_current_progress_remaining(self.num_timesteps, total_timesteps)
+                if log_interval is not None and iteration % log_interval == 0:
+                    self.dump_logs(iteration)
+
+                rollout = None
+                if self.num_timesteps < total_timesteps:
+                    rollout = actor.submit(
+                        self.collect_rollouts, self.env, callback, self._next_buffer, self.n_steps)
+                self.train()
+                self._publish()
+                self.weight_swaps += 1
+                if rollout is None:
+                    break
+                continue_training = rollout.result()
+                self.rollout_buffer, self._next_buffer = self._next_buffer, self.rollout_buffer
+
+        callback.on_training_end()
+        return self
+
+    def collect_rollouts(self, env, callback, rollout_buffer, n_rollout_steps):
+        """
+        OnPolicyAlgorithm.collect_rollouts, acting with the latest snapshot
+        instead of the policy being trained.
+        """
+        assert self._last_obs is not None, "No previous observation was provided"
+        n_steps = 0
+        rollout_buffer.reset()
+        if self.use_sde:
+            self._actor_policy.reset_noise(env.num_envs)
+
+        callback.on_rollout_start()
+
+        while n_steps < n_rollout_steps:
+            # Picks up new weights between steps, never during one
+            policy = self._actor_policy
+            if self.use_sde and self.sde_sample_freq > 0 and n_steps % self.sde_sample_freq == 0:
+                policy.reset_noise(env.num_envs)
+
+            with th.no_grad():
+                obs_tensor = obs_as_tensor(self._last_obs, self.device)
+                actions, values, log_probs = policy(obs_tensor)
+            actions = actions.cpu().numpy()
+
+            clipped_actions = actions
+            if isinstance(self.action_space, spaces.Box):
+                if policy.squash_output:
+                    clipped_actions = policy.unscale_action(clipped_actions)
+                else:
+                    clipped_actions = np.clip(actions, self.action_space.low, self.action_space.high)
+
+            new_obs, rewards, dones, infos = env.step(clipped_actions)
+            self.num_timesteps += env.num_envs
+
+            callback.update_locals(locals())
+            if not callback.on_step():
+                return False
+
+            self._update_info_buffer(infos, dones)
+            n_steps += 1
+
+            if isinstance(self.action_space, spaces.Discrete):
+                actions = actions.reshape(-1, 1)
+
+            # Bootstrap truncated episodes with the value function
+            for idx, done in enumerate(dones):
+                if (
+                    done
+                    and infos[idx].get("terminal_observation") is not None
+                    and infos[idx].get("TimeLimit.truncated", False)
+                ):
+                    terminal_obs = policy.obs_to_tensor(infos[idx]["terminal_observation"])[0]
+                    with th.no_grad():
+                        terminal_value = policy.predict_values(terminal_obs)[0]
+                    rewards[idx] += self.gamma * terminal_value
+
+            rollout_buffer.add(self._last_obs, actions, rewards, self._last_episode_starts, values, log_probs)
+            self._last_obs = new_obs
+            self._last_episode_starts = dones
+
+        with th.no_grad():
+            values = self._actor_policy.predict_values(obs_as_tensor(new_obs, self.device))
+        rollout_buffer.compute_returns_and_advantage(last_values=values, dones=dones)
+
+        callback.update_locals(locals())
+        callback.on_rollout_end()
+        return True
@@ -0,0 +1,389 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+import websockets
+
+from encoder import FrameArrays
+from protocol import decode_message, pack_state
+from simulator import synthetic_payload
+from slither_env import ENTITIES, GameConnection, SlitherEnv
+
+GRID_SIZES = (50, 128, 256)
+VIEW_RANGE = 2000
+
+
+# -----------------------------------------------------------------------------
+# Synthetic payloads
+# -----------------------------------------------------------------------------
+def synthetic_messages(rng, count, **kwargs):
+    """
+    (json_text, binary) message pairs for the same payloads.
+    """
+    messages = []
+    for _ in range(count):
+        payload = synthetic_payload(rng, **kwargs)
+        text = json.dumps({"type": "update", "payload": payload})
+        messages.append((text, pack_state(FrameArrays.from_state(payload))))
+    return messages
+
+
+# -----------------------------------------------------------------------------
+# Measurement
+# -----------------------------------------------------------------------------
+def measure(fn, inputs, repeat, warmup=3):
+    """
+    Calls fn on each input `repeat` times in total (cycling through inputs)
+    and returns per-call latencies in seconds plus the peak traced memory.
+    Memory is traced in a separate pass since tracemalloc skews timings.
+    """
+    for i in range(warmup):
+        fn(inputs[i % len(inputs)])
+    latencies = np.empty(repeat)
+    for i in range(repeat):
+        x = inputs[i % len(inputs)]
+        t0 = time.perf_counter()
+        fn(x)
+        latencies[i] = time.perf_counter() - t0
+    tracemalloc.start()
+    for x in inputs[:warmup]:
+        fn(x)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return latencies, peak
+
+
+def summarize(stage, grid_size, latencies, peak_bytes, items_per_call=1, stored_bytes=None):
+    ms = latencies * 1e3
+    return {
+        "stage": stage,
+        "grid_size": grid_size,
+        "n": int(len(latencies)),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p90_ms": float(np.percentile(ms, 90)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "throughput_per_s": float(items_per_call * len(latencies) / latencies.sum()),
+        "peak_mem_mb": peak_bytes / 2**20,
+        "stored_mb": None if stored_bytes is None else stored_bytes / 2**20,
+    }
+
+
+# -----------------------------------------------------------------------------
+# Stages
+# -----------------------------------------------------------------------------
+def bench_protocol(messages, repeat):
+    results = []
+    texts = [text for text, _ in messages]
+    binaries = [binary for _, binary in messages]
+    for stage, inputs in (("decode_json", texts), ("decode_binary", binaries)):
+        latencies, peak = measure(decode_message, inputs, repeat)
+        results.append(summarize(stage, None, latencies, peak))
+    return results
+
+
+def bench_env(messages, grid_size, repeat, loop_repeat):
+    env = SlitherEnv(connection=GameConnection(), grid_size=grid_size, view_range=VIEW_RANGE)
+    payloads = [json.loads(text)["payload"] for text, _ in messages]
+    frames = [decode_message(binary)[1] for _, binary in messages]
+    results = []
+    stages = (
+        ("encode_state_loop", env._encode_state_loop, payloads, loop_repeat),
+        ("encode_state_json", env.encode_state, payloads, repeat),
+        ("encode_state_binary", env.encode_state, frames, repeat),
+        ("calc_reward_json", env.calc_reward, payloads, repeat),
+        ("calc_reward_binary", env.calc_reward, frames, repeat),
+    )
+    for stage, fn, inputs, n in stages:
+        latencies, peak = measure(fn, inputs, n)
+        results.append(summarize(stage, grid_size, latencies, peak))
+    return results
+
+
+def patch_size_for(grid_size):
+    for patch in (8, 10, 16):
+        if grid_size % patch == 0:
+            return patch
+    return grid_size
+
+
+def bench_model(messages, grid_size, repeat, batch_sizes=(1, 32)):
+    import torch
+    from model import SparseViTExtractor, ViTExtractor
+
+    env = SlitherEnv(connection=GameConnection(), grid_size=grid_size, view_range=VIEW_RANGE)
+    frames = [decode_message(binary)[1] for _, binary in messages]
+    encoded = torch.from_numpy(np.stack([env.encode_state(frame) for frame in frames]))
+    results = []
+    for name, cls in (("vit", ViTExtractor), ("sparse_vit", SparseViTExtractor)):
+        extractor = cls(env.observation_space, patch_size=patch_size_for(grid_size)).eval()
+        for batch in batch_sizes:
+            obs = encoded.repeat((batch + len(encoded) - 1) // len(encoded), 1, 1, 1)[:batch]
+            with torch.no_grad():
+                latencies, peak = measure(extractor, [obs], repeat)
+            results.append(summarize(f"{name}_forward_b{batch}", grid_size, latencies, peak, batch))
+    return results
+
+
+def bench_train_step(messages, grid_size, repeat, batch_size=32, compile=False):
+    """
+    One PPO minibatch update of a ViT policy (evaluate_actions, loss,
+    backward, Adam step), eager and with the fast paths of set_fast_path.
+    """
+    import torch
+    from stable_baselines3.common.policies import ActorCriticCnnPolicy
+    from model import ViTExtractor, set_fast_path
+
+    env = SlitherEnv(connection=GameConnection(), grid_size=grid_size, view_range=VIEW_RANGE)
+    frames = [decode_message(binary)[1] for _, binary in messages]
+    encoded = torch.from_numpy(np.stack([env.encode_state(frame) for frame in frames]))
+    obs = encoded.repeat((batch_size + len(encoded) - 1) // len(encoded), 1, 1, 1)[:batch_size]
+    actions = torch.from_numpy(np.stack([env.action_space.sample() for _ in range(batch_size)]))
+    variants = [
+        ("eager", {}),
+        ("fused", dict(fused_attention=True)),
+        ("fused_bf16", dict(fused_attention=True, bf16=True)),
+    ]
+    if compile:
+        variants.append(("fused_compiled", dict(fused_attention=True, compile=True)))
+
+    results = []
+    for name, fast_path in variants:
+        torch.manual_seed(0)
+        policy = ActorCriticCnnPolicy(
+            env.observation_space, env.action_space, lambda _: 1e-3, features_extractor_class=ViTExtractor,
+            features_extractor_kwargs=dict(patch_size=patch_size_for(grid_size), num_heads=4))
+        if fast_path:
+            set_fast_path(policy, **fast_path)
+
+        def step(x):
+            values, log_prob, entropy = policy.evaluate_actions(x, actions)
+            loss = -log_prob.mean() + values.pow(2).mean() - 0.01 * entropy.mean()
+            policy.optimizer.zero_grad()
+            loss.backward()
+            policy.optimizer.step()
+
+        latencies, peak = measure(step, [obs], repeat)
+        results.append(summarize(f"vit_train_step_{name}", grid_size, latencies, peak, batch_size))
+    return results
+
+
+def bench_entities(messages, repeat, include_model=True, batch_sizes=(1, 32)):
+    """
+    The entity-table observation and its extractor; no grid involved.
+    """
+    env = SlitherEnv(connection=GameConnection(), view_range=VIEW_RANGE, observation=ENTITIES)
+    frames = [decode_message(binary)[1] for _, binary in messages]
+    latencies, peak = measure(env.encode_state, frames, repeat)
+    results = [summarize("encode_entities_binary", None, latencies, peak)]
+    if not include_model:
+        return results
+
+    import torch
+    from model import EntityAttentionExtractor
+
+    encoded = torch.from_numpy(np.stack([env.encode_state(frame) for frame in frames]))
+    extractor = EntityAttentionExtractor(env.observation_space).eval()
+    for batch in batch_sizes:
+        obs = encoded.repeat((batch + len(encoded) - 1) // len(encoded), 1, 1)[:batch]
+        with torch.no_grad():
+            latencies, peak = measure(extractor, [obs], max(5, repeat // 10))
+        results.append(summarize(f"entity_forward_b{batch}", None, latencies, peak, batch))
+    return results
+
+
+def bench_rollout(messages, grid_size, repeat, n_steps=64, n_envs=4, batch_size=32):
+    """
+    Filling a rollout buffer and sampling minibatches from it, per
+    observation storage, with the memory the stored observations take.
+    """
+    import torch
+    from gymnasium import spaces
+    from rollout_buffer import STORAGES, CompactRolloutBuffer
+
+    env = SlitherEnv(connection=GameConnection(), grid_size=grid_size, view_range=VIEW_RANGE)
+    frames = [decode_message(binary)[1] for _, binary in messages]
+    encoded = np.stack([env.encode_state(frame) for frame in frames])
+    batches = [encoded[np.arange(i, i + n_envs) % len(encoded)] for i in range(len(encoded))]
+    action_space = spaces.Box(-1, 1, (3,), dtype=np.float32)
+    actions, zeros = np.zeros((n_envs, 3), dtype=np.float32), np.zeros(n_envs, dtype=np.float32)
+    tensor = torch.zeros(n_envs)
+    results = []
+    for storage in STORAGES:
+        buffer = CompactRolloutBuffer(
+            n_steps, env.observation_space, action_space, device="cpu", n_envs=n_envs, storage=storage)
+
+        def add(obs):
+            if buffer.full:
+                buffer.reset()
+            buffer.add(obs, actions, zeros, zeros, tensor, tensor)
+
+        latencies, peak = measure(add, batches, max(repeat, n_steps))
+        buffer.reset()
+        for i in range(n_steps):
+            add(batches[i % len(batches)])
+        stored = buffer.observation_nbytes()
+        results.append(summarize(f"rollout_add_{storage}", grid_size, latencies, peak, n_envs, stored))
+        buffer.compute_returns_and_advantage(tensor, zeros)
+        samples = list(buffer.get(batch_size))
+        latencies, peak = measure(lambda _: list(buffer.get(batch_size)), [None], max(5, repeat // 20))
+        results.append(summarize(
+            f"rollout_get_{storage}", grid_size, latencies, peak, len(samples) * batch_size, stored))
+    return results
+
+
+class _FakeSocket:
+    """
+    Just enough of a websockets connection to drive utils.handle_client,
+    recording the time from each recv to the matching send.
+    """
+
+    def __init__(self, messages, count):
+        self.messages = messages
+        self.count = count
+        self.remote_address = ("bench", 0)
+        self.latencies = []
+        self._received = 0
+        self._t0 = None
+
+    async def recv(self):
+        if self._received == self.count:
+            raise websockets.exceptions.ConnectionClosed(None, None)
+        self._received += 1
+        self._t0 = time.perf_counter()
+        return self.messages[self._received % len(self.messages)]
+
+    async def send(self, message):
+        self.latencies.append(time.perf_counter() - self._t0)
+
+
+def bench_handler(messages, repeat):
+    from utils import handle_client
+
+    results = []
+    for stage, inputs in (("handler_json", [t for t, _ in messages]), ("handler_binary", [b for _, b in messages])):
+        socket = _FakeSocket(inputs, repeat)
+        with contextlib.redirect_stdout(io.StringIO()):
+            asyncio.run(handle_client(socket, GameConnection()))
+            tracemalloc.start()
+            asyncio.run(handle_client(_FakeSocket(inputs, 3), GameConnection()))
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        results.append(summarize(stage, None, np.array(socket.latencies), peak))
+    return results
+
+
+def bench_startup(repeat):
+    """
+    Wall time for a fresh interpreter to import each entry point and parse
+    its arguments, which is what a restart of the process pays before
+    loading a model.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    for stage, script in (("startup_serve", "__main__.py"), ("startup_train", "train.py")):
+        command = [sys.executable, os.path.join(here, script), "--help"]
+        latencies = np.empty(repeat)
+        for i in range(repeat):
+            t0 = time.perf_counter()
+            subprocess.run(command, stdout=subprocess.DEVNULL, check=True)
+            latencies[i] = time.perf_counter() - t0
+        results.append(summarize(stage, None, latencies, 0))
+    return results
+
+
+# -----------------------------------------------------------------------------
+# Reporting
+# -----------------------------------------------------------------------------
+def metadata():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    meta = {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": np.__version__,
+    }
+    try:
+        import torch
+        meta["torch"] = torch.__version__
+        meta["torch_threads"] = torch.get_num_threads()
+    except ImportError:
+        pass
+    return meta
+
+
+def print_table(results, baseline=None):
+    base = {(r["stage"], r["grid_size"]): r for r in (baseline or [])}
+    header = f"{'stage':<22}{'grid':>6}{'p50 ms':>10}{'p99 ms':>10}{'ops/s':>12}{'peak MB':>10}{'stored MB':>11}"
+    if baseline:
+        header += f"{'p50 vs base':>13}"
+    print(header)
+    for r in results:
+        grid = "-" if r["grid_size"] is None else r["grid_size"]
+        line = (f"{r['stage']:<22}{grid:>6}{r['p50_ms']:>10.3f}{r['p99_ms']:>10.3f}"
+                f"{r['throughput_per_s']:>12.1f}{r['peak_mem_mb']:>10.2f}")
+        stored = r.get("stored_mb")
+        line += "-".rjust(11) if stored is None else f"{stored:>11.2f}"
+        old = base.get((r["stage"], r["grid_size"]))
+        if old:
+            line += f"{r['p50_ms'] / old['p50_ms']:>12.2f}x"
+        print(line)
+
+
+def run(grid_sizes=GRID_SIZES, repeat=200, seed=0, include_model=True, include_startup=True, compile=False):
+    rng = np.random.default_rng(seed)
+    messages = synthetic_messages(rng, 8)
+    results = bench_startup(max(3, repeat // 40)) if include_startup else []
+    results += bench_protocol(messages, repeat)
+    results += bench_entities(messages, repeat, include_model)
+    results += bench_handler(messages, repeat)
+    for grid_size in grid_sizes:
+        results += bench_env(messages, grid_size, repeat, max(10, repeat // 10))
+        if include_model:
+            results += bench_model(messages, grid_size, max(5, repeat // 10))
+            results += bench_train_step(messages, grid_size, max(5, repeat // 40), compile=compile)
+            results += bench_rollout(messages, grid_size, repeat)
+    return {"meta": metadata(), "results": results}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the observation, reward, inference and handler hot paths.")
+    parser.add_argument("--grid-sizes", type=int, nargs="+", default=list(GRID_SIZES))
+    parser.add_argument("--repeat", type=int, default=200,
+                        help="Timed calls per stage (the loop encoder and model use fewer).")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-model", action="store_true", help="Skip the ViTExtractor stages.")
+    parser.add_argument("--no-startup", action="store_true", help="Skip the process startup stages.")
+    parser.add_argument("--compile", action="store_true",
+                        help="Also time torch.compile'd training steps; compiling takes about a minute.")
+    parser.add_argument("--output", type=str, default=None,
+                        help="Write results as JSON to this path.")
+    parser.add_argument("--compare", type=str, default=None,
+                        help="Earlier JSON results to compare p50 latencies against.")
+    args = parser.parse_args()
+
+    report = run(args.grid_sizes, args.repeat, args.seed, not args.no_model, not args.no_startup,
+                 args.compile)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+    print_table(report["results"], baseline)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,92 @@
+import copy
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from stable_baselines3.common.callbacks import BaseCallback
+from stable_baselines3.common.save_util import save_to_zip_file
+
+
+def snapshot(model):
+    """
+    Everything model.save() writes, copied on the calling thread so it can
+    be written from another one while training carries on.
+    """
+    data = model.__dict__.copy()
+    exclude = set(model._excluded_save_params())
+    state_dicts_names, torch_variable_names = model._get_torch_save_params()
+    for name in state_dicts_names + torch_variable_names:
+        exclude.add(name.split(".")[0])
+    for name in exclude:
+        data.pop(name, None)
+    # E.g. _last_obs, which vec envs may overwrite in place
+    data = {key: value.copy() if isinstance(value, np.ndarray) else value for key, value in data.items()}
+
+    # OverlappedPPO may be optimizing model.policy right now; the snapshot
+    # its actor acts with is never written while it is in use, and carries
+    # the optimizer state of the update that produced its weights
+    policy = getattr(model, "_actor_policy", model.policy)
+    params = copy.deepcopy({"policy": policy.state_dict(), "policy.optimizer": policy.optimizer.state_dict()})
+    return data, params
+
+
+def write(path, data, params):
+    """
+    Writes a model.save()-compatible zip at `path`, atomically: readers see
+    either the previous checkpoint or the new one, never half a file.
+    """
+    tmp = f"{path}.tmp"
+    save_to_zip_file(tmp, data=data, params=params)
+    os.replace(tmp, path)
+
+
+class BackgroundCheckpointCallback(BaseCallback):
+    """
+    Saves the model to `path` every `save_freq` env steps without pausing
+    training. The weights are copied at the end of a rollout, between two
+    updates, and serialized and written by a background thread. If the
+    previous checkpoint is still being written, the next one is skipped.
+
+    The file loads with PPO.load, and serving with --watch picks it up.
+    """
+
+    def __init__(self, path, save_freq, verbose=0):
+        super().__init__(verbose)
+        self.path = path
+        self.save_freq = save_freq
+        self.saved = 0
+        self.skipped = 0
+        self._last_save = 0
+        self._pending = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint")
+
+    def _init_callback(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _on_step(self) -> bool:
+        return True
+
+    def _on_rollout_end(self) -> None:
+        if self.num_timesteps - self._last_save < self.save_freq:
+            return
+        if self._pending is not None and not self._pending.done():
+            self.skipped += 1
+            return
+        self._last_save = self.num_timesteps
+        data, params = snapshot(self.model)
+        self._pending = self._executor.submit(self._write, data, params, self.num_timesteps)
+
+    def _write(self, data, params, steps):
+        try:
+            write(self.path, data, params)
+        except Exception as e:
+            print(f"Could not write checkpoint to {self.path}: {e}")
+            return
+        self.saved += 1
+        if self.verbose:
+            print(f"Checkpoint at {steps} steps written to {self.path}")
+
+    def _on_training_end(self) -> None:
+        # Let the last write land before anything else touches the file
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,351 @@
+import numpy as np
+
+NUM_CHANNELS = 10
+
+# Entity types of encode_entities, in table order
+ENTITY_TYPES = (
+    "food", "own_head", "own_part", "top_part", "target_part",
+    "target_head", "prey", "other_head", "other_part",
+)
+# Rows kept per type, nearest to the head first; 256 rows in total
+ENTITY_CAPACITIES = {
+    "food": 96, "own_head": 1, "own_part": 32, "top_part": 16, "target_part": 16,
+    "target_head": 1, "prey": 8, "other_head": 24, "other_part": 62,
+}
+# Columns of an entity row
+ENTITY_FEATURES = ("x", "y", "size", "angle", "type", "valid")
+
+_EMPTY2 = np.empty((0, 2), dtype=np.float64)
+_EMPTY3 = np.empty((0, 3), dtype=np.float64)
+_EMPTY4 = np.empty((0, 4), dtype=np.float64)
+
+
+def _rows(items, keys, defaults):
+    """
+    Pulls `keys` out of a list of dicts into a (N, len(keys)) float64 array.
+    A default of None means the key is required.
+    """
+    out = np.empty((len(items), len(keys)), dtype=np.float64)
+    # Column at a time: a flat list of floats converts much faster than rows
+    for col, (k, d) in enumerate(zip(keys, defaults)):
+        if d is None:
+            out[:, col] = [item[k] for item in items]
+        else:
+            out[:, col] = [item.get(k, d) for item in items]
+    return out
+
+
+class FrameArrays:
+    """
+    Columnar view of a single game state, one array per entity kind.
+    Arrays are float64 when built from JSON and float32 views straight
+    over the message buffer when decoded from the binary protocol.
+
+    agent:        (x, y, ang)
+    size, food_eaten, dead: own slither scalars used by the reward
+    foods:        (N, 3) x, y, value
+    own_parts:    (N, 3) x, y, size
+    top_parts:    (N, 3) x, y, size
+    target_parts: (N, 3) x, y, size
+    target_head:  (x, y, ang) or None
+    preys:        (N, 2) x, y
+    other_heads:  (N, 4) x, y, ang, size
+    others_dead:  (N,) bool, aligned with other_heads
+    other_part_counts: (N,) number of other_parts rows per other slither
+    other_parts:  (N, 3) x, y, size
+    """
+    __slots__ = (
+        "agent", "size", "food_eaten", "dead", "foods", "own_parts",
+        "top_parts", "target_parts", "target_head", "preys", "other_heads",
+        "others_dead", "other_part_counts", "other_parts",
+    )
+
+    def __init__(
+        self,
+        agent,
+        foods=_EMPTY3,
+        own_parts=_EMPTY3,
+        top_parts=_EMPTY3,
+        preys=_EMPTY2,
+        other_heads=_EMPTY4,
+        other_parts=_EMPTY3,
+        target_parts=_EMPTY3,
+        target_head=None,
+        size=0.0,
+        food_eaten=0.0,
+        dead=False,
+        others_dead=None,
+        other_part_counts=None,
+    ):
+        self.agent = agent
+        self.size = size
+        self.food_eaten = food_eaten
+        self.dead = dead
+        self.foods = foods
+        self.own_parts = own_parts
+        self.top_parts = top_parts
+        self.preys = preys
+        self.other_heads = other_heads
+        self.other_parts = other_parts
+        self.target_parts = target_parts
+        self.target_head = target_head
+        if others_dead is None:
+            others_dead = np.zeros(len(other_heads), dtype=bool)
+        self.others_dead = others_dead
+        if other_part_counts is None:
+            other_part_counts = np.zeros(len(other_heads), dtype=np.uint32)
+        self.other_part_counts = other_part_counts
+
+    @classmethod
+    def from_state(cls, state):
+        """
+        Builds the arrays from a JSON payload as sent by client/script.js.
+        """
+        slither = state["slither"]
+        target_slither = state["target_slither"]
+        others = state["others"]
+
+        target_parts = _EMPTY3
+        target_head = None
+        if target_slither:
+            target_parts = _rows(
+                target_slither.get("parts", []),
+                ("x", "y", "size"), (0.0, 0.0, 10.0))
+            target_x = target_slither.get("x", None)
+            target_y = target_slither.get("y", None)
+            if target_x is not None and target_y is not None:
+                target_head = (target_x, target_y, target_slither.get("ang", 0.0))
+
+        other_parts = [part for other in others for part in other["parts"]]
+
+        return cls(
+            agent=(slither["x"], slither["y"], slither.get("ang", 0.0)),
+            foods=_rows(state["foods"], ("x", "y", "value"), (None, None, 1.0)),
+            own_parts=_rows(slither["parts"], ("x", "y", "size"), (None, None, 10.0)),
+            top_parts=_rows(state["top_body_parts"], ("x", "y", "size"), (None, None, 10.0)),
+            preys=_rows(state["preys"], ("x", "y"), (None, None)),
+            other_heads=_rows(others, ("x", "y", "ang", "size"), (None, None, 0.0, 0.0)),
+            other_parts=_rows(other_parts, ("x", "y", "size"), (None, None, 10.0)),
+            target_parts=target_parts,
+            target_head=target_head,
+            size=slither.get("size", 0.0),
+            food_eaten=slither.get("food_eaten", 0.0),
+            dead=bool(state.get("dead", False)),
+            others_dead=np.array(
+                [bool(other.get("dead", False)) for other in others], dtype=bool),
+            other_part_counts=np.array(
+                [len(other["parts"]) for other in others], dtype=np.uint32),
+        )
+
+
+def to_grid_coords(xs, ys, agent_x, agent_y, grid_size, view_range):
+    """
+    Batched version of the per-entity projection: same float64 arithmetic and
+    truncation towards zero as int(), so indices match the scalar path exactly.
+    """
+    scale = grid_size / (2.0 * view_range)
+    # Always subtract in float64 so float32 wire arrays project like JSON ones
+    gx = (np.subtract(xs, agent_x, dtype=np.float64) + view_range) * scale
+    gy = (np.subtract(ys, agent_y, dtype=np.float64) + view_range) * scale
+    return gx.astype(np.intp), gy.astype(np.intp)
+
+
+def _clip(gx, gy, grid_size, *columns):
+    mask = (gx >= 0) & (gx < grid_size) & (gy >= 0) & (gy < grid_size)
+    return (gx[mask], gy[mask]) + tuple(c[mask] for c in columns)
+
+
+def _wrap(gx, gy, grid_size):
+    """
+    Python indexing semantics for unchecked writes: negatives wrap, anything
+    outside [-grid_size, grid_size) raises.
+    """
+    if gx.size and (
+        gx.min() < -grid_size or gx.max() >= grid_size
+        or gy.min() < -grid_size or gy.max() >= grid_size
+    ):
+        raise IndexError("grid index out of range")
+    return gx % grid_size, gy % grid_size
+
+
+def scatter_last(plane, gx, gy, values, scratch=None):
+    """
+    Assigns values into plane[gx, gy]; on duplicate cells the last entity wins,
+    as it would in a sequential loop.
+
+    `scratch` is an optional intp array of plane.size elements to reuse
+    between calls; its contents do not matter.
+    """
+    if gx.size == 0:
+        return
+    flat = gx * plane.shape[1] + gy
+    if scratch is None:
+        scratch = np.empty(plane.size, dtype=np.intp)
+    # Highest entity index per cell, in one unsorted pass
+    order = np.arange(flat.size)
+    scratch[flat] = -1
+    np.maximum.at(scratch, flat, order)
+    keep = scratch[flat] == order
+    plane[gx[keep], gy[keep]] = values[keep]
+
+
+def scatter_add(plane, gx, gy, values):
+    """
+    Accumulates values into plane[gx, gy], summing duplicates in order.
+    """
+    if gx.size == 0:
+        return
+    np.add.at(plane, (gx, gy), values.astype(plane.dtype, copy=False))
+
+
+def encode_frame(frame: FrameArrays, grid_size, view_range, out=None, scratch=None):
+    """
+    Encodes a FrameArrays into the (10, grid_size, grid_size) observation.
+    With a preallocated `out` and `scratch` (see scatter_last) no grid-sized
+    array is allocated.
+
+    Channels:
+    0: Food (summed value)          5: Target slither head angle
+    1: Own head angle               6: Preys
+    2: Own body parts (size)        7: Other slithers' head angle
+    3: Closest enemy body parts     8: Other slithers' size
+    4: Target slither body parts    9: Other slithers' body parts
+    """
+    if out is None:
+        out = np.zeros((NUM_CHANNELS, grid_size, grid_size), dtype=np.float32)
+    else:
+        out.fill(0.0)
+    _encode_into(out, frame, grid_size, view_range, scratch, clip_heads=False)
+    return out
+
+
+def foveal_ranges(levels, view_range):
+    """
+    View ranges of `levels` concentric grids, halving from `view_range`
+    inwards and ordered finest first.
+    """
+    return tuple(view_range / 2 ** k for k in reversed(range(levels)))
+
+
+def encode_foveated(frame: FrameArrays, grid_size, view_ranges, out=None, scratch=None):
+    """
+    Encodes a FrameArrays into a stack of concentric grids centred on the
+    head, one per view range, each with the 10 channels of encode_frame:
+    a (10 * len(view_ranges), grid_size, grid_size) observation. Grids
+    share the cell count, so the small ranges see the near field at high
+    resolution and the large ones the far field coarsely.
+
+    Heads beyond a grid are left out of it rather than wrapped around.
+    """
+    if out is None:
+        out = np.zeros((NUM_CHANNELS * len(view_ranges), grid_size, grid_size), dtype=np.float32)
+    else:
+        out.fill(0.0)
+    for level, view_range in enumerate(view_ranges):
+        level_out = out[level * NUM_CHANNELS:(level + 1) * NUM_CHANNELS]
+        _encode_into(level_out, frame, grid_size, view_range, scratch, clip_heads=True)
+    return out
+
+
+def _encode_into(out, frame, grid_size, view_range, scratch, clip_heads):
+    """
+    Draws `frame` into a zeroed (10, grid_size, grid_size) `out`. Heads
+    outside the grid raise like Python indexing unless `clip_heads`.
+    """
+    agent_x, agent_y, agent_ang = frame.agent
+
+    def project(arr):
+        return to_grid_coords(arr[:, 0], arr[:, 1], agent_x, agent_y, grid_size, view_range)
+
+    def place(gx, gy, *columns):
+        if clip_heads:
+            return _clip(gx, gy, grid_size, *columns)
+        return _wrap(gx, gy, grid_size) + columns
+
+    gx, gy = project(frame.foods)
+    gx, gy, value = _clip(gx, gy, grid_size, frame.foods[:, 2])
+    scatter_add(out[0], gx, gy, value)
+
+    head = np.array([[agent_x, agent_y]], dtype=np.float64)
+    gx, gy = place(*project(head))
+    out[1, gx, gy] = agent_ang
+
+    for channel, parts in ((2, frame.own_parts), (3, frame.top_parts), (4, frame.target_parts)):
+        gx, gy = project(parts)
+        gx, gy, size = _clip(gx, gy, grid_size, parts[:, 2])
+        scatter_last(out[channel], gx, gy, size, scratch)
+
+    if frame.target_head is not None:
+        target = np.array([frame.target_head[:2]], dtype=np.float64)
+        gx, gy = place(*project(target))
+        out[5, gx, gy] = frame.target_head[2]
+
+    gx, gy = _clip(*project(frame.preys), grid_size)
+    out[6, gx, gy] = 1.0
+
+    gx, gy, ang, size = place(*project(frame.other_heads), frame.other_heads[:, 2], frame.other_heads[:, 3])
+    scatter_last(out[7], gx, gy, ang, scratch)
+    scatter_last(out[8], gx, gy, size, scratch)
+
+    gx, gy = project(frame.other_parts)
+    gx, gy, size = _clip(gx, gy, grid_size, frame.other_parts[:, 2])
+    scatter_last(out[9], gx, gy, size, scratch)
+
+
+def encode_entities(frame: FrameArrays, view_range, capacities=ENTITY_CAPACITIES, out=None):
+    """
+    Encodes a FrameArrays into a fixed-size (sum(capacities), 6) entity
+    table instead of a grid, one row per entity within the same square as
+    encode_frame:
+
+        x, y:  position relative to the head, divided by view_range
+        size:  part or head size, food value; 0 for preys
+        angle: heading of heads, 0 otherwise
+        type:  index into ENTITY_TYPES
+        valid: 1 for entities, 0 for padding
+
+    Entities are packed at the top of the table in ENTITY_TYPES order and
+    the rest is zero padding. A type with more entities than its capacity
+    keeps the ones nearest to the head.
+    """
+    total = sum(capacities.values())
+    if out is None:
+        out = np.zeros((total, len(ENTITY_FEATURES)), dtype=np.float32)
+    agent_x, agent_y, agent_ang = frame.agent
+    if frame.target_head is None:
+        target_head = _EMPTY3
+    else:
+        target_head = np.array([frame.target_head], dtype=np.float64)
+    heads = frame.other_heads
+    # (points, size, angle or None) per entity type
+    sources = (
+        (frame.foods, frame.foods[:, 2], None),
+        (np.array([[agent_x, agent_y]], dtype=np.float64), np.zeros(1), np.array([agent_ang])),
+        (frame.own_parts, frame.own_parts[:, 2], None),
+        (frame.top_parts, frame.top_parts[:, 2], None),
+        (frame.target_parts, frame.target_parts[:, 2], None),
+        (target_head, np.zeros(len(target_head)), target_head[:, 2]),
+        (frame.preys, np.zeros(len(frame.preys)), None),
+        (heads, heads[:, 3], heads[:, 2]),
+        (frame.other_parts, frame.other_parts[:, 2], None),
+    )
+    row = 0
+    for kind, (points, size, angle) in enumerate(sources):
+        x = np.subtract(points[:, 0], agent_x, dtype=np.float64) / view_range
+        y = np.subtract(points[:, 1], agent_y, dtype=np.float64) / view_range
+        keep = np.flatnonzero((np.abs(x) < 1.0) & (np.abs(y) < 1.0))
+        capacity = capacities[ENTITY_TYPES[kind]]
+        if len(keep) > capacity:
+            distance = x[keep] ** 2 + y[keep] ** 2
+            keep = keep[np.argpartition(distance, capacity - 1)[:capacity]]
+        n = len(keep)
+        rows = out[row:row + n]
+        rows[:, 0] = x[keep]
+        rows[:, 1] = y[keep]
+        rows[:, 2] = size[keep]
+        rows[:, 3] = 0.0 if angle is None else angle[keep]
+        rows[:, 4] = kind
+        rows[:, 5] = 1.0
+        row += n
+    out[row:] = 0.0
+    return out
@@ -0,0 +1,153 @@
+import argparse
+import copy
+import time
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.ao.quantization import quantize_dynamic
+from stable_baselines3 import PPO
+
+from encoder import NUM_CHANNELS
+from inference import ExportedPolicy
+from model import TransformerEncoderBlock
+from simulator import synthetic_payload
+from slither_env import ENTITIES, GameConnection, SlitherEnv
+
+
+class ExportablePolicy(nn.Module):
+    """
+    The acting half of an SB3 ActorCriticPolicy as a plain module:
+    features extractor, actor MLP, action head, Gaussian noise and clipping
+    to the action bounds. `noise` is standard normal, or zeros for
+    deterministic actions, so the artifact needs no RNG of its own.
+    """
+
+    def __init__(self, policy):
+        super().__init__()
+        self.features_extractor = policy.pi_features_extractor
+        self.policy_net = policy.mlp_extractor.policy_net
+        self.action_net = policy.action_net
+        self.register_buffer("std", policy.log_std.detach().exp().clone())
+        space = policy.action_space
+        self.register_buffer("low", torch.as_tensor(space.low, dtype=torch.float32))
+        self.register_buffer("high", torch.as_tensor(space.high, dtype=torch.float32))
+
+    def forward(self, obs, noise):
+        mean = self.action_net(self.policy_net(self.features_extractor(obs)))
+        return torch.minimum(torch.maximum(mean + self.std * noise, self.low), self.high)
+
+
+def quantize(module):
+    """
+    Dynamic int8 quantization of the MLP Linear layers in every
+    TransformerEncoderBlock. Attention projections stay in float.
+    """
+    for block in module.modules():
+        if isinstance(block, TransformerEncoderBlock):
+            block.mlp = quantize_dynamic(block.mlp, {nn.Linear}, dtype=torch.qint8)
+    return module
+
+
+def export(model, path, fmt="torchscript", int8=False):
+    # Copy so quantization leaves the eager model intact for comparison
+    module = ExportablePolicy(copy.deepcopy(model.policy)).cpu().eval()
+    if int8:
+        module = quantize(module)
+    obs = torch.zeros((1, *model.observation_space.shape))
+    noise = torch.zeros((1, *model.action_space.shape))
+    with torch.no_grad():
+        if fmt == "torchscript":
+            torch.jit.trace(module, (obs, noise)).save(path)
+        else:
+            # The fused eval-mode attention kernel has no ONNX symbolic
+            torch.backends.mha.set_fastpath_enabled(False)
+            try:
+                torch.onnx.export(
+                    module, (obs, noise), path, dynamo=False,
+                    input_names=["obs", "noise"], output_names=["actions"],
+                    dynamic_axes={"obs": {0: "batch"}, "noise": {0: "batch"}, "actions": {0: "batch"}},
+                )
+            finally:
+                torch.backends.mha.set_fastpath_enabled(True)
+
+
+def sample_observations(model, count, seed=0):
+    """
+    Encoded synthetic game states, so parity is checked on realistic grids.
+    """
+    rng = np.random.default_rng(seed)
+    shape = model.observation_space.shape
+    if len(shape) == 2:
+        env = SlitherEnv(connection=GameConnection(), observation=ENTITIES)
+    else:
+        channels, _, grid_size = shape
+        env = SlitherEnv(connection=GameConnection(), grid_size=grid_size, levels=channels // NUM_CHANNELS)
+    return np.stack([env.encode_state(synthetic_payload(rng)) for _ in range(count)])
+
+
+def timed(fn, obs, repeat):
+    fn(obs)
+    latencies = np.empty(repeat)
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        fn(obs)
+        latencies[i] = time.perf_counter() - t0
+    return np.percentile(latencies * 1e3, [50, 99])
+
+
+def compare(model, exported, obs, repeat=50, batch_sizes=(1, 16)):
+    """
+    Max absolute difference between eager and exported deterministic
+    actions, then p50/p99 CPU latency of both at each batch size.
+    """
+    expected, _ = model.predict(obs, deterministic=True)
+    actual = exported(obs, deterministic=True)
+    error = float(np.abs(expected - actual).max())
+    print(f"Parity: max |eager - exported| = {error:.2e} over {len(obs)} observations")
+
+    def eager(x):
+        return model.predict(x, deterministic=True)[0]
+
+    def artifact(x):
+        return exported(x, deterministic=True)
+
+    print(f"{'batch':>6}{'eager p50':>12}{'eager p99':>12}{'export p50':>12}{'export p99':>12}")
+    for batch in batch_sizes:
+        x = np.resize(obs, (batch, *obs.shape[1:]))
+        e50, e99 = timed(eager, x, repeat)
+        x50, x99 = timed(artifact, x, repeat)
+        print(f"{batch:>6}{e50:>12.2f}{e99:>12.2f}{x50:>12.2f}{x99:>12.2f}")
+    return error
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Export a trained PPO policy to TorchScript or ONNX for serving.")
+    parser.add_argument("model_path", type=str, help="Path to the SB3 model to export.")
+    parser.add_argument("output", type=str, help="Artifact path (.pt or .onnx).")
+    parser.add_argument("--format", choices=("torchscript", "onnx"), default=None,
+                        help="Defaults to onnx for .onnx outputs, torchscript otherwise.")
+    parser.add_argument("--int8", action="store_true",
+                        help="Dynamically quantize the transformer MLP layers to int8.")
+    parser.add_argument("--atol", type=float, default=None,
+                        help="Largest allowed action difference (default 1e-4, or 5e-2 with --int8).")
+    parser.add_argument("--samples", type=int, default=32,
+                        help="Observations used for the parity check.")
+    parser.add_argument("--repeat", type=int, default=50,
+                        help="Timed calls per batch size in the latency comparison.")
+    args = parser.parse_args()
+
+    fmt = args.format or ("onnx" if args.output.endswith(".onnx") else "torchscript")
+    if fmt == "onnx" and args.int8:
+        parser.error("--int8 is only supported for TorchScript exports")
+    atol = args.atol if args.atol is not None else (5e-2 if args.int8 else 1e-4)
+
+    torch.set_grad_enabled(False)
+    model = PPO.load(args.model_path, device="cpu")
+    export(model, args.output, fmt, args.int8)
+    print(f"Exported {fmt}{' (int8)' if args.int8 else ''} policy to {args.output}")
+
+    obs = sample_observations(model, args.samples)
+    error = compare(model, ExportedPolicy(args.output), obs, args.repeat)
+    if error > atol:
+        raise SystemExit(f"Parity check failed: {error:.2e} > {atol:.0e}")
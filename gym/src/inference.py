@@ -0,0 +1,283 @@
+import asyncio
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from metrics import METRICS
+
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+
+class LatencyStats:
+    """
+    Rolling window of latency samples (seconds) with percentile summaries.
+    """
+
+    def __init__(self, window=2000):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+        self.count += 1
+
+    def percentiles(self, *qs):
+        if not self.samples:
+            return {f"p{q}": None for q in qs}
+        values = np.percentile(np.fromiter(self.samples, dtype=np.float64), qs) * 1e3
+        return {f"p{q}": float(v) for q, v in zip(qs, values)}
+
+
+class DecisionInterval:
+    """
+    Action repeat for one served client: the policy acts on every k-th
+    state and the client keeps its last action in between. With
+    `adaptive`, k follows the client's decision latency (encode, batching
+    and forward pass) against the time between its states: it is the
+    smallest k whose k states take longer to arrive than a decision.
+    States that arrive while a decision is still being computed are
+    repeats too, so the policy never acts on a backlog of stale states.
+    """
+
+    def __init__(self, k=1, adaptive=False, max_k=8, smoothing=0.2):
+        self.k = k
+        self.adaptive = adaptive
+        self.max_k = max_k
+        self.smoothing = smoothing
+        # Moving averages, in seconds
+        self.latency = None
+        self.period = None
+        self.decisions = 0
+        self.repeats = 0
+        # When the last decision started, and states seen since
+        self._decided_at = None
+        self._since_decision = None
+
+    def arrive(self, now=None, busy=False):
+        """
+        Records a state arriving. Returns True if the policy should act on
+        it; never while the previous decision is still `busy`.
+        """
+        now = time.perf_counter() if now is None else now
+        if self._since_decision is not None and (busy or self._since_decision + 1 < self.k):
+            self._since_decision += 1
+            self.repeats += 1
+            return False
+        if self._since_decision is not None:
+            # Averaged over every state since the last decision, so that
+            # jitter in single gaps does not move k
+            self.period = self._average(self.period, (now - self._decided_at) / (self._since_decision + 1))
+        self._decided_at = now
+        self._since_decision = 0
+        self.decisions += 1
+        return True
+
+    def decided(self, latency):
+        """
+        Records how long a decision took, and adapts k.
+        """
+        self.latency = self._average(self.latency, latency)
+        if self.adaptive and self.period:
+            self.k = min(self.max_k, int(self.latency // self.period) + 1)
+
+    def restart(self):
+        """
+        Acts on the next state, e.g. the first one after a death.
+        """
+        self._since_decision = None
+
+    def _average(self, average, sample):
+        if average is None:
+            return sample
+        return average + self.smoothing * (sample - average)
+
+
+class _Request:
+    __slots__ = ("state", "future", "t0")
+
+    def __init__(self, state, future):
+        self.state = state
+        self.future = future
+        self.t0 = time.perf_counter()
+
+
+class InferenceScheduler:
+    """
+    Collects observations from every connected client into micro-batches
+    and runs one batched forward pass per batch on a worker thread, so the
+    event loop never blocks on the model and clients share forward passes.
+
+    A batch is dispatched once it holds `max_batch_size` requests or its
+    oldest request has waited `max_wait_ms`, whichever comes first.
+    Requests that queued up while the previous batch was running are
+    dispatched straight away.
+
+    :param encode: state -> observation, run on the worker thread
+    :param policy: (B, *obs_shape) observations -> (B, action_dim) actions
+    :param viewer: optional renderer.Renderer shown the first observation of each batch
+    """
+
+    def __init__(self, encode, policy, max_batch_size=16, max_wait_ms=5.0, viewer=None):
+        self.encode = encode
+        self.policy = policy
+        self.viewer = viewer
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1e3
+        self.latency = LatencyStats()
+        self.batch_sizes = deque(maxlen=2000)
+        self.policy_swaps = 0
+        self._queue = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+
+    async def predict(self, state):
+        """
+        Returns the action for `state` once its batch has been evaluated.
+        """
+        request = _Request(state, asyncio.get_running_loop().create_future())
+        await self._queue.put(request)
+        return await request.future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = batch[0].t0 + self.max_wait
+            while len(batch) < self.max_batch_size:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                actions = await loop.run_in_executor(
+                    self._executor, self._forward, [r.state for r in batch])
+            except Exception as e:
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+                continue
+
+            done = time.perf_counter()
+            self.batch_sizes.append(len(batch))
+            METRICS.observe_value("inference_batch_size", len(batch), BATCH_BUCKETS)
+            for request, action in zip(batch, actions):
+                if not request.future.done():
+                    request.future.set_result(action)
+                self.latency.add(done - request.t0)
+                METRICS.observe("action_latency", done - request.t0)
+
+    def swap_policy(self, policy):
+        """
+        Serves `policy` from the next batch on. A batch already being
+        evaluated finishes with the old one, so no request is dropped or
+        sees a half-loaded model.
+        """
+        self.policy = policy
+        self.policy_swaps += 1
+
+    async def watch(self, path, load, interval=2.0):
+        """
+        Polls `path` and hot-swaps in `load(path)` whenever the file changes.
+        The load runs on its own thread while the current policy keeps
+        serving. A file is only loaded once it has looked the same for two
+        polls, and a failed load keeps the current policy.
+        """
+        def signature():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                return None
+            return stat.st_mtime_ns, stat.st_size
+
+        loaded = signature()
+        seen = loaded
+        while True:
+            await asyncio.sleep(interval)
+            current = signature()
+            if current is None or current == loaded or current != seen:
+                # Missing, unchanged, or still being written
+                seen = current
+                continue
+            t0 = time.perf_counter()
+            try:
+                policy = await asyncio.to_thread(load, path)
+            except Exception as e:
+                print(f"Could not reload {path}, keeping the current policy: {e}")
+            else:
+                self.swap_policy(policy)
+                print(f"Reloaded {path} in {time.perf_counter() - t0:.2f} s")
+            loaded = current
+
+    def _forward(self, states):
+        obs = np.stack([self.encode(state) for state in states])
+        if self.viewer is not None:
+            self.viewer.submit(obs[0], states[0])
+        with METRICS.timer("policy_forward"):
+            return self.policy(obs)
+
+    def stats(self):
+        stats = self.latency.percentiles(50, 99)
+        stats["requests"] = self.latency.count
+        stats["mean_batch"] = float(np.mean(self.batch_sizes)) if self.batch_sizes else None
+        return stats
+
+    async def report(self, interval):
+        """
+        Prints action latency percentiles and mean batch size every `interval` seconds.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            stats = self.stats()
+            if stats["p50"] is not None:
+                print(f"Action latency p50 {stats['p50']:.1f} ms | p99 {stats['p99']:.1f} ms"
+                      f" | mean batch {stats['mean_batch']:.1f} | {stats['requests']} requests")
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class ExportedPolicy:
+    """
+    Runs a policy exported by export.py. Needs torch for TorchScript
+    artifacts and onnxruntime for ONNX ones, but not stable-baselines3.
+
+    Called with a (B, *obs_shape) batch, returns (B, action_dim) actions,
+    sampled like PPO.predict(deterministic=False) unless `deterministic`.
+    """
+
+    def __init__(self, path, seed=None):
+        self.path = path
+        self.rng = np.random.default_rng(seed)
+        if path.endswith(".onnx"):
+            import onnxruntime
+
+            self._session = onnxruntime.InferenceSession(path, providers=["CPUExecutionProvider"])
+            self.action_dim = self._session.get_outputs()[0].shape[-1]
+            self._run = self._run_onnx
+        else:
+            import torch
+
+            self._torch = torch
+            self._module = torch.jit.load(path, map_location="cpu").eval()
+            self.action_dim = int(self._module.std.shape[-1])
+            self._run = self._run_torchscript
+
+    def __call__(self, obs, deterministic=False):
+        obs = np.asarray(obs, dtype=np.float32)
+        shape = (len(obs), self.action_dim)
+        noise = np.zeros(shape, np.float32) if deterministic else self.rng.standard_normal(shape, np.float32)
+        return self._run(obs, noise)
+
+    def _run_torchscript(self, obs, noise):
+        with self._torch.inference_mode():
+            return self._module(self._torch.from_numpy(obs), self._torch.from_numpy(noise)).numpy()
+
+    def _run_onnx(self, obs, noise):
+        return self._session.run(None, {"obs": obs, "noise": noise})[0]
@@ -0,0 +1,301 @@
+import atexit
+import bisect
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds (seconds) of the latency histogram buckets
+TIME_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+)
+# Upper bounds (seconds) for whole training phases such as a rollout
+PHASE_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+PREFIX = "slither"
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram in the Prometheus sense: a count per upper
+    bound plus the overall count and sum.
+    """
+
+    def __init__(self, buckets=TIME_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """
+        Upper bound of the bucket holding the q-th quantile (inf past the last).
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets + (float("inf"),), self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class _Timer:
+    __slots__ = ("metrics", "name", "t0")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.t0)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Metrics:
+    """
+    Per-stage timers, counters and histograms for the hot paths. Timed
+    stages share one histogram family in seconds; other quantities, such as
+    batch sizes, go through observe_value() and get a family of their own.
+
+    Disabled by default: timer() then hands out one shared no-op context
+    manager and the other calls return after a single attribute check, so
+    instrumented code costs next to nothing until enable() is called.
+
+        with METRICS.timer("encode_state"):
+            obs = encode_frame(...)
+        METRICS.count("messages_binary")
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.histograms = {}
+        # Histograms of quantities that are not times, by metric name
+        self.values = {}
+        self.counters = {}
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+        return self
+
+    def disable(self):
+        self.enabled = False
+
+    def timer(self, stage):
+        """
+        Context manager recording the wall time of its block under `stage`.
+        """
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, stage)
+
+    def observe(self, stage, value, buckets=TIME_BUCKETS):
+        """
+        Records the duration `value`, in seconds, of `stage`.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._histogram(self.histograms, stage, buckets).observe(value)
+
+    def observe_value(self, name, value, buckets):
+        """
+        Records a quantity that is not a time, e.g. a batch size. It is
+        exported as its own `slither_<name>` histogram.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._histogram(self.values, name, buckets).observe(value)
+
+    @staticmethod
+    def _histogram(histograms, name, buckets):
+        histogram = histograms.get(name)
+        if histogram is None:
+            histogram = histograms[name] = Histogram(buckets)
+        return histogram
+
+    def count(self, name, n=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.values.clear()
+            self.counters.clear()
+            self.started = time.time()
+
+    def snapshot(self):
+        """
+        Plain-dict copy of everything recorded, with p50/p99 estimates: in
+        ms for stages, and in the recorded unit for other values.
+        """
+        def summary(h, scale, suffix):
+            p50, p99 = h.quantile(0.5), h.quantile(0.99)
+            return {
+                "count": h.count,
+                "sum": h.sum,
+                f"mean{suffix}": h.sum / h.count * scale if h.count else None,
+                f"p50{suffix}_le": None if p50 is None else p50 * scale,
+                f"p99{suffix}_le": None if p99 is None else p99 * scale,
+                "buckets": dict(zip([*map(str, h.buckets), "+Inf"], h.counts)),
+            }
+
+        with self._lock:
+            return {
+                "timestamp": time.time(),
+                "uptime_s": time.time() - self.started,
+                "stages": {stage: summary(h, 1e3, "_ms") for stage, h in self.histograms.items()},
+                "values": {name: summary(h, 1, "") for name, h in self.values.items()},
+                "counters": dict(self.counters),
+            }
+
+    def prometheus(self):
+        """
+        Everything recorded, in the Prometheus text exposition format.
+        """
+        def samples(name, h, labels=""):
+            sep = "," if labels else ""
+            cumulative = 0
+            for bound, n in zip([*map(repr, h.buckets), "+Inf"], h.counts):
+                cumulative += n
+                lines.append(f'{name}_bucket{{{labels}{sep}le="{bound}"}} {cumulative}')
+            suffix = f"{{{labels}}}" if labels else ""
+            lines.append(f"{name}_sum{suffix} {h.sum!r}")
+            lines.append(f"{name}_count{suffix} {h.count}")
+
+        lines = []
+        with self._lock:
+            if self.histograms:
+                name = f"{PREFIX}_stage_seconds"
+                lines += [f"# HELP {name} Time spent per hot-path stage.", f"# TYPE {name} histogram"]
+                for stage, h in sorted(self.histograms.items()):
+                    samples(name, h, f'stage="{stage}"')
+            for value, h in sorted(self.values.items()):
+                name = f"{PREFIX}_{value}"
+                lines.append(f"# TYPE {name} histogram")
+                samples(name, h)
+            for counter, value in sorted(self.counters.items()):
+                name = f"{PREFIX}_{counter}_total"
+                lines += [f"# TYPE {name} counter", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path):
+        """
+        Writes snapshot() as JSON, atomically so readers never see half a file.
+        """
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.snapshot(), f, indent=2)
+        os.replace(tmp, path)
+
+
+# Shared by every module; enabled from the command line
+METRICS = Metrics()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    metrics = METRICS
+
+    def do_GET(self):
+        if self.path in ("/", "/metrics"):
+            body = self.metrics.prometheus().encode()
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        elif self.path == "/metrics.json":
+            body = json.dumps(self.metrics.snapshot()).encode()
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port, host="127.0.0.1", metrics=METRICS):
+    """
+    Serves /metrics (Prometheus text) and /metrics.json from a daemon thread.
+    """
+    handler = type("Handler", (_Handler,), {"metrics": metrics})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    print(f"Metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+
+def dump_periodically(path, interval=10.0, metrics=METRICS):
+    """
+    Rewrites `path` with a JSON snapshot every `interval` seconds from a
+    daemon thread. Set the returned event to stop.
+    """
+    stopped = threading.Event()
+
+    def run():
+        while not stopped.wait(interval):
+            try:
+                metrics.dump(path)
+            except OSError as e:
+                print(f"Could not write metrics to {path}: {e}")
+
+    threading.Thread(target=run, name="metrics-dump", daemon=True).start()
+    return stopped
+
+
+def configure(port=None, dump_path=None, interval=10.0):
+    """
+    Enables METRICS if a port or dump path is given, and starts the
+    endpoint and dump thread. Used by the command-line entry points.
+    """
+    if port is None and dump_path is None:
+        return
+    METRICS.enable()
+    if port is not None:
+        serve(port)
+    if dump_path is not None:
+        dump_periodically(dump_path, interval)
+        # And once more on the way out, so short runs leave a dump too
+        atexit.register(METRICS.dump, dump_path)
+
+
+def add_arguments(parser):
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="Enable hot-path metrics and serve them at http://127.0.0.1:PORT/metrics.")
+    parser.add_argument("--metrics-dump", type=str, default=None, metavar="PATH",
+                        help="Enable hot-path metrics and write them as JSON to PATH periodically.")
+    parser.add_argument("--metrics-interval", type=float, default=10.0,
+                        help="Seconds between JSON metric dumps.")
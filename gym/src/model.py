@@ -1,5 +1,6 @@
 import torch
 import torch.nn as nn
+from gymnasium import spaces
 from stable_baselines3.common.torch_layers import BaseFeaturesExtractor
 
 
@@ -21,12 +22,26 @@ class TransformerEncoderBlock(nn.Module):
             nn.Linear(hidden_dim, embed_dim),
             nn.Dropout(dropout)
         )
+        # Set by set_fast_path; neither changes the parameters
+        self.fused_attention = False
+        self.autocast_dtype = None
 
-    def forward(self, x):
+    def forward(self, x, key_padding_mask=None):
         # x: (B, seq_len, embed_dim)
+        # key_padding_mask: optional (B, seq_len), True for tokens to ignore
+        if self.autocast_dtype is not None:
+            # Matmuls run in autocast_dtype; the residual stream stays float32
+            with torch.autocast(x.device.type, dtype=self.autocast_dtype):
+                return self._forward(x, key_padding_mask)
+        return self._forward(x, key_padding_mask)
+
+    def _forward(self, x, key_padding_mask):
         # 1) Multi-head self-attention
         x_norm = self.norm1(x)
-        x_attn, _ = self.attn(x_norm, x_norm, x_norm)
+        if key_padding_mask is None and not self.fused_attention:
+            x_attn, _ = self.attn(x_norm, x_norm, x_norm, need_weights=False)
+        else:
+            x_attn = self._fused_attention(x_norm, key_padding_mask)
         x = x + x_attn  # Residual connection
         
         # 2) MLP
@@ -36,6 +51,40 @@ class TransformerEncoderBlock(nn.Module):
         
         return x
 
+    def _fused_attention(self, x, key_padding_mask=None):
+        """
+        Same computation as self.attn, done with scaled_dot_product_attention
+        on self.attn's weights. nn.MultiheadAttention's inference fast path
+        is several times slower on CPU once a mask is given, and in training
+        it materializes the attention weights instead of using a fused kernel.
+        """
+        B, L, E = x.shape
+        heads = self.attn.num_heads
+        qkv = nn.functional.linear(x, self.attn.in_proj_weight, self.attn.in_proj_bias)
+        q, k, v = qkv.reshape(B, L, 3, heads, E // heads).permute(2, 0, 3, 1, 4)
+        attn_mask = None if key_padding_mask is None else ~key_padding_mask[:, None, None, :]
+        out = nn.functional.scaled_dot_product_attention(
+            q, k, v, attn_mask=attn_mask,
+            dropout_p=self.attn.dropout if self.training else 0.0)
+        return self.attn.out_proj(out.transpose(1, 2).reshape(B, L, E))
+
+
+def set_fast_path(module, fused_attention=True, bf16=False, compile=False):
+    """
+    Switches every TransformerEncoderBlock in `module` to a faster path for
+    CPU training: scaled_dot_product_attention even without a padding mask,
+    optionally bf16 autocast for the blocks' matmuls, and optionally
+    torch.compile of each block. Parameters are untouched, so the state dict
+    is the same and checkpoints load with or without it.
+    """
+    for block in module.modules():
+        if isinstance(block, TransformerEncoderBlock):
+            block.fused_attention = fused_attention
+            block.autocast_dtype = torch.bfloat16 if bf16 else None
+            if compile:
+                block.compile()
+    return module
+
 
 class ViTExtractor(BaseFeaturesExtractor):
     """
@@ -112,21 +161,28 @@ class ViTExtractor(BaseFeaturesExtractor):
         if self.cls_token is not None:
             nn.init.normal_(self.cls_token, std=0.02)
 
-    def forward(self, observations: torch.Tensor) -> torch.Tensor:
+    def patch_tokens(self, observations: torch.Tensor) -> torch.Tensor:
         """
-        :param observations: shape (B, C, H, W)
-        :return: a feature tensor of shape (B, features_dim)
+        (B, C, H, W) -> (B, num_patches, embed_dim) patch embeddings.
         """
-        B = observations.shape[0]
-
         # 1) Patch embedding => (B, embed_dim, H/patch_size, W/patch_size)
         x = self.patch_embed(observations)
-        
+
         # 2) Flatten spatial dimensions => (B, embed_dim, num_patches)
         x = x.flatten(2)  # (B, embed_dim, num_patches)
-        
+
         # 3) Transpose => (B, num_patches, embed_dim)
-        x = x.transpose(1, 2)
+        return x.transpose(1, 2)
+
+    def forward(self, observations: torch.Tensor) -> torch.Tensor:
+        """
+        :param observations: shape (B, C, H, W)
+        :return: a feature tensor of shape (B, features_dim)
+        """
+        B = observations.shape[0]
+
+        # 1-3) Patch embedding => (B, num_patches, embed_dim)
+        x = self.patch_tokens(observations)
 
         # 4) If we use a CLS token, prepend it
         if self.use_cls_token:
@@ -155,3 +211,196 @@ class ViTExtractor(BaseFeaturesExtractor):
         # 9) Final projection to features_dim
         out = self.fc(x)  # => (B, features_dim)
         return out
+
+
+class SparseViTExtractor(ViTExtractor):
+    """
+    ViTExtractor that only attends over occupied patches. Patches whose
+    pixels are all zero are dropped from the token sequence; in a batch,
+    sequences are padded to the longest one and padding is masked out of
+    attention and pooling. Parameters match ViTExtractor, so weights can be
+    loaded into either.
+
+    Unlike ViTExtractor, empty patches contribute nothing instead of their
+    bias + positional embedding, so features differ unless every patch is
+    occupied.
+    """
+
+    def patches(self, observations: torch.Tensor) -> torch.Tensor:
+        """
+        (B, C, H, W) -> (B, num_patches, C * patch_size**2), flattened in the
+        same (C, kh, kw) order as the patch_embed kernel.
+        """
+        B, p = observations.shape[0], self.patch_size
+        x = observations.reshape(B, self.C, self.num_patches_h, p, self.num_patches_w, p)
+        return x.permute(0, 2, 4, 1, 3, 5).reshape(B, self.num_patches, -1)
+
+    def forward(self, observations: torch.Tensor) -> torch.Tensor:
+        """
+        :param observations: shape (B, C, H, W)
+        :return: a feature tensor of shape (B, features_dim)
+        """
+        B = observations.shape[0]
+        patches = self.patches(observations)
+
+        # 1) Occupied patches first, in their original order => (B, k)
+        occupied = patches.abs().amax(dim=-1) > 0
+        counts = occupied.sum(dim=1)
+        k = max(int(counts.max()), 1)
+        order = torch.argsort((~occupied).to(torch.int8), dim=1, stable=True)[:, :k]
+        # Keep at least one token per row so attention never sees an all-masked row
+        padding = torch.arange(k, device=observations.device) >= counts.clamp(min=1)[:, None]
+
+        # 2) Embed only the kept patches with the patch_embed kernel => (B, k, embed_dim)
+        kept = torch.gather(patches, 1, order[..., None].expand(-1, -1, patches.shape[-1]))
+        weight = self.patch_embed.weight.reshape(self.embed_dim, -1)
+        x = nn.functional.linear(kept, weight, self.patch_embed.bias)
+
+        # 3) Positional embeddings of the kept patches
+        offset = 1 if self.use_cls_token else 0
+        x = x + self.pos_embed[0, offset:][order]
+
+        if self.use_cls_token:
+            cls_tokens = (self.cls_token + self.pos_embed[:, :1]).expand(B, -1, -1)
+            x = torch.cat((cls_tokens, x), dim=1)
+            padding = torch.cat((padding.new_zeros(B, 1), padding), dim=1)
+
+        # 4) Transformer blocks with padding masked out
+        for block in self.blocks:
+            x = block(x, key_padding_mask=padding)
+        x = self.norm(x)
+
+        # 5) Pool: CLS token, or mean over the real tokens
+        if self.use_cls_token:
+            x = x[:, 0]
+        else:
+            keep = (~padding).unsqueeze(-1).to(x.dtype)
+            x = (x * keep).sum(dim=1) / keep.sum(dim=1)
+
+        return self.fc(x)
+
+
+class FoveatedViTExtractor(ViTExtractor):
+    """
+    ViTExtractor for the foveated observations of encoder.encode_foveated:
+    `levels` concentric grids of `level_channels` channels stacked along C.
+    Every level is cut into patches with one shared patch_embed, and the
+    patches of all levels form a single token sequence, with positional
+    embeddings per level and patch. A 32x32 grid at 3 levels gives 48
+    tokens, against 256 for a single 128x128 grid at patch size 8.
+    """
+    def __init__(self, observation_space, level_channels=10, **kwargs):
+        channels, height, width = observation_space.shape
+        assert channels % level_channels == 0, "Observation channels not a multiple of level_channels"
+        # Build the per-level ViT, then widen its token sequence to all levels
+        level_space = spaces.Box(
+            low=observation_space.low[:level_channels], high=observation_space.high[:level_channels],
+            dtype=observation_space.dtype)
+        super().__init__(level_space, **kwargs)
+        self._observation_space = observation_space
+        self.levels = channels // level_channels
+
+        self.num_patches = self.levels * self.num_patches_h * self.num_patches_w
+        self.seq_length = self.num_patches + (1 if self.use_cls_token else 0)
+        self.pos_embed = nn.Parameter(torch.zeros(1, self.seq_length, self.embed_dim))
+        self._init_weights()
+
+        with torch.no_grad():
+            sample_features = self.forward(torch.zeros((1, channels, height, width)))
+            assert sample_features.shape == (1, self.features_dim), (
+                f"Expected (1, {self.features_dim}), got {sample_features.shape}"
+            )
+
+    def patch_tokens(self, observations: torch.Tensor) -> torch.Tensor:
+        """
+        (B, levels * C, H, W) -> (B, levels * num_patches_per_level, embed_dim),
+        finest level first.
+        """
+        B = observations.shape[0]
+        levels = observations.shape[1] // self.C
+        x = observations.reshape(B * levels, self.C, self.H, self.W)
+        x = super().patch_tokens(x)
+        return x.reshape(B, -1, self.embed_dim)
+
+
+class EntityAttentionExtractor(BaseFeaturesExtractor):
+    """
+    Set-attention feature extractor for the entity tables of
+    encoder.encode_entities, of shape (N, 6): x, y, size, angle, type, valid.
+
+    Each entity becomes one token, embedded from its position, size and
+    heading plus a learned embedding of its type, and a CLS token attends
+    over them through the same Transformer blocks as ViTExtractor. Rows are
+    packed with padding at the end, so a batch is cut to its largest
+    entity count first and compute follows the number of entities rather
+    than the table size. Remaining padding is masked out of attention.
+    """
+    def __init__(
+        self,
+        observation_space,
+        features_dim=128,
+        embed_dim=64,
+        num_heads=4,
+        num_layers=4,
+        mlp_ratio=4.0,
+        dropout=0.0,
+        num_types=9,
+    ):
+        super().__init__(observation_space, features_dim)
+        self.max_entities, self.num_features = observation_space.shape
+        self.embed_dim = embed_dim
+
+        # x, y, size, sin(angle), cos(angle)
+        self.entity_embed = nn.Linear(5, embed_dim)
+        self.type_embed = nn.Embedding(num_types, embed_dim)
+        self.cls_token = nn.Parameter(torch.zeros(1, 1, embed_dim))
+
+        self.blocks = nn.ModuleList([
+            TransformerEncoderBlock(embed_dim, num_heads, mlp_ratio, dropout)
+            for _ in range(num_layers)
+        ])
+        self.norm = nn.LayerNorm(embed_dim)
+
+        self.fc = nn.Sequential(
+            nn.Linear(embed_dim, features_dim),
+            nn.ReLU()
+        )
+        nn.init.normal_(self.cls_token, std=0.02)
+
+        with torch.no_grad():
+            sample_features = self.forward(torch.zeros((1, *observation_space.shape)))
+            assert sample_features.shape == (1, features_dim), (
+                f"Expected (1, {features_dim}), got {sample_features.shape}"
+            )
+
+    def forward(self, observations: torch.Tensor) -> torch.Tensor:
+        """
+        :param observations: shape (B, N, 6)
+        :return: a feature tensor of shape (B, features_dim)
+        """
+        B = observations.shape[0]
+        valid = observations[..., 5] > 0
+
+        # 1) Drop the padding every row of the batch has. Traced exports
+        # keep the full table, as the cut depends on the data
+        if not torch.jit.is_tracing():
+            k = int(valid.sum(dim=1).max())
+            observations, valid = observations[:, :k], valid[:, :k]
+
+        # 2) Entity tokens => (B, k, embed_dim)
+        angle = observations[..., 3:4]
+        features = torch.cat((observations[..., :3], torch.sin(angle), torch.cos(angle)), dim=-1)
+        types = observations[..., 4].long().clamp(0, self.type_embed.num_embeddings - 1)
+        x = self.entity_embed(features) + self.type_embed(types)
+
+        # 3) CLS token first; it is never padding, so no row is fully masked
+        x = torch.cat((self.cls_token.expand(B, -1, -1), x), dim=1)
+        padding = torch.cat((valid.new_zeros(B, 1), ~valid), dim=1)
+
+        # 4) Transformer blocks with padding masked out
+        for block in self.blocks:
+            x = block(x, key_padding_mask=padding)
+        x = self.norm(x)
+
+        # 5) Pool the CLS token and project
+        return self.fc(x[:, 0])
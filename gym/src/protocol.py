@@ -0,0 +1,531 @@
+import json
+import struct
+import numpy as np
+from encoder import FrameArrays
+
+# Binary "update" frames (little-endian, every field 4 bytes wide so the
+# float32 sections that follow stay aligned for np.frombuffer):
+#
+#   magic      4s      b"SLG" + version byte
+#   flags      u32     bit 0: own slither is dead
+#   scalars    8 x f32 x, y, ang, size, food_eaten, target_x, target_y, target_ang
+#                      (target_* are NaN when there is no target head)
+#   counts     7 x u32 foods, own_parts, top_parts, target_parts, preys,
+#                      others, other_parts
+#
+# followed by the sections, in this order:
+#
+#   foods              f32 (n, 3)  x, y, value
+#   own_parts          f32 (n, 3)  x, y, size
+#   top_parts          f32 (n, 3)  x, y, size
+#   target_parts       f32 (n, 3)  x, y, size
+#   preys              f32 (n, 2)  x, y
+#   others             f32 (n, 5)  x, y, ang, size, dead
+#   other_part_counts  u32 (n,)    parts per other slither
+#   other_parts        f32 (n, 3)  x, y, size
+#
+# Every number is rounded to float32 on the way (relative error at most
+# FLOAT32_RTOL), so a binary frame encodes exactly like its JSON payload
+# with each value rounded to float32.
+FLOAT32_RTOL = 2.0 ** -24
+
+PROTOCOL_DELTA = "delta-v1"
+PROTOCOL_BINARY = "binary-v1"
+PROTOCOL_JSON = "json"
+SUPPORTED_PROTOCOLS = (PROTOCOL_DELTA, PROTOCOL_BINARY, PROTOCOL_JSON)
+
+MAGIC = b"SLG\x01"
+FLAG_DEAD = 1
+
+_HEADER = struct.Struct("<4sI8f7I")
+_SECTIONS = (
+    ("foods", 3),
+    ("own_parts", 3),
+    ("top_parts", 3),
+    ("target_parts", 3),
+    ("preys", 2),
+    ("others", 5),
+)
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+def unpack_state(buffer) -> FrameArrays:
+    """
+    Decodes a binary update frame. The entity arrays are read-only float32
+    views over `buffer`; nothing is copied.
+    """
+    if len(buffer) < _HEADER.size:
+        raise ProtocolError(f"Frame too short: {len(buffer)} bytes")
+    magic, flags, *fields = _HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise ProtocolError(f"Bad frame magic: {magic!r}")
+    x, y, ang, size, food_eaten, target_x, target_y, target_ang = fields[:8]
+    counts = fields[8:]
+
+    expected = _HEADER.size + 4 * (
+        sum(n * width for n, (_, width) in zip(counts, _SECTIONS))
+        + counts[5] + 3 * counts[6]
+    )
+    if len(buffer) != expected:
+        raise ProtocolError(f"Frame is {len(buffer)} bytes, header says {expected}")
+
+    offset = _HEADER.size
+    sections = {}
+    for n, (name, width) in zip(counts, _SECTIONS):
+        sections[name] = np.frombuffer(
+            buffer, dtype="<f4", count=n * width, offset=offset).reshape(n, width)
+        offset += 4 * n * width
+    n_others = counts[5]
+    other_part_counts = np.frombuffer(buffer, dtype="<u4", count=n_others, offset=offset)
+    offset += 4 * n_others
+    other_parts = np.frombuffer(
+        buffer, dtype="<f4", count=3 * counts[6], offset=offset).reshape(counts[6], 3)
+
+    others = sections["others"]
+    target_head = None
+    if not (np.isnan(target_x) or np.isnan(target_y)):
+        target_head = (target_x, target_y, target_ang)
+
+    return FrameArrays(
+        agent=(x, y, ang),
+        foods=sections["foods"],
+        own_parts=sections["own_parts"],
+        top_parts=sections["top_parts"],
+        preys=sections["preys"],
+        other_heads=others[:, :4],
+        other_parts=other_parts,
+        target_parts=sections["target_parts"],
+        target_head=target_head,
+        size=size,
+        food_eaten=food_eaten,
+        dead=bool(flags & FLAG_DEAD),
+        others_dead=others[:, 4] != 0,
+        other_part_counts=other_part_counts,
+    )
+
+
+def pack_state(frame: FrameArrays) -> bytes:
+    """
+    Inverse of unpack_state; mirrors what client/script.js sends.
+    """
+    target = frame.target_head if frame.target_head is not None else (np.nan,) * 3
+    others = np.column_stack((frame.other_heads, frame.others_dead))
+    arrays = (
+        frame.foods, frame.own_parts, frame.top_parts, frame.target_parts,
+        frame.preys, others,
+    )
+    header = _HEADER.pack(
+        MAGIC, FLAG_DEAD if frame.dead else 0,
+        *frame.agent, frame.size, frame.food_eaten, *target,
+        *(len(a) for a in arrays), len(frame.other_parts),
+    )
+    body = [np.ascontiguousarray(a, dtype="<f4").tobytes() for a in arrays]
+    body.append(np.ascontiguousarray(frame.other_part_counts, dtype="<u4").tobytes())
+    body.append(np.ascontiguousarray(frame.other_parts, dtype="<f4").tobytes())
+    return header + b"".join(body)
+
+
+def decode_message(message, mirror=None):
+    """
+    Splits an incoming WebSocket message into (type, payload). Binary frames
+    decode to FrameArrays; text frames are JSON. delta-v1 frames need the
+    connection's WorldMirror and may also come back as:
+
+    - ("keyframe", None): a keyframe that only checked the mirror
+    - ("resync", None): the mirror is out of sync; send keyframe_request()
+    """
+    if isinstance(message, (bytes, bytearray, memoryview)):
+        if bytes(message[:4]) == DELTA_MAGIC:
+            if mirror is None:
+                raise ProtocolError("delta-v1 frame on a connection without a WorldMirror")
+            return mirror.apply(message)
+        return "update", unpack_state(message)
+    data = json.loads(message)
+    return data["type"], data.get("payload")
+
+
+def handshake(payload):
+    """
+    Builds the reply to a client "init" message, picking the first protocol
+    from the client's list that we support. Clients that do not advertise
+    any keep talking JSON.
+    """
+    offered = (payload or {}).get("protocols", [PROTOCOL_JSON])
+    protocol = next((p for p in offered if p in SUPPORTED_PROTOCOLS), PROTOCOL_JSON)
+    return {"type": "init", "payload": {"protocol": protocol}}
+
+
+def keyframe_request():
+    """
+    Asks a delta-v1 client to send its next frame as a keyframe.
+    """
+    return {"type": "keyframe", "payload": {}}
+
+
+# Game frames between two states until the server says otherwise
+DEFAULT_SEND_EVERY = 10
+# Entity categories the client can cap, keeping the nearest
+CONTROL_CAPS = ("foods", "preys", "others", "other_parts", "top_body_parts")
+# Sections of the state the client can leave out; they are sent empty
+CONTROL_FIELDS = ("foods", "preys", "others", "top_body_parts", "target_slither")
+
+
+def control(send_every=None, view_radius=None, caps=None, fields=None):
+    """
+    Tells the client what to compute and send. Settings left as None keep
+    the client's current value:
+
+    - send_every: game frames between two states
+    - view_radius: distance from the head beyond which entities are left out
+    - caps: most entities kept per CONTROL_CAPS category, nearest first;
+      other_parts counts all other slithers' parts together, and a None
+      cap restores the client's default
+    - fields: the CONTROL_FIELDS the server reads
+    """
+    payload = {}
+    if send_every is not None:
+        if send_every < 1:
+            raise ValueError(f"send_every must be at least 1, got {send_every}")
+        payload["send_every"] = int(send_every)
+    if view_radius is not None:
+        payload["view_radius"] = float(view_radius)
+    if caps is not None:
+        unknown = sorted(set(caps) - set(CONTROL_CAPS))
+        if unknown:
+            raise ValueError(f"Unknown cap categories {unknown}, expected some of {CONTROL_CAPS}")
+        payload["caps"] = {name: None if cap is None else int(cap) for name, cap in caps.items()}
+    if fields is not None:
+        unknown = sorted(set(fields) - set(CONTROL_FIELDS))
+        if unknown:
+            raise ValueError(f"Unknown fields {unknown}, expected some of {CONTROL_FIELDS}")
+        payload["fields"] = list(fields)
+    return {"type": "control", "payload": payload}
+
+
+# -----------------------------------------------------------------------------
+# delta-v1
+# -----------------------------------------------------------------------------
+# Incremental frames. Every entity carries a stable u32 ID assigned by the
+# client, and each frame only lists what changed since the previous one:
+#
+#   magic      4s      b"SLD" + version byte
+#   flags      u32     bit 0: own slither is dead, bit 1: keyframe
+#   seq        u32     frame number, +1 per frame (a check keyframe repeats it)
+#   scalars    8 x f32 as in binary-v1
+#   counts     7 x (u32 removed, u32 upserted), one pair per section
+#
+# followed by, for each section in DELTA_SECTIONS order:
+#
+#   removed         u32 (r,)        IDs that left the section
+#   removed owners  u32 (r,)        their slither IDs (other_parts only)
+#   ids             u32 (u,)        IDs added or moved
+#   owners          u32 (u,)        their slither IDs (other_parts only)
+#   values          f32 (u, width)  their new rows
+#
+# A keyframe lists every entity and no removals. Clients send one to start
+# a stream or after a "keyframe" request, and otherwise every few seconds
+# right after the delta with the same seq, so the server can check its
+# mirror against it.
+DELTA_MAGIC = b"SLD\x01"
+FLAG_KEYFRAME = 2
+
+_DELTA_HEADER = struct.Struct("<4sII8f14I")
+DELTA_SECTIONS = (
+    ("foods", 3),
+    ("own_parts", 3),
+    ("top_parts", 3),
+    ("target_parts", 3),
+    ("preys", 2),
+    ("others", 5),
+    ("other_parts", 3),
+)
+_OWNED = "other_parts"
+
+
+class _MirrorSection:
+    """
+    One section of a WorldMirror. Rows are kept sorted by key, the entity
+    ID, or (owner << 32 | ID) for owned parts so that each slither's parts
+    stay contiguous. Deltas are applied with searchsorted, and moved rows
+    are patched in place.
+    """
+
+    def __init__(self, width):
+        self.keys = np.empty(0, dtype=np.uint64)
+        self.values = np.empty((0, width), dtype=np.float32)
+
+    def reset(self, keys, values):
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        self.values = values[order]
+
+    def _find(self, keys):
+        pos = np.searchsorted(self.keys, keys)
+        found = pos < len(self.keys)
+        found[found] = self.keys[pos[found]] == keys[found]
+        return pos, found
+
+    def apply(self, removed, keys, values):
+        if len(removed):
+            pos, found = self._find(removed)
+            keep = np.ones(len(self.keys), dtype=bool)
+            keep[pos[found]] = False
+            self.keys, self.values = self.keys[keep], self.values[keep]
+        if not len(keys):
+            return
+        pos, found = self._find(keys)
+        # Moved entities: overwrite their rows
+        self.values[pos[found]] = values[found]
+        new = ~found
+        if not new.any():
+            return
+        # New entities: insert at their sorted positions. Client IDs only grow,
+        # so they usually all go at the end.
+        order = np.argsort(keys[new], kind="stable")
+        new_keys, new_values = keys[new][order], values[new][order]
+        if not len(self.keys) or new_keys[0] > self.keys[-1]:
+            self.keys = np.concatenate((self.keys, new_keys))
+            self.values = np.concatenate((self.values, new_values))
+        else:
+            at = pos[new][order]
+            self.keys = np.insert(self.keys, at, new_keys)
+            self.values = np.insert(self.values, at, new_values, axis=0)
+
+    def matches(self, keys, values):
+        order = np.argsort(keys, kind="stable")
+        # Compare bit patterns so NaNs and -0.0 round-trip exactly
+        return (np.array_equal(self.keys, keys[order])
+                and np.array_equal(self.values.view(np.uint32), values[order].view(np.uint32)))
+
+
+class WorldMirror:
+    """
+    Server-side copy of a delta-v1 client's world. Each frame patches the
+    mirror and yields a FrameArrays snapshot of it. Keyframes resynchronize
+    the mirror, or check it when they repeat the last delta's seq;
+    `counters` tracks deltas, keyframes, failed checks and resyncs.
+    """
+
+    def __init__(self):
+        self.sections = {name: _MirrorSection(width) for name, width in DELTA_SECTIONS}
+        self.seq = None
+        self.synced = False
+        self.counters = {"deltas": 0, "keyframes": 0, "mismatches": 0, "resyncs": 0}
+
+    def apply(self, buffer):
+        if len(buffer) < _DELTA_HEADER.size:
+            raise ProtocolError(f"Frame too short: {len(buffer)} bytes")
+        magic, flags, seq, *fields = _DELTA_HEADER.unpack_from(buffer, 0)
+        scalars, counts = fields[:8], fields[8:]
+        parsed = self._parse(buffer, counts)
+
+        if flags & FLAG_KEYFRAME:
+            self.counters["keyframes"] += 1
+            check = self.synced and seq == self.seq
+            if check and not all(
+                self.sections[name].matches(keys, values)
+                for name, (_, keys, values) in parsed.items()
+            ):
+                self.counters["mismatches"] += 1
+                print(f"delta-v1 mirror diverged from keyframe {seq}; resynchronized")
+            for name, (_, keys, values) in parsed.items():
+                self.sections[name].reset(keys, values)
+            self.seq, self.synced = seq, True
+            if check:
+                return "keyframe", None
+        elif not self.synced or seq != self.seq + 1:
+            # A lost or reordered delta: everything until a keyframe is suspect
+            if self.synced:
+                self.counters["resyncs"] += 1
+            self.synced = False
+            return "resync", None
+        else:
+            self.counters["deltas"] += 1
+            for name, (removed, keys, values) in parsed.items():
+                self.sections[name].apply(removed, keys, values)
+            self.seq = seq
+
+        return "update", self.snapshot(scalars, flags)
+
+    @staticmethod
+    def _parse(buffer, counts):
+        expected = _DELTA_HEADER.size + 4 * sum(
+            (r + u) * (1 + (name == _OWNED)) + u * width
+            for (name, width), r, u in zip(DELTA_SECTIONS, counts[0::2], counts[1::2]))
+        if len(buffer) != expected:
+            raise ProtocolError(f"Frame is {len(buffer)} bytes, header says {expected}")
+
+        offset = _DELTA_HEADER.size
+
+        def take(dtype, count):
+            nonlocal offset
+            array = np.frombuffer(buffer, dtype=dtype, count=count, offset=offset)
+            offset += 4 * count
+            return array
+
+        def take_keys(count, owned):
+            keys = take("<u4", count).astype(np.uint64)
+            if owned:
+                keys |= take("<u4", count).astype(np.uint64) << np.uint64(32)
+            return keys
+
+        parsed = {}
+        for (name, width), r, u in zip(DELTA_SECTIONS, counts[0::2], counts[1::2]):
+            owned = name == _OWNED
+            removed = take_keys(r, owned)
+            upserted = take_keys(u, owned)
+            parsed[name] = (removed, upserted, take("<f4", u * width).reshape(u, width))
+        return parsed
+
+    def snapshot(self, scalars, flags) -> FrameArrays:
+        """
+        FrameArrays copy of the mirror, safe to keep after later patches.
+        Rows come in entity ID order rather than the client's, and other
+        slithers' parts are grouped by owner in the order of `others`.
+        """
+        x, y, ang, size, food_eaten, target_x, target_y, target_ang = scalars
+        s = self.sections
+        others = s["others"]
+        parts = s["other_parts"]
+        # Parts are sorted by owner, and owners are in the same order as others
+        owners = others.keys << np.uint64(32)
+        starts = np.searchsorted(parts.keys, owners)
+        ends = np.searchsorted(parts.keys, owners + np.uint64(2**32))
+        counts = (ends - starts).astype(np.uint32)
+        if counts.sum() == len(parts.keys):
+            other_parts = parts.values.copy()
+        else:
+            # Drop parts whose owner is not (or no longer) in view
+            slices = [parts.values[a:b] for a, b in zip(starts, ends)]
+            if slices:
+                other_parts = np.concatenate(slices)
+            else:
+                other_parts = np.empty((0, parts.values.shape[1]), dtype=np.float32)
+
+        target_head = None
+        if not (np.isnan(target_x) or np.isnan(target_y)):
+            target_head = (target_x, target_y, target_ang)
+        return FrameArrays(
+            agent=(x, y, ang),
+            foods=s["foods"].values.copy(),
+            own_parts=s["own_parts"].values.copy(),
+            top_parts=s["top_parts"].values.copy(),
+            target_parts=s["target_parts"].values.copy(),
+            preys=s["preys"].values.copy(),
+            other_heads=others.values[:, :4].copy(),
+            others_dead=others.values[:, 4] != 0,
+            other_part_counts=counts,
+            other_parts=other_parts,
+            target_head=target_head,
+            size=size,
+            food_eaten=food_eaten,
+            dead=bool(flags & FLAG_DEAD),
+        )
+
+
+class DeltaEncoder:
+    """
+    Python counterpart of the delta-v1 encoder in client/script.js, used to
+    produce delta streams from recorded or simulated frames.
+
+    encode() takes a FrameArrays, the entity IDs of each section's rows and
+    the owning slither ID of each row of other_parts.
+    """
+
+    def __init__(self, keyframe_interval=30):
+        self.keyframe_interval = keyframe_interval
+        self.seq = 0
+        self._sent = None
+
+    @staticmethod
+    def _sections(frame, ids, owners):
+        others = np.column_stack((frame.other_heads, frame.others_dead))
+        rows = dict(
+            foods=frame.foods, own_parts=frame.own_parts, top_parts=frame.top_parts,
+            target_parts=frame.target_parts, preys=frame.preys, others=others,
+            other_parts=frame.other_parts,
+        )
+        sections = {}
+        for name, _ in DELTA_SECTIONS:
+            section_ids = np.asarray(ids[name], dtype="<u4")
+            # Key rows like the mirror does, so owned parts carry their owner
+            section_owners = np.asarray(owners, dtype="<u4") if name == _OWNED else None
+            sections[name] = (section_ids, section_owners, np.ascontiguousarray(rows[name], dtype="<f4"))
+        return sections
+
+    def encode(self, frame: FrameArrays, ids, owners=(), keyframe=False):
+        """
+        Returns the messages to send for `frame`: a keyframe (the first
+        frame, on request, or when it is smaller than the delta), a delta,
+        or a delta followed by a check keyframe.
+        """
+        sections = self._sections(frame, ids, owners)
+        self.seq += 1
+        if keyframe or self._sent is None:
+            messages = [self._pack(frame, self._full(sections), FLAG_KEYFRAME)]
+        else:
+            delta = self._pack(frame, self._delta(sections), 0)
+            full = self._pack(frame, self._full(sections), FLAG_KEYFRAME)
+            # When most entities moved a keyframe is the smaller message
+            if len(full) <= len(delta):
+                return self._remember(sections, [full])
+            messages = [delta]
+            if self.seq % self.keyframe_interval == 0:
+                messages.append(full)
+        return self._remember(sections, messages)
+
+    def _remember(self, sections, messages):
+        self._sent = {
+            name: {key: row for key, row in zip(self._keys(ids, owners), values.view("<u4").tolist())}
+            for name, (ids, owners, values) in sections.items()
+        }
+        return messages
+
+    @staticmethod
+    def _keys(ids, owners):
+        return ids.tolist() if owners is None else list(zip(owners.tolist(), ids.tolist()))
+
+    @staticmethod
+    def _full(sections):
+        empty = np.empty(0, dtype="<u4")
+        return {name: ((empty, None if owners is None else empty), (ids, owners), values)
+                for name, (ids, owners, values) in sections.items()}
+
+    def _delta(self, sections):
+        delta = {}
+        for name, (ids, owners, values) in sections.items():
+            sent = self._sent[name]
+            keys = self._keys(ids, owners)
+            current = set(keys)
+            gone = [key for key in sent if key not in current]
+            changed = [k for k, (key, row) in enumerate(zip(keys, values.view("<u4").tolist()))
+                       if sent.get(key) != row]
+            if owners is None:
+                removed = (np.array(gone, dtype="<u4"), None)
+                upserted = (ids[changed], None)
+            else:
+                gone = np.array(gone, dtype="<u4").reshape(-1, 2)
+                removed = (gone[:, 1].copy(), gone[:, 0].copy())
+                upserted = (ids[changed], owners[changed])
+            delta[name] = (removed, upserted, values[changed])
+        return delta
+
+    def _pack(self, frame, sections, flags):
+        target = frame.target_head if frame.target_head is not None else (np.nan,) * 3
+        counts = []
+        body = []
+        for name, _ in DELTA_SECTIONS:
+            removed, upserted, values = sections[name]
+            counts += [len(removed[0]), len(upserted[0])]
+            for ids, owners in (removed, upserted):
+                body.append(ids.tobytes())
+                if owners is not None:
+                    body.append(owners.tobytes())
+            body.append(values.tobytes())
+        header = _DELTA_HEADER.pack(
+            DELTA_MAGIC, flags | (FLAG_DEAD if frame.dead else 0), self.seq,
+            *frame.agent, frame.size, frame.food_eaten, *target, *counts)
+        return header + b"".join(body)
@@ -0,0 +1,270 @@
+import mmap
+import queue
+import struct
+import threading
+import zlib
+import numpy as np
+from encoder import FrameArrays
+from protocol import pack_state, unpack_state
+from slither_env import GameConnection
+
+# Trace files hold a session's incoming states and outgoing actions:
+#
+#   b"SLGTRC01"
+#   chunk*       CHUNK header + zlib(record table + packed states)
+#   index        chunk table + one INDEX_DTYPE row per record
+#   trailer      TRAILER (index offset, chunk count, end magic)
+#
+# States are stored as binary-v1 frames (see protocol.py), so replay decodes
+# them straight into FrameArrays. If a recording is cut short the trailer is
+# missing and the reader rebuilds the index by walking the chunk headers.
+FILE_MAGIC = b"SLGTRC01"
+END_MAGIC = b"SLGTEND1"
+CHUNK = struct.Struct("<4sIII")  # b"CHNK", n_records, raw_len, comp_len
+TRAILER = struct.Struct("<QQ8s")  # index offset, n_chunks, END_MAGIC
+
+RECORD_DTYPE = np.dtype([
+    ("episode", "<u4"), ("step", "<u4"), ("offset", "<u4"), ("length", "<u4"),
+    ("action", "<f4", (3,)),
+])
+CHUNK_DTYPE = np.dtype([
+    ("offset", "<u8"), ("n_records", "<u4"), ("raw_len", "<u4"), ("comp_len", "<u4"),
+])
+INDEX_DTYPE = np.dtype([
+    ("episode", "<u4"), ("step", "<u4"), ("chunk", "<u4"), ("slot", "<u4"),
+])
+
+_NO_ACTION = np.full(3, np.nan, dtype=np.float32)
+_CLOSE = object()
+
+
+class TraceRecorder:
+    """
+    Streams states and actions to a trace file from a background thread,
+    so recording costs the caller one queue put per message.
+
+    Each state is paired with the first action set after it; states that
+    get no action before the next one arrives are stored with NaN actions.
+    A state flagged dead ends the current episode.
+    """
+
+    def __init__(self, path, records_per_chunk=256, compression_level=6):
+        self.path = path
+        self.records_per_chunk = records_per_chunk
+        self.compression_level = compression_level
+        self._queue = queue.SimpleQueue()
+        self._file = open(path, "wb")
+        self._file.write(FILE_MAGIC)
+        self._chunks = []
+        self._index = []
+        self._thread = threading.Thread(target=self._run, name="trace-recorder", daemon=True)
+        self._thread.start()
+
+    def record_state(self, state):
+        self._queue.put(("state", state))
+
+    def record_action(self, action):
+        self._queue.put(("action", action))
+
+    def close(self):
+        self._queue.put((_CLOSE, None))
+        self._thread.join()
+
+    def _run(self):
+        episode, step = 0, 0
+        pending = None
+        records = []
+        while True:
+            kind, item = self._queue.get()
+            action = None
+            if kind == "action":
+                if pending is not None:
+                    action = np.asarray(item, dtype=np.float32)
+            elif pending is not None:
+                action = _NO_ACTION
+
+            if action is not None:
+                records.append((episode, step, pending, action))
+                if pending.dead:
+                    episode, step = episode + 1, 0
+                else:
+                    step += 1
+                pending = None
+                if len(records) >= self.records_per_chunk:
+                    self._write_chunk(records)
+                    records = []
+
+            if kind is _CLOSE:
+                break
+            if kind == "state":
+                pending = item if isinstance(item, FrameArrays) else FrameArrays.from_state(item)
+        if records:
+            self._write_chunk(records)
+        self._write_index()
+        self._file.close()
+
+    def _write_chunk(self, records):
+        states = [pack_state(frame) for _, _, frame, _ in records]
+        table = np.zeros(len(records), dtype=RECORD_DTYPE)
+        offset = 0
+        for row, (episode, step, _, action), blob in zip(table, records, states):
+            row["episode"], row["step"] = episode, step
+            row["offset"], row["length"] = offset, len(blob)
+            row["action"] = action
+            offset += len(blob)
+        raw = table.tobytes() + b"".join(states)
+        compressed = zlib.compress(raw, self.compression_level)
+
+        chunk_id = len(self._chunks)
+        self._chunks.append((self._file.tell(), len(records), len(raw), len(compressed)))
+        self._index.extend(
+            (episode, step, chunk_id, slot)
+            for slot, (episode, step, _, _) in enumerate(records))
+        self._file.write(CHUNK.pack(b"CHNK", len(records), len(raw), len(compressed)))
+        self._file.write(compressed)
+
+    def _write_index(self):
+        index_offset = self._file.tell()
+        self._file.write(np.array(self._chunks, dtype=CHUNK_DTYPE).tobytes())
+        self._file.write(np.array(self._index, dtype=INDEX_DTYPE).tobytes())
+        self._file.write(TRAILER.pack(index_offset, len(self._chunks), END_MAGIC))
+
+
+class TraceReader:
+    """
+    Random access over a trace file. The file is memory-mapped and chunks
+    are decompressed on demand, so only the index is held in memory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(FILE_MAGIC)] != FILE_MAGIC:
+            raise ValueError(f"{path} is not a trace file")
+        self.chunks, self.index = self._load_index()
+        self._cached_chunk = None
+        self._cached = None
+
+        # First record of every episode, for (episode, step) lookups
+        self.episodes = np.unique(self.index["episode"])
+        self._episode_start = np.searchsorted(self.index["episode"], self.episodes)
+
+    def _load_index(self):
+        buf = self._mmap
+        if len(buf) >= len(FILE_MAGIC) + TRAILER.size:
+            index_offset, n_chunks, magic = TRAILER.unpack_from(buf, len(buf) - TRAILER.size)
+            if magic == END_MAGIC:
+                chunks = np.frombuffer(buf, dtype=CHUNK_DTYPE, count=n_chunks, offset=index_offset)
+                n_records = int(chunks["n_records"].sum())
+                index = np.frombuffer(
+                    buf, dtype=INDEX_DTYPE, count=n_records,
+                    offset=index_offset + chunks.nbytes)
+                return chunks.copy(), index.copy()
+        return self._rebuild_index()
+
+    def _rebuild_index(self):
+        """
+        Walks the chunk headers of a trace whose recording never finished.
+        """
+        buf = self._mmap
+        chunks, index = [], []
+        offset = len(FILE_MAGIC)
+        while offset + CHUNK.size <= len(buf):
+            magic, n_records, raw_len, comp_len = CHUNK.unpack_from(buf, offset)
+            if magic != b"CHNK" or offset + CHUNK.size + comp_len > len(buf):
+                break
+            chunk_id = len(chunks)
+            chunks.append((offset, n_records, raw_len, comp_len))
+            table = self._decompress(offset, comp_len)[:n_records * RECORD_DTYPE.itemsize]
+            table = np.frombuffer(table, dtype=RECORD_DTYPE)
+            index.extend(
+                (int(row["episode"]), int(row["step"]), chunk_id, slot)
+                for slot, row in enumerate(table))
+            offset += CHUNK.size + comp_len
+        return np.array(chunks, dtype=CHUNK_DTYPE), np.array(index, dtype=INDEX_DTYPE)
+
+    def _decompress(self, offset, comp_len):
+        start = offset + CHUNK.size
+        return zlib.decompress(memoryview(self._mmap)[start:start + comp_len])
+
+    def _chunk(self, chunk_id):
+        if chunk_id != self._cached_chunk:
+            chunk = self.chunks[chunk_id]
+            raw = self._decompress(int(chunk["offset"]), int(chunk["comp_len"]))
+            table = np.frombuffer(raw, dtype=RECORD_DTYPE, count=int(chunk["n_records"]))
+            self._cached_chunk = chunk_id
+            self._cached = (raw, table, table.nbytes)
+        return self._cached
+
+    def __len__(self):
+        return len(self.index)
+
+    def record(self, i):
+        """
+        Returns (FrameArrays, action) for the i-th record in the trace.
+        The action is NaN where none was sent for that state.
+        """
+        entry = self.index[i]
+        raw, table, base = self._chunk(int(entry["chunk"]))
+        row = table[int(entry["slot"])]
+        start = base + int(row["offset"])
+        state = unpack_state(memoryview(raw)[start:start + int(row["length"])])
+        return state, row["action"]
+
+    def position(self, episode, step=0):
+        """
+        Record number of `step` within `episode`.
+        """
+        k = np.searchsorted(self.episodes, episode)
+        if k == len(self.episodes) or self.episodes[k] != episode:
+            raise KeyError(f"No episode {episode} in {self.path}")
+        i = int(self._episode_start[k]) + step
+        if i >= len(self.index) or self.index[i]["episode"] != episode:
+            raise KeyError(f"Episode {episode} has no step {step}")
+        return i
+
+    def read(self, episode, step):
+        return self.record(self.position(episode, step))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.record(i)
+
+    def close(self):
+        self._cached = None
+        self._mmap.close()
+        self._file.close()
+
+
+class ReplayConnection(GameConnection):
+    """
+    A GameConnection fed from a trace file instead of a live client. Each
+    get_state returns the next recorded state immediately, so a SlitherEnv
+    on top of it replays as fast as it can step. The recorded action for
+    the current state is kept in `recorded_action`.
+    """
+
+    def __init__(self, path, episode=0, step=0, loop=True):
+        super().__init__()
+        self.reader = TraceReader(path)
+        self.loop = loop
+        self.position = self.reader.position(episode, step)
+        self.recorded_action = None
+
+    def seek(self, episode, step=0):
+        self.position = self.reader.position(episode, step)
+
+    def get_state(self, timeout=None):
+        if self.position >= len(self.reader):
+            if not self.loop:
+                return None
+            self.position = 0
+        state, self.recorded_action = self.reader.record(self.position)
+        self.position += 1
+        self.latest_state = state
+        return state
+
+    def close(self):
+        super().close()
+        self.reader.close()
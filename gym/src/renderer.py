@@ -1,18 +1,150 @@
-import asyncio
-from typing import TYPE_CHECKING
-# if TYPE_CHECKING:
-from slither_env import SlitherEnv, GameConnection
-
-async def render(connection: GameConnection, env: SlitherEnv):
-    last_state = None
-    try:
-        while True:
-            state = connection.latest_state
-            if last_state != state:
-                last_state = state
-                obs = env.encode_state(state)
-                env.render(obs)
-            # Add a small delay to yield control to the event loop
-            await asyncio.sleep(0.1)
-    except Exception as e:
-        print(f"Error in render loop: {e}")
+import threading
+import time
+import numpy as np
+from encoder import NUM_CHANNELS, FrameArrays
+
+# Colours of the drawn channels; where several overlap the last one wins
+CHANNEL_COLORS = np.array([
+    (255, 0, 0),      # Food (red scaled by value, see obs_to_rgb)
+    (255, 255, 255),  # Slither Head
+    (0, 255, 0),      # Own Slither
+    (0, 0, 255),      # Top Body Parts
+    (255, 255, 0),    # Preys
+    (255, 255, 255),  # Other Slithers' Head
+    (255, 0, 255),    # Other Slithers' Body
+    (0, 255, 255),    # Other Slithers' Size
+], dtype=np.uint8)
+
+
+def obs_to_rgb(obs):
+    """
+    (C, W, H) observation -> (W, H, 3) uint8 image in one vectorized pass,
+    laid out for pygame.surfarray.
+    """
+    occupied = obs[:len(CHANNEL_COLORS)] > 0
+    # Index of the last occupied channel per cell
+    top = len(CHANNEL_COLORS) - 1 - np.argmax(occupied[::-1], axis=0)
+    rgb = CHANNEL_COLORS[top]
+    food = top == 0
+    rgb[food, 0] = np.minimum(255, obs[0][food] * 3 + 155)
+    rgb[~occupied.any(axis=0)] = 0
+    return rgb
+
+
+# Grid channel drawn for each entity type of encoder.encode_entities
+ENTITY_CHANNELS = np.array([0, 1, 2, 3, 4, 5, 6, 7, 9])
+
+
+def entities_to_grid(table, grid_size=128):
+    """
+    Rasterizes an entity table from encoder.encode_entities into grid
+    channels, so it can be drawn like a grid observation.
+    """
+    obs = np.zeros((NUM_CHANNELS, grid_size, grid_size), dtype=np.float32)
+    table = table[table[:, 5] > 0]
+    gx = np.clip(((table[:, 0] + 1.0) * grid_size / 2).astype(np.intp), 0, grid_size - 1)
+    gy = np.clip(((table[:, 1] + 1.0) * grid_size / 2).astype(np.intp), 0, grid_size - 1)
+    # Angles can be zero, but the cell should still show up
+    obs[ENTITY_CHANNELS[table[:, 4].astype(np.intp)], gx, gy] = np.maximum(table[:, 2], 1.0)
+    return obs
+
+
+def draw(screen, obs, font, hud=""):
+    """
+    Blits `obs` scaled to whole cells over `screen`, with a line of text.
+    """
+    import pygame
+
+    if obs.ndim == 2:
+        obs = entities_to_grid(obs)
+    grid_w, grid_h = obs.shape[1:]
+    width, height = screen.get_size()
+    cell_w, cell_h = max(1, width // grid_w), max(1, height // grid_h)
+    grid = pygame.surfarray.make_surface(obs_to_rgb(obs))
+    screen.fill((0, 0, 0))
+    screen.blit(pygame.transform.scale(grid, (grid_w * cell_w, grid_h * cell_h)), (0, 0))
+    if hud:
+        screen.blit(font.render(hud, True, (255, 255, 255)), (10, 10))
+    pygame.display.flip()
+
+
+def hud_text(state, step=None):
+    if state is None:
+        return "" if step is None else f"Step: {step}"
+    frame = state if isinstance(state, FrameArrays) else FrameArrays.from_state(state)
+    text = f"Angle: {frame.agent[2]:.2f} | Size: {frame.size:.2f}"
+    return text if step is None else f"Step: {step} | {text}"
+
+
+class Renderer:
+    """
+    Shows observations in a pygame window from a background thread.
+
+    Producers hand over observations they already computed with submit(),
+    which never blocks on drawing: it keeps only the newest pending frame,
+    so frames that arrive faster than `max_fps` or while the previous one
+    is still being drawn are dropped and counted in `dropped`.
+    """
+
+    def __init__(self, window_size=(800, 600), max_fps=30):
+        self.window_size = window_size
+        self.min_interval = 1.0 / max_fps
+        self.drawn = 0
+        self.dropped = 0
+        self._pending = None
+        self._last_submit = 0.0
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="renderer", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def submit(self, obs, state=None, step=None):
+        now = time.perf_counter()
+        if self._stopped.is_set() or now - self._last_submit < self.min_interval:
+            self.dropped += 1
+            return
+        self._last_submit = now
+        # Copy: callers may reuse their observation buffers
+        frame = (np.array(obs, dtype=np.float32), state, step)
+        with self._lock:
+            if self._pending is not None:
+                self.dropped += 1
+            self._pending = frame
+        self._ready.set()
+
+    def _run(self):
+        # Only loaded once a window is opened, so headless processes never pay for it
+        import pygame
+
+        try:
+            pygame.init()
+            screen = pygame.display.set_mode(self.window_size)
+            pygame.display.set_caption('Slither Environment')
+            font = pygame.font.Font(None, 20)
+            while not self._stopped.is_set():
+                # Wake up regularly to keep the window responsive
+                self._ready.wait(0.1)
+                if any(event.type == pygame.QUIT for event in pygame.event.get()):
+                    break
+                with self._lock:
+                    pending, self._pending = self._pending, None
+                    self._ready.clear()
+                if pending is not None:
+                    obs, state, step = pending
+                    draw(screen, obs, font, hud_text(state, step))
+                    self.drawn += 1
+        except Exception as e:
+            print(f"Error in render loop: {e}")
+        finally:
+            self._stopped.set()
+            pygame.quit()
+
+    def close(self):
+        self._stopped.set()
+        self._ready.set()
+        if self._thread.is_alive():
+            self._thread.join()
@@ -0,0 +1,154 @@
+import numpy as np
+from encoder import FrameArrays
+
+KILL_RADIUS = 20.0
+
+
+class BodyIndex:
+    """
+    Uniform-grid spatial index over a set of 2D points. Points are bucketed
+    by cell and sorted by cell key, so a radius query only looks at the
+    cells around each query point instead of at every point.
+    """
+
+    def __init__(self, points, cell_size=KILL_RADIUS):
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        self.cell_size = float(cell_size)
+        keys = self._keys(np.floor(points / self.cell_size).astype(np.int64))
+        order = np.argsort(keys, kind="stable")
+        self.points = points[order]
+        self.cell_keys, self.cell_starts, counts = np.unique(
+            keys[order], return_index=True, return_counts=True)
+        self.cell_ends = self.cell_starts + counts
+
+    def __len__(self):
+        return len(self.points)
+
+    @staticmethod
+    def _keys(cells):
+        # Packs (cx, cy) into one int64; fine while |cy| < 2**31 cells
+        return (cells[..., 0] << 32) + cells[..., 1]
+
+    def count_within(self, queries, radius):
+        """
+        Number of indexed points within `radius` (inclusive) of each query.
+        """
+        queries = np.asarray(queries, dtype=np.float64).reshape(-1, 2)
+        counts = np.zeros(len(queries), dtype=np.intp)
+        if len(queries) == 0 or len(self.points) == 0:
+            return counts
+
+        # Candidate cells: the (2r+1)^2 block around each query's cell
+        reach = int(np.ceil(radius / self.cell_size))
+        steps = np.arange(-reach, reach + 1)
+        offsets = np.stack(np.meshgrid(steps, steps, indexing="ij"), axis=-1).reshape(-1, 2)
+        cells = np.floor(queries / self.cell_size).astype(np.int64)
+        keys = self._keys(cells[:, None, :] + offsets[None, :, :]).ravel()
+        query_ids = np.repeat(np.arange(len(queries)), len(offsets))
+
+        slot = np.searchsorted(self.cell_keys, keys)
+        slot = np.minimum(slot, len(self.cell_keys) - 1)
+        hit = self.cell_keys[slot] == keys
+        slot, query_ids = slot[hit], query_ids[hit]
+        starts, lengths = self.cell_starts[slot], self.cell_ends[slot] - self.cell_starts[slot]
+
+        # Expand each matched cell into the indices of the points it holds
+        total = int(lengths.sum())
+        if total == 0:
+            return counts
+        first = np.cumsum(lengths) - lengths
+        point_ids = np.repeat(starts - first, lengths) + np.arange(total)
+        query_ids = np.repeat(query_ids, lengths)
+
+        d2 = np.sum((self.points[point_ids] - queries[query_ids]) ** 2, axis=1)
+        return np.bincount(query_ids[d2 <= radius * radius], minlength=len(queries))
+
+    def any_within(self, queries, radius):
+        return self.count_within(queries, radius) > 0
+
+
+class RewardContext:
+    """
+    Per-frame data shared by reward components. Spatial indexes are built
+    the first time a component asks for them and reused by the rest.
+    """
+
+    def __init__(self, frame: FrameArrays, cell_size=KILL_RADIUS):
+        self.frame = frame
+        self.cell_size = cell_size
+        self._own_index = None
+
+    @property
+    def own_index(self) -> BodyIndex:
+        if self._own_index is None:
+            self._own_index = BodyIndex(self.frame.own_parts[:, :2], self.cell_size)
+        return self._own_index
+
+
+class RewardComponent:
+    """
+    One additive term of the reward. Subclasses implement __call__ and
+    return the term's value for the frame in `ctx`.
+    """
+
+    def __call__(self, ctx: RewardContext) -> float:
+        raise NotImplementedError
+
+
+class FoodReward(RewardComponent):
+    """
+    Growth since the last frame, scaled by our size.
+    """
+
+    def __init__(self, weight=0.05):
+        self.weight = weight
+
+    def __call__(self, ctx):
+        frame = ctx.frame
+        return max(-1, frame.food_eaten) * (frame.size * self.weight)
+
+
+class KillReward(RewardComponent):
+    """
+    Flat bonus when any visible slither died this frame.
+    """
+
+    def __init__(self, value=100.0):
+        self.value = value
+
+    def __call__(self, ctx):
+        return self.value if ctx.frame.others_dead.any() else 0.0
+
+
+class DeathPenalty(RewardComponent):
+    def __init__(self, value=100.0):
+        self.value = value
+
+    def __call__(self, ctx):
+        return -self.value if ctx.frame.dead else 0.0
+
+
+class KillProximityReward(RewardComponent):
+    """
+    Bonus for every slither that died with its head within `radius` of our
+    body, i.e. most likely by running into us.
+    """
+
+    def __init__(self, radius=KILL_RADIUS, value=100.0):
+        self.radius = radius
+        self.value = value
+
+    def __call__(self, ctx):
+        frame = ctx.frame
+        if not frame.others_dead.any() or len(frame.own_parts) == 0:
+            return 0.0
+        heads = frame.other_heads[frame.others_dead, :2]
+        return self.value * int(ctx.own_index.any_within(heads, self.radius).sum())
+
+
+DEFAULT_REWARD_COMPONENTS = (
+    FoodReward(),
+    KillReward(),
+    DeathPenalty(),
+    KillProximityReward(),
+)
@@ -0,0 +1,88 @@
+import numpy as np
+from stable_baselines3.common.buffers import RolloutBuffer
+
+FLOAT32 = "float32"
+FLOAT16 = "float16"
+SPARSE = "sparse"
+STORAGES = (FLOAT32, FLOAT16, SPARSE)
+
+
+class CompactRolloutBuffer(RolloutBuffer):
+    """
+    RolloutBuffer that keeps observations compact between collection and
+    the gradient epochs, for the mostly-empty observation grids.
+
+    float16: observations are stored at half precision and only turned
+    back into float32 by the policy's preprocessing, per minibatch.
+    sparse:  each observation is stored as the flat indices and float32
+    values of its nonzero cells, and minibatches are densified as they
+    are sampled. Lossless.
+    float32: same as RolloutBuffer.
+
+    Only Box observation spaces are supported.
+    """
+
+    def __init__(self, *args, storage=FLOAT16, **kwargs):
+        if storage not in STORAGES:
+            raise ValueError(f"Unknown rollout storage {storage!r}, expected one of {STORAGES}")
+        self.storage = storage
+        super().__init__(*args, **kwargs)
+
+    def reset(self):
+        if self.storage == FLOAT32:
+            super().reset()
+            return
+        # Let RolloutBuffer allocate everything but a full-size observation array
+        obs_shape = self.obs_shape
+        self.obs_shape = (0,)
+        try:
+            super().reset()
+        finally:
+            self.obs_shape = obs_shape
+        if self.storage == FLOAT16:
+            self.observations = np.zeros((self.buffer_size, self.n_envs, *obs_shape), dtype=np.float16)
+        else:
+            # Per step: nonzero flat indices and values of all envs, back to
+            # back, and where each env's run starts
+            self._indices = [None] * self.buffer_size
+            self._values = [None] * self.buffer_size
+            self._offsets = np.zeros((self.buffer_size, self.n_envs + 1), dtype=np.int64)
+
+    def add(self, obs, *args, **kwargs):
+        if self.storage != SPARSE:
+            super().add(obs, *args, **kwargs)
+            return
+        flat = np.asarray(obs).reshape(self.n_envs, -1)
+        rows, cols = np.nonzero(flat)
+        self._indices[self.pos] = cols.astype(np.int32)
+        self._values[self.pos] = flat[rows, cols].astype(np.float32)
+        np.cumsum(np.bincount(rows, minlength=self.n_envs), out=self._offsets[self.pos, 1:])
+        # RolloutBuffer stores everything else; its observations are empty
+        super().add(self.observations[self.pos], *args, **kwargs)
+
+    def _get_samples(self, batch_inds, env=None):
+        samples = super()._get_samples(batch_inds, env)
+        if self.storage != SPARSE:
+            return samples
+        return samples._replace(observations=self.to_torch(self._densify(batch_inds)))
+
+    def _densify(self, batch_inds):
+        """
+        Dense float32 observations for indices into the flattened buffer,
+        which get() orders env-major: index = env * buffer_size + step.
+        """
+        out = np.zeros((len(batch_inds), int(np.prod(self.obs_shape))), dtype=np.float32)
+        envs, steps = np.divmod(batch_inds, self.buffer_size)
+        for row, (env, step) in enumerate(zip(envs, steps)):
+            start, end = self._offsets[step, env], self._offsets[step, env + 1]
+            out[row, self._indices[step][start:end]] = self._values[step][start:end]
+        return out.reshape((len(batch_inds), *self.obs_shape))
+
+    def observation_nbytes(self):
+        """
+        Bytes held by the stored observations.
+        """
+        if self.storage != SPARSE:
+            return self.observations.nbytes
+        stored = [a.nbytes for a in self._indices + self._values if a is not None]
+        return sum(stored) + self._offsets.nbytes
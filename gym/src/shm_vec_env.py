@@ -0,0 +1,207 @@
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+from gymnasium import spaces
+from stable_baselines3.common.vec_env.base_vec_env import CloudpickleWrapper
+from stable_baselines3.common.vec_env.patch_gym import _patch_env
+from stable_baselines3.common.vec_env.subproc_vec_env import SubprocVecEnv
+
+
+class SharedBuffers:
+    """
+    Named numpy arrays laid out back to back in one SharedMemory block.
+    The creating process owns the block; workers attach to it by name.
+
+    :param specs: (name, shape, dtype) for each array
+    """
+
+    def __init__(self, specs, name=None):
+        self.specs = [(key, tuple(shape), np.dtype(dtype).str) for key, shape, dtype in specs]
+        offsets, size = [], 0
+        for _, shape, dtype in self.specs:
+            # Keep every array aligned for its dtype (and for SIMD loads)
+            size = -(-size // 64) * 64
+            offsets.append(size)
+            size += int(np.prod(shape)) * np.dtype(dtype).itemsize
+        self.owner = name is None
+        # Workers started by the owner share its resource tracker, which
+        # dedups their registrations, so only the owner has to unlink
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=max(size, 1))
+        self.arrays = {
+            key: np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=offset)
+            for (key, shape, dtype), offset in zip(self.specs, offsets)
+        }
+
+    def __getitem__(self, key):
+        return self.arrays[key]
+
+    def attach_args(self):
+        return self.specs, self.shm.name
+
+    def close(self):
+        # Views must go before the mapping can be closed
+        self.arrays = {}
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def _worker(remote, parent_remote, env_fn_wrapper, index):
+    from stable_baselines3.common.env_util import is_wrapped
+
+    parent_remote.close()
+    env = _patch_env(env_fn_wrapper.var())
+    buffers = None
+    while True:
+        try:
+            cmd, data = remote.recv()
+            if cmd == "step":
+                # data: which of the two observation slots to write
+                obs, reward, terminated, truncated, info = env.step(buffers["actions"][index])
+                done = terminated or truncated
+                info["TimeLimit.truncated"] = truncated and not terminated
+                reset_info = {}
+                if done:
+                    buffers["terminal"][index] = obs
+                    obs, reset_info = env.reset()
+                buffers[f"obs{data}"][index] = obs
+                buffers["rewards"][index] = reward
+                buffers["dones"][index] = done
+                remote.send((info, reset_info))
+            elif cmd == "reset":
+                slot, seed, options = data
+                maybe_options = {"options": options} if options else {}
+                obs, reset_info = env.reset(seed=seed, **maybe_options)
+                buffers[f"obs{slot}"][index] = obs
+                remote.send(reset_info)
+            elif cmd == "attach":
+                buffers = SharedBuffers(*data)
+                remote.send(None)
+            elif cmd == "render":
+                remote.send(env.render())
+            elif cmd == "close":
+                env.close()
+                if buffers is not None:
+                    buffers.close()
+                remote.close()
+                break
+            elif cmd == "get_spaces":
+                remote.send((env.observation_space, env.action_space))
+            elif cmd == "env_method":
+                method = env.get_wrapper_attr(data[0])
+                remote.send(method(*data[1], **data[2]))
+            elif cmd == "get_attr":
+                remote.send(env.get_wrapper_attr(data))
+            elif cmd == "has_attr":
+                try:
+                    env.get_wrapper_attr(data)
+                    remote.send(True)
+                except AttributeError:
+                    remote.send(False)
+            elif cmd == "set_attr":
+                remote.send(setattr(env, data[0], data[1]))
+            elif cmd == "is_wrapped":
+                remote.send(is_wrapped(env, data))
+            else:
+                raise NotImplementedError(f"`{cmd}` is not implemented in the worker")
+        except (EOFError, KeyboardInterrupt):
+            break
+
+
+class SharedMemoryVecEnv(SubprocVecEnv):
+    """
+    SubprocVecEnv that moves observations, rewards and dones through shared
+    memory instead of pickling them through the pipes.
+
+    Each worker writes its results in place into its row of preallocated
+    (num_envs, ...) buffers and only sends back the (small) info dicts, so
+    the trainer reads the whole batch without copying or unpickling a
+    single observation. Actions go the other way through a shared buffer.
+
+    Observations are double-buffered: the batch returned by a step is a
+    view that stays valid until the step after next, which covers SB3
+    keeping the previous observation while it steps. Pass `copy=True` to
+    get fresh arrays instead. Terminal observations are copied out of
+    shared memory into their infos.
+
+    Only Box observation spaces are supported.
+    """
+
+    def __init__(self, env_fns, start_method=None, copy=False):
+        self.waiting = False
+        self.closed = False
+        self.copy = copy
+        n_envs = len(env_fns)
+
+        if start_method is None:
+            # Same default as SubprocVecEnv: fork is not thread safe
+            start_method = "forkserver" if "forkserver" in mp.get_all_start_methods() else "spawn"
+        ctx = mp.get_context(start_method)
+
+        self.remotes, self.work_remotes = zip(*[ctx.Pipe() for _ in range(n_envs)])
+        self.processes = []
+        for index, (work_remote, remote, env_fn) in enumerate(zip(self.work_remotes, self.remotes, env_fns)):
+            args = (work_remote, remote, CloudpickleWrapper(env_fn), index)
+            process = ctx.Process(target=_worker, args=args, daemon=True)
+            process.start()
+            self.processes.append(process)
+            work_remote.close()
+
+        self.remotes[0].send(("get_spaces", None))
+        observation_space, action_space = self.remotes[0].recv()
+        if not isinstance(observation_space, spaces.Box):
+            self.close()
+            raise ValueError(f"SharedMemoryVecEnv needs a Box observation space, got {observation_space}")
+        # VecEnv.__init__ sets up seeds and options
+        super(SubprocVecEnv, self).__init__(n_envs, observation_space, action_space)
+
+        obs_shape, obs_dtype = (n_envs, *observation_space.shape), observation_space.dtype
+        self.buffers = SharedBuffers([
+            ("obs0", obs_shape, obs_dtype),
+            ("obs1", obs_shape, obs_dtype),
+            ("terminal", obs_shape, obs_dtype),
+            ("rewards", (n_envs,), np.float32),
+            ("dones", (n_envs,), bool),
+            ("actions", (n_envs, *action_space.shape), action_space.dtype),
+        ])
+        for remote in self.remotes:
+            remote.send(("attach", self.buffers.attach_args()))
+        for remote in self.remotes:
+            remote.recv()
+        self._slot = 0
+
+    def _batch(self, key):
+        return self.buffers[key].copy() if self.copy else self.buffers[key]
+
+    def reset(self):
+        for env_idx, remote in enumerate(self.remotes):
+            remote.send(("reset", (self._slot, self._seeds[env_idx], self._options[env_idx])))
+        self.reset_infos = [remote.recv() for remote in self.remotes]
+        self._reset_seeds()
+        self._reset_options()
+        return self._batch(f"obs{self._slot}")
+
+    def step_async(self, actions):
+        self.buffers["actions"][:] = np.asarray(actions).reshape(self.buffers["actions"].shape)
+        # Write into the slot the caller is not holding on to
+        self._slot ^= 1
+        for remote in self.remotes:
+            remote.send(("step", self._slot))
+        self.waiting = True
+
+    def step_wait(self):
+        results = [remote.recv() for remote in self.remotes]
+        self.waiting = False
+        infos, self.reset_infos = zip(*results)
+        dones = self.buffers["dones"].copy()
+        for i in np.flatnonzero(dones):
+            infos[i]["terminal_observation"] = self.buffers["terminal"][i].copy()
+        return self._batch(f"obs{self._slot}"), self.buffers["rewards"].copy(), dones, infos
+
+    def close(self):
+        if self.closed:
+            return
+        super().close()
+        if getattr(self, "buffers", None) is not None:
+            self.buffers.close()
+            self.buffers = None
@@ -0,0 +1,409 @@
+import numpy as np
+from encoder import FrameArrays
+from slither_env import GameConnection
+
+# One tick corresponds to one client message, i.e. 10 game frames
+ARENA_RADIUS = 4000.0
+BASE_SPEED = 32.0
+BOOST_SPEED = 64.0
+MAX_TURN = 0.6
+BOT_TURN_NOISE = 0.3
+BOOST_THRESHOLD = 0.9
+BOOST_COST = 0.2
+MIN_BOOST_SIZE = 12.0
+START_SIZE = 10.0
+FOOD_GROWTH = 0.1
+PREY_VALUE = 2.0
+PREY_SPEED = 20.0
+EAT_RADIUS = 40.0
+COLLISION_RADIUS = 20.0
+
+# Same view limits as client/script.js
+FOOD_VIEW = 1000.0
+PREY_VIEW = 1000.0
+OTHERS_VIEW = 2000.0
+TOP_PARTS = 200
+OTHER_PART_SIZE = 10.0
+
+
+def n_parts(size, max_parts):
+    return np.clip((5 + size / 2).astype(np.intp), 1, max_parts)
+
+
+class SlitherSimulator:
+    """
+    Headless stand-in for the browser game. Steps `num_arenas` independent
+    arenas at once, each holding our snake, `num_bots` wandering bot snakes,
+    food and prey, entirely as batched NumPy array operations.
+
+    Snake bodies are the trail of past head positions kept in a shared ring
+    buffer, so moving every snake is a single write per tick. Index 0 along
+    the snake axis is always our snake.
+
+    `frame(i)` and `payload(i)` report arena i the way client/script.js
+    would, as a FrameArrays or as the JSON-shaped dict respectively.
+    """
+
+    def __init__(
+        self,
+        num_arenas=1,
+        num_bots=10,
+        num_foods=2000,
+        num_preys=10,
+        max_parts=200,
+        arena_radius=ARENA_RADIUS,
+        seed=None,
+    ):
+        self.num_arenas = num_arenas
+        self.num_bots = num_bots
+        self.num_foods = num_foods
+        self.num_preys = num_preys
+        self.max_parts = max_parts
+        self.arena_radius = arena_radius
+        self.rng = np.random.default_rng(seed)
+
+        A, S = num_arenas, num_bots + 1
+        self.heads = np.zeros((A, S, 2))
+        self.angles = np.zeros((A, S))
+        self.sizes = np.zeros((A, S))
+        self.killed = np.zeros((A, S), dtype=bool)
+        self.trails = np.zeros((A, S, max_parts, 2))
+        self._tick = 0
+
+        self.foods = np.zeros((A, num_foods, 2))
+        self.food_values = np.zeros((A, num_foods))
+        self.preys = np.zeros((A, num_preys, 2))
+        self.prey_angles = np.zeros((A, num_preys))
+        self.food_eaten = np.zeros(A)
+
+        self.reset()
+
+    # -------------------------------------------------------------------------
+    # Spawning
+    # -------------------------------------------------------------------------
+    def _random_points(self, shape, radius):
+        r = radius * np.sqrt(self.rng.random(shape))
+        theta = self.rng.uniform(0, 2 * np.pi, shape)
+        return np.stack((r * np.cos(theta), r * np.sin(theta)), axis=-1)
+
+    def _spawn_snakes(self, mask, sizes):
+        """
+        Respawns every snake where `mask` (A, S) is set, laying its trail out
+        straight behind the new head.
+        """
+        n = int(mask.sum())
+        if n == 0:
+            return
+        heads = self._random_points(n, 0.7 * self.arena_radius)
+        angles = self.rng.uniform(0, 2 * np.pi, n)
+        self.heads[mask] = heads
+        self.angles[mask] = angles
+        self.sizes[mask] = sizes
+        self.killed[mask] = False
+        back = -np.stack((np.cos(angles), np.sin(angles)), axis=-1)
+        k = np.arange(self.max_parts)
+        slots = (self._tick - k) % self.max_parts
+        trail = heads[:, None, :] + back[:, None, :] * (k[None, :, None] * BASE_SPEED)
+        arena_idx, snake_idx = np.nonzero(mask)
+        self.trails[arena_idx[:, None], snake_idx[:, None], slots[None, :]] = trail
+
+    def _spawn_foods(self, mask):
+        n = int(mask.sum())
+        if n:
+            self.foods[mask] = self._random_points(n, self.arena_radius)
+            self.food_values[mask] = self.rng.integers(1, 11, n)
+
+    def _spawn_preys(self, mask):
+        n = int(mask.sum())
+        if n:
+            self.preys[mask] = self._random_points(n, self.arena_radius)
+            self.prey_angles[mask] = self.rng.uniform(0, 2 * np.pi, n)
+
+    def reset(self, arenas=None):
+        """
+        Restarts the given arenas (all of them by default).
+        """
+        A = np.zeros(self.num_arenas, dtype=bool)
+        A[slice(None) if arenas is None else arenas] = True
+        snakes = np.repeat(A[:, None], self.num_bots + 1, axis=1)
+        bot_sizes = self.rng.uniform(START_SIZE, 300.0, snakes.shape)
+        bot_sizes[:, 0] = START_SIZE
+        self._spawn_snakes(snakes, bot_sizes[snakes])
+        self._spawn_foods(np.repeat(A[:, None], self.num_foods, axis=1))
+        self._spawn_preys(np.repeat(A[:, None], self.num_preys, axis=1))
+        self.food_eaten[A] = 0.0
+
+    def respawn_dead(self, hold=None):
+        """
+        Respawns our snake in arenas where it died, and every killed bot.
+        Our snake stays dead in arenas set in the (num_arenas,) mask `hold`.
+        """
+        dead = self.killed.copy()
+        if hold is not None:
+            dead[:, 0] &= ~np.asarray(hold, dtype=bool)
+        if not dead.any():
+            return
+        sizes = self.rng.uniform(START_SIZE, 300.0, dead.shape)
+        sizes[:, 0] = START_SIZE
+        self._spawn_snakes(dead, sizes[dead])
+        self.food_eaten[dead[:, 0]] = 0.0
+
+    # -------------------------------------------------------------------------
+    # Stepping
+    # -------------------------------------------------------------------------
+    def step(self, actions, hold=None):
+        """
+        Advances every arena by one tick. `actions` is (num_arenas, 3) of
+        (xt, yt, accelerate) as sent to the client.
+
+        In arenas set in the (num_arenas,) mask `hold`, a dead snake of ours
+        is not respawned: it stays dead where it is, and does not eat or
+        kill bots, while the rest of the arena plays on.
+        """
+        actions = np.asarray(actions, dtype=np.float64).reshape(self.num_arenas, 3)
+        self.respawn_dead(hold)
+        self._tick += 1
+        frozen = np.zeros(self.num_arenas, dtype=bool) if hold is None else np.asarray(hold, dtype=bool) & self.killed[:, 0]
+
+        # Steering: our snake turns towards (xt, yt), bots wander and avoid the edge
+        steer = np.any(actions[:, :2] != 0, axis=1)
+        target = np.where(steer, np.arctan2(actions[:, 1], actions[:, 0]), self.angles[:, 0])
+        target = np.broadcast_to(target[:, None], self.angles.shape).copy()
+        wander = self.angles[:, 1:] + self.rng.normal(0.0, BOT_TURN_NOISE, self.angles[:, 1:].shape)
+        homeward = np.arctan2(-self.heads[:, 1:, 1], -self.heads[:, 1:, 0])
+        near_edge = np.hypot(*self.heads[:, 1:].transpose(2, 0, 1)) > 0.8 * self.arena_radius
+        target[:, 1:] = np.where(near_edge, homeward, wander)
+        turn = (target - self.angles + np.pi) % (2 * np.pi) - np.pi
+        self.angles = (self.angles + np.clip(turn, -MAX_TURN, MAX_TURN)) % (2 * np.pi)
+
+        speed = np.full(self.angles.shape, BASE_SPEED)
+        boost = (actions[:, 2] > BOOST_THRESHOLD) & (self.sizes[:, 0] > MIN_BOOST_SIZE)
+        boost &= ~frozen
+        speed[:, 0] = np.where(boost, BOOST_SPEED, np.where(frozen, 0.0, BASE_SPEED))
+        size_before = self.sizes[:, 0].copy()
+        self.sizes[:, 0] -= boost * BOOST_COST
+
+        self.heads += speed[..., None] * np.stack((np.cos(self.angles), np.sin(self.angles)), axis=-1)
+        self.trails[:, :, self._tick % self.max_parts] = self.heads
+
+        head = self.heads[:, 0]
+
+        # Food and prey near our head are eaten and respawn elsewhere
+        eaten = (np.sum((self.foods - head[:, None]) ** 2, axis=-1) < EAT_RADIUS ** 2) & ~frozen[:, None]
+        self.sizes[:, 0] += FOOD_GROWTH * np.sum(self.food_values * eaten, axis=1)
+        self._spawn_foods(eaten)
+
+        prey_dir = np.stack((np.cos(self.prey_angles), np.sin(self.prey_angles)), axis=-1)
+        self.preys += PREY_SPEED * prey_dir
+        self.prey_angles += self.rng.normal(0.0, BOT_TURN_NOISE, self.prey_angles.shape)
+        caught = (np.sum((self.preys - head[:, None]) ** 2, axis=-1) < EAT_RADIUS ** 2) & ~frozen[:, None]
+        self.sizes[:, 0] += PREY_VALUE * caught.sum(axis=1)
+        escaped = np.hypot(*self.preys.transpose(2, 0, 1)) > self.arena_radius
+        self._spawn_preys(caught | escaped)
+        self.food_eaten = self.sizes[:, 0] - size_before
+
+        # Collisions: our head against bot bodies, bot heads against ours
+        bodies, valid = self._bodies()
+        d_ours = np.sum((bodies[:, 1:] - head[:, None, None]) ** 2, axis=-1)
+        hit_bot = np.any((d_ours < COLLISION_RADIUS ** 2) & valid[:, 1:], axis=(1, 2))
+        out_of_bounds = np.hypot(head[:, 0], head[:, 1]) > self.arena_radius
+        self.killed[:, 0] = hit_bot | out_of_bounds | frozen
+
+        own = bodies[:, 0]
+        d_bots = np.sum((self.heads[:, 1:, None] - own[:, None]) ** 2, axis=-1)
+        self.killed[:, 1:] = np.any(
+            (d_bots < COLLISION_RADIUS ** 2) & valid[:, :1], axis=2) & ~self.killed[:, :1]
+
+    def _bodies(self, arenas=slice(None)):
+        """
+        Returns (trails ordered newest first, valid-part mask) for the given
+        arenas, over (..., S, max_parts).
+        """
+        order = (self._tick - np.arange(self.max_parts)) % self.max_parts
+        bodies = self.trails[arenas][..., order, :]
+        valid = np.arange(self.max_parts) < n_parts(self.sizes[arenas], self.max_parts)[..., None]
+        return bodies, valid
+
+    # -------------------------------------------------------------------------
+    # Observations
+    # -------------------------------------------------------------------------
+    def frame(self, i) -> FrameArrays:
+        """
+        Arena i as the client would report it, ready for encode_frame.
+        """
+        head = self.heads[i, 0]
+        bodies, valid = self._bodies(i)
+
+        own = bodies[0][valid[0]]
+        own_parts = np.column_stack((own, np.full(len(own), self.sizes[i, 0])))
+
+        in_view = np.sum((self.foods[i] - head) ** 2, axis=-1) < FOOD_VIEW ** 2
+        foods = np.column_stack((self.foods[i][in_view], self.food_values[i][in_view]))
+        preys = self.preys[i][np.sum((self.preys[i] - head) ** 2, axis=-1) < PREY_VIEW ** 2]
+
+        bots = np.flatnonzero(np.sum((self.heads[i, 1:] - head) ** 2, axis=-1) < OTHERS_VIEW ** 2) + 1
+        other_heads = np.column_stack((
+            self.heads[i, bots], self.angles[i, bots], self.sizes[i, bots]))
+        counts = valid[bots].sum(axis=1).astype(np.uint32)
+        other = bodies[bots][valid[bots]]
+        other_parts = np.column_stack((other, np.full(len(other), OTHER_PART_SIZE)))
+
+        # Closest TOP_PARTS enemy parts, sorted by distance
+        all_parts = bodies[1:][valid[1:]]
+        all_sizes = np.broadcast_to(self.sizes[i, 1:, None], valid[1:].shape)[valid[1:]]
+        dist = np.sum((all_parts - head) ** 2, axis=-1)
+        if len(dist) > TOP_PARTS:
+            nearest = np.argpartition(dist, TOP_PARTS)[:TOP_PARTS]
+        else:
+            nearest = np.arange(len(dist))
+        nearest = nearest[np.argsort(dist[nearest], kind="stable")]
+        top_parts = np.column_stack((all_parts[nearest], all_sizes[nearest]))
+
+        return FrameArrays(
+            agent=(float(head[0]), float(head[1]), float(self.angles[i, 0])),
+            foods=foods,
+            own_parts=own_parts,
+            top_parts=top_parts,
+            preys=preys,
+            other_heads=other_heads,
+            other_parts=other_parts,
+            size=float(self.sizes[i, 0]),
+            food_eaten=float(self.food_eaten[i]),
+            dead=bool(self.killed[i, 0]),
+            others_dead=self.killed[i, bots],
+            other_part_counts=counts,
+        )
+
+    def payload(self, i):
+        """
+        Arena i as the JSON "update" payload client/script.js sends.
+        """
+        frame = self.frame(i)
+        x, y, ang = frame.agent
+
+        def dist(arr):
+            return np.hypot(arr[:, 0] - x, arr[:, 1] - y).tolist()
+
+        def points(arr, d, extra=()):
+            return [
+                dict(zip(("x", "y", *extra, "dist"), (*row, dd)))
+                for row, dd in zip(arr.tolist(), d)
+            ]
+
+        others = []
+        start = 0
+        heads = frame.other_heads
+        for k, count in enumerate(frame.other_part_counts.tolist()):
+            parts = frame.other_parts[start:start + count, :2]
+            start += count
+            others.append({
+                "x": heads[k, 0].item(),
+                "y": heads[k, 1].item(),
+                "ang": heads[k, 2].item(),
+                "parts": points(parts, dist(parts)),
+                "size": heads[k, 3].item(),
+                "dist": float(np.hypot(heads[k, 0] - x, heads[k, 1] - y)),
+                "dead": bool(frame.others_dead[k]),
+            })
+
+        payload = {
+            "slither": {
+                "dead": False,
+                "x": x,
+                "y": y,
+                "parts": points(frame.own_parts, dist(frame.own_parts), ("size",)),
+                "ang": ang,
+                "size": frame.size,
+                "food_eaten": frame.food_eaten,
+            },
+            "target_slither": {},
+            "foods": points(frame.foods, dist(frame.foods), ("value",)),
+            "preys": points(frame.preys, dist(frame.preys)),
+            "others": others,
+            "top_body_parts": points(frame.top_parts, dist(frame.top_parts), ("size",)),
+        }
+        if frame.dead:
+            payload["dead"] = True
+        return payload
+
+
+class SimulatedConnection(GameConnection):
+    """
+    A GameConnection driven by a single-arena simulator instead of a browser.
+    Every get_state advances the arena by one tick using the latest action,
+    so a SlitherEnv on top of it runs as fast as it can step.
+    """
+
+    def __init__(self, simulator: SlitherSimulator = None, as_payload=False, **kwargs):
+        super().__init__()
+        self.simulator = simulator or SlitherSimulator(num_arenas=1, **kwargs)
+        self.as_payload = as_payload
+
+    def get_state(self, timeout=None):
+        action = self.latest_action if self.latest_action is not None else np.zeros(3)
+        self.simulator.step(np.asarray(action)[None])
+        state = self.simulator.payload(0) if self.as_payload else self.simulator.frame(0)
+        self.latest_state = state
+        return state
+
+
+# -----------------------------------------------------------------------------
+# Synthetic payloads
+# -----------------------------------------------------------------------------
+def synthetic_payload(
+    rng: np.random.Generator,
+    n_foods=2000,
+    n_snakes=50,
+    n_parts=200,
+    n_top=200,
+    n_preys=20,
+    n_dead=2,
+    spread=2500.0,
+):
+    """
+    A random JSON payload shaped like the ones client/script.js sends, at
+    the sizes seen in a crowded late game, for benchmarks and export
+    checks. Entities are scattered a little beyond the view range so that
+    clipping is exercised too.
+    """
+    ax, ay = rng.uniform(-20000, 20000, 2)
+
+    def points(n, *extra, radius=None):
+        if radius is None:
+            xy = rng.uniform(-spread, spread, (n, 2))
+        else:
+            # Within `radius` of our head, as the client filters other snakes
+            r = radius * np.sqrt(rng.random(n))
+            theta = rng.uniform(0, 2 * np.pi, n)
+            xy = np.column_stack((r * np.cos(theta), r * np.sin(theta)))
+        xy = xy + (ax, ay)
+        dist = np.hypot(xy[:, 0] - ax, xy[:, 1] - ay)
+        cols = [xy[:, 0], xy[:, 1], dist] + [values for _, values in extra]
+        names = ["x", "y", "dist"] + [name for name, _ in extra]
+        return [dict(zip(names, row)) for row in np.column_stack(cols).tolist()]
+
+    others = []
+    for k in range(n_snakes):
+        head = points(
+            1, ("ang", rng.uniform(0, 2 * np.pi, 1)), ("size", rng.uniform(10, 500, 1)),
+            radius=0.99 * OTHERS_VIEW)[0]
+        head["parts"] = points(n_parts)
+        head["dead"] = k < n_dead
+        others.append(head)
+    own_size = float(rng.uniform(10, 500))
+    return {
+        "slither": {
+            "dead": False,
+            "x": float(ax),
+            "y": float(ay),
+            "parts": points(n_parts, ("size", np.full(n_parts, own_size))),
+            "ang": float(rng.uniform(0, 2 * np.pi)),
+            "size": own_size,
+            "food_eaten": float(rng.integers(0, 5)),
+        },
+        "target_slither": {},
+        "foods": points(n_foods, ("value", rng.integers(1, 11, n_foods).astype(float))),
+        "preys": points(n_preys),
+        "others": others,
+        "top_body_parts": points(n_top, ("size", rng.uniform(10, 500, n_top))),
+    }
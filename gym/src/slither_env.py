@@ -1,43 +1,243 @@
 import numpy as np
 from gymnasium import Env, spaces
-import queue
-import matplotlib.pyplot as plt
-import pygame
+import threading
+from encoder import (
+    ENTITY_CAPACITIES, ENTITY_FEATURES, NUM_CHANNELS, FrameArrays, encode_entities, encode_foveated,
+    encode_frame, foveal_ranges,
+)
+from reward import DEFAULT_REWARD_COMPONENTS, RewardContext
+from renderer import draw, hud_text
+from state_buffer import DROP_OLDEST, StateBuffer
+from metrics import METRICS
+
+
+def is_terminal(state):
+    """
+    Whether a JSON payload or FrameArrays reports our snake dead.
+    """
+    if isinstance(state, FrameArrays):
+        return state.dead
+    return bool(state.get("dead", False))
 
 
 class GameConnection:
-    def __init__(self):
+    """
+    Hands states from a game client to the env and actions back. States go
+    through a bounded StateBuffer whose `policy` decides what happens when
+    the env falls behind (see state_buffer.py); terminal states are never
+    dropped by the policy.
+    """
+
+    def __init__(self, notify: threading.Event = None, recorder=None, policy=DROP_OLDEST, capacity=32):
         self.latest_state = None
         self.latest_action = None
-        self.queue = queue.Queue()
+        self.buffer = StateBuffer(policy, capacity)
         self.rollout_state = False
+        self.closed = False
+        # Optional event shared across connections, set on every new state
+        self.notify = notify
+        # Optional recording.TraceRecorder that sees every state and action
+        self.recorder = recorder
+
+    @property
+    def counters(self):
+        """
+        Frames queued, dropped (by the policy or while training), lagged and blocked.
+        """
+        return self.buffer.counters
 
     def put_state(self, state):
-        if not self.rollout_state:
-            self.latest_state = state
-            self.queue.put(state)
+        """
+        Queues a state from a producer thread. Blocks under the "block"
+        policy; use put_state_async on an event loop.
+        """
+        if self._accept(state):
+            self.buffer.put(state, sticky=is_terminal(state))
+            self._notify()
+
+    async def put_state_async(self, state):
+        if self._accept(state):
+            await self.buffer.put_async(state, sticky=is_terminal(state))
+            self._notify()
+
+    def _accept(self, state):
+        if self.recorder is not None:
+            self.recorder.record_state(state)
+        if self.rollout_state:
+            # The learner is optimizing; nobody will consume this frame
+            self.buffer.counters["dropped"] += 1
+            return False
+        self.latest_state = state
+        return True
+
+    def _notify(self):
+        if self.notify is not None:
+            self.notify.set()
+
+    def get_state(self, timeout=None):
+        """
+        Blocks for the next state. Returns None if `timeout` expires or the
+        connection has been closed.
+        """
+        return self.buffer.get(timeout=timeout)
 
-    def get_state(self):
-        return self.queue.get()
+    async def get_state_async(self, timeout=None):
+        return await self.buffer.get_async(timeout=timeout)
 
     def set_action(self, action):
         self.latest_action = action
+        if self.recorder is not None:
+            self.recorder.record_action(action)
+
+    def close(self):
+        self.closed = True
+        # Wakes up anyone waiting in get_state
+        self.buffer.close()
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+
+
+class ClientPool:
+    """
+    Gives each WebSocket client its own GameConnection in one of `size` slots,
+    so that several game clients can be stepped side by side.
+    """
+
+    def __init__(self, size, recorder_factory=None, policy=DROP_OLDEST, capacity=32):
+        self.size = size
+        # Optional callable returning a TraceRecorder for each new client
+        self.recorder_factory = recorder_factory
+        # StateBuffer settings for every client's connection
+        self.policy = policy
+        self.capacity = capacity
+        self.connections = [None] * size
+        self.activity = threading.Event()
+        self._rollout_state = False
+        self._lock = threading.Lock()
+
+    @property
+    def rollout_state(self):
+        return self._rollout_state
+
+    @rollout_state.setter
+    def rollout_state(self, value):
+        self._rollout_state = value
+        for connection in self.connections:
+            if connection is not None:
+                connection.rollout_state = value
+
+    @property
+    def latest_state(self):
+        for connection in self.connections:
+            if connection is not None and connection.latest_state is not None:
+                return connection.latest_state
+        return None
+
+    def attach(self):
+        """
+        Claims a free slot for a new client. Returns (slot, connection), or
+        (None, None) when every slot is taken.
+        """
+        with self._lock:
+            for slot, current in enumerate(self.connections):
+                if current is None:
+                    recorder = self.recorder_factory() if self.recorder_factory else None
+                    connection = GameConnection(
+                        notify=self.activity, recorder=recorder, policy=self.policy, capacity=self.capacity)
+                    connection.rollout_state = self._rollout_state
+                    self.connections[slot] = connection
+                    self.activity.set()
+                    return slot, connection
+        return None, None
+
+    def detach(self, slot):
+        with self._lock:
+            connection = self.connections[slot]
+            self.connections[slot] = None
+        if connection is not None:
+            connection.close()
+        self.activity.set()
+
+    def active_count(self):
+        return sum(connection is not None for connection in self.connections)
+
+    def close(self):
+        for slot in range(self.size):
+            self.detach(slot)
+
+    async def serve(self, websocket, handle_client, **kwargs):
+        slot, connection = self.attach()
+        if connection is None:
+            print(f"Rejecting {websocket.remote_address}: all {self.size} slots in use")
+            await websocket.close()
+            return
+        print(f"Client {websocket.remote_address} assigned to slot {slot}")
+        try:
+            await handle_client(websocket, connection, **kwargs)
+        finally:
+            print(f"Slot {slot} frames: {connection.counters}")
+            self.detach(slot)
+
+
+GRID = "grid"
+ENTITIES = "entities"
+OBSERVATIONS = (GRID, ENTITIES)
+
+
+def client_caps(observation=GRID):
+    """
+    Most entities per category (see protocol.control) the client needs to
+    send for an observation mode. An entity table keeps no more than its
+    capacity of each type; grids show everything in view.
+    """
+    if observation != ENTITIES:
+        return {}
+    return {
+        "foods": ENTITY_CAPACITIES["food"],
+        "preys": ENTITY_CAPACITIES["prey"],
+        "others": ENTITY_CAPACITIES["other_head"],
+        "other_parts": ENTITY_CAPACITIES["other_part"],
+        "top_body_parts": ENTITY_CAPACITIES["top_part"],
+    }
 
 
 class SlitherEnv(Env):
     metadata = {"render.modes": ["human"]}
 
-    def __init__(self, connection: GameConnection, grid_size=50, view_range=2000):
+    def __init__(self, connection: GameConnection, grid_size=50, view_range=2000, reward_components=None, levels=1,
+                 observation=GRID, decision_interval=1):
         super().__init__()
         self.connection = connection
         self.grid_size = grid_size
         self.view_range = view_range
+        # With levels > 1, a stack of concentric grids out to view_range
+        # (see encoder.encode_foveated) instead of one uniform grid
+        self.levels = levels
+        self.view_ranges = foveal_ranges(levels, view_range)
+        # ENTITIES: a padded table of the entities in view (see
+        # encoder.encode_entities) instead of grids
+        self.observation = observation
+        # States each action is repeated for; only the last one is encoded
+        self.decision_interval = decision_interval
+        # Terms summed by calc_reward; see reward.py
+        self.reward_components = list(reward_components or DEFAULT_REWARD_COMPONENTS)
         self.step_counter = 0  # Initialize a step counter
+        # Returned again by a step that gets no new state
+        self._last_obs = None
+        # Reused by encode_frame, so that encoding into `out` allocates no grid
+        self._scratch = np.empty(grid_size * grid_size, dtype=np.intp)
 
         # Gymnasium spaces
-        self.observation_space = spaces.Box(
-            low=0, high=1, shape=(10, grid_size, grid_size), dtype=np.float32
-        )
+        if observation == ENTITIES:
+            self.observation_space = spaces.Box(
+                low=-np.inf, high=np.inf, shape=(sum(ENTITY_CAPACITIES.values()), len(ENTITY_FEATURES)),
+                dtype=np.float32
+            )
+        else:
+            self.observation_space = spaces.Box(
+                low=0, high=1, shape=(NUM_CHANNELS * levels, grid_size, grid_size), dtype=np.float32
+            )
         # (xt, yt, accelerate)
         self.action_space = spaces.Box(
             low=np.array([-1, -1, 0]),
@@ -47,40 +247,92 @@ class SlitherEnv(Env):
 
         self.window_size = (800, 600)  # Set the window size
         self.screen = None  # Pygame screen
-        self.clock = pygame.time.Clock()
+        self.font = None
+        # Optional renderer.Renderer that is handed each new observation
+        self.viewer = None
+        self.clock = None
 
     def reset(self, seed=None, options=None):
         super().reset(seed=seed)
         # Wait for the next incoming state from the queue
         state = self._wait_for_next_state()
         obs = self.encode_state(state)
+        self._last_obs = obs
+        if self.viewer is not None:
+            self.viewer.submit(obs, state, self.step_counter)
         info = {}
         return obs, info
 
     def step(self, action):
-        # Store the chosen action so the server can send it to the JS client
+        # Store the chosen action so the server can send it to the JS client,
+        # which keeps acting on it until the next decision
         self.connection.set_action(action)
-        # Wait for the next incoming game state
-        next_state = self._wait_for_next_state()
-
-        # Convert to observation, compute reward, check done
-
-        obs = self.encode_state(next_state)
-        reward = self.calc_reward(next_state)
-        done = bool(next_state.get("dead", False))
+        # Wait for the next decision point, summing the rewards on the way
+        frame, reward = self._repeat_action(self._wait_for_next_state)
+        if frame is None:
+            # The connection closed or a replay ran out: truncate the
+            # episode on the last observation, like a stale vec env slot
+            return self._last_obs, 0.0, False, True, {"stale": True}
+
+        # Convert to observation, check done
+        obs = self.encode_state(frame)
+        done = frame.dead
+        self._last_obs = obs
 
         info = {}
         self.step_counter += 1  # Increment the step counter
-        # self.render(obs)
+        if self.viewer is not None:
+            self.viewer.submit(obs, frame, self.step_counter)
         return obs, reward, done, False, info
 
-    def _wait_for_next_state(self):
-        # Just block on the synchronous queue
-        return self.connection.get_state()
+    def _repeat_action(self, get_state):
+        """
+        Lets the current action play out over up to `decision_interval`
+        states from `get_state`, and returns the last one as a FrameArrays
+        with the rewards of all of them. Stops early at a death or when
+        get_state returns None; the frame is None if no state came.
+        """
+        frame, reward = None, 0.0
+        for _ in range(self.decision_interval):
+            state = get_state()
+            if state is None:
+                break
+            frame = self._as_frame(state)
+            reward += self.calc_reward(frame)
+            if frame.dead:
+                break
+        return frame, reward
 
-    def encode_state(self, state):
+    def _wait_for_next_state(self):
+        # Block on the connection's state buffer
+        with METRICS.timer("queue_wait"):
+            return self.connection.get_state()
+
+    @staticmethod
+    def _as_frame(state) -> FrameArrays:
+        # States arrive as JSON dicts from old clients and as FrameArrays
+        # decoded from the binary protocol
+        if isinstance(state, FrameArrays):
+            return state
+        return FrameArrays.from_state(state)
+
+    def encode_state(self, state, out=None):
         """
-        Encodes the game state into a grid-based representation.
+        Encodes the game state into the observation: grids, or an entity
+        table with observation=ENTITIES. Accepts either a JSON payload or a prebuilt FrameArrays, and
+        optionally a preallocated observation-shaped array to fill.
+        """
+        with METRICS.timer("encode_state"):
+            frame = self._as_frame(state)
+            if self.observation == ENTITIES:
+                return encode_entities(frame, self.view_range, out=out)
+            if self.levels > 1:
+                return encode_foveated(frame, self.grid_size, self.view_ranges, out=out, scratch=self._scratch)
+            return encode_frame(frame, self.grid_size, self.view_range, out=out, scratch=self._scratch)
+
+    def _encode_state_loop(self, state):
+        """
+        Reference per-entity encoder. Kept to check the batched encoder against.
         """
         slither = state["slither"]
         target_slither = state["target_slither"]
@@ -189,89 +441,34 @@ class SlitherEnv(Env):
 
     def calc_reward(self, payload):
         """
-        Reward function logic.
+        Reward function logic: the sum of `reward_components` over one frame.
+        The components share a RewardContext, so spatial indexes over the
+        frame are built once.
         """
-        reward = 0.0
-        reward += max(-1, payload["slither"]["food_eaten"]
-                      ) * (payload["slither"]["size"] * 0.05)
-        # If any other slithers died, reward the agent
-        if any(other_snake.get("dead", False) for other_snake in payload["others"]):
-            reward += 100.0
-        # If the agent is dead, penalize it
-        if payload.get("dead", False):
-            reward -= 100.0
-
-        # Check if any other slither's head is within 20 units of your slither's body parts
-        for other_snake in payload["others"]:
-            if other_snake.get("dead", False):
-                head_pos = np.array(
-                    [other_snake["x"], other_snake["y"]])
-                for part in payload["slither"]["parts"]:
-                    part_pos = np.array([part["x"], part["y"]])
-                    distance = np.linalg.norm(head_pos - part_pos)
-                    if distance <= 20:
-                        reward += 100.0
-                        break  # Exit the loop once a reward is given
-        return reward
+        with METRICS.timer("calc_reward"):
+            ctx = RewardContext(self._as_frame(payload))
+            reward = 0.0
+            for component in self.reward_components:
+                reward += component(ctx)
+        return float(reward)
 
     def render(self, obs):
         """
-        Render the grid for visualization using Pygame.
+        Render the grid for visualization using Pygame. Blocks while drawing;
+        set `viewer` to a renderer.Renderer to draw from another thread.
         """
-        if not obs.shape == (10, self.grid_size, self.grid_size):
+        if not obs.shape == self.observation_space.shape:
             return
+        # Only loaded once a window is opened, so headless processes never pay for it
+        import pygame
+
         if self.screen is None:
             pygame.init()
+            self.clock = pygame.time.Clock()
             self.screen = pygame.display.set_mode(self.window_size)
             pygame.display.set_caption('Slither Environment')
-
-        # Clear the screen
-        self.screen.fill((0, 0, 0))  # Black background
-
-        # Define colors for each channel
-        colors = [
-            (255, 0, 0),    # Food
-            (255, 255, 255),  # Slither Head
-            (0, 255, 0),    # Own Slither
-            (0, 0, 255),    # Top Body Parts
-            (255, 255, 0),  # Preys
-            (255, 255, 255),  # Other Slithers' Head
-            (255, 0, 255),  # Other Slithers' Body
-            (0, 255, 255),  # Other Slithers' Size
-        ]
-
-        # Render each channel
-        for i in range(len(colors)):
-            for x in range(self.grid_size):
-                for y in range(self.grid_size):
-                    value = obs[i, x, y]
-                    if value > 0:
-                        if i == 0:
-                            color = (min(255, (value * 3) + 155), 0, 0)
-                        else:
-                            color = colors[i]
-                        # Scale grid coordinates to window size
-                        rect = pygame.Rect(
-                            x * (self.window_size[0] // self.grid_size),
-                            y * (self.window_size[1] // self.grid_size),
-                            self.window_size[0] // self.grid_size,
-                            self.window_size[1] // self.grid_size
-                        )
-                        pygame.draw.rect(self.screen, color, rect)
-        # Text
-        font = pygame.font.Font(None, 20)
-        # Retrieve slither angle and size
-        slither_angle = self.connection.latest_state["slither"].get("ang", 0.0)
-        slither_size = self.connection.latest_state["slither"].get("size", 0.0)
-        # Render text with step counter, slither angle, and size
-        text = font.render(
-            f"Step: {self.step_counter} | Angle: {
-                slither_angle:.2f} | Size: {slither_size:.2f}",
-            True, (255, 255, 255)
-        )
-        self.screen.blit(text, (10, 10))
-
-        pygame.display.flip()  # Update the display
+            self.font = pygame.font.Font(None, 20)
+        draw(self.screen, obs, self.font, hud_text(self.connection.latest_state, self.step_counter))
         self.clock.tick(60)  # Limit to 60 FPS
 
     def close(self):
@@ -280,4 +477,6 @@ class SlitherEnv(Env):
         """
         super().close()
         if self.screen is not None:
+            import pygame
+
             pygame.quit()
@@ -0,0 +1,177 @@
+import asyncio
+import threading
+import time
+from collections import deque
+
+LATEST = "latest"
+DROP_OLDEST = "drop-oldest"
+BLOCK = "block"
+POLICIES = (LATEST, DROP_OLDEST, BLOCK)
+
+
+class StateBuffer:
+    """
+    Bounded FIFO between a producer and a consumer that may live on
+    different threads or on an asyncio event loop. What happens when a put
+    finds the buffer full depends on `policy`:
+
+    - "latest": capacity is 1 and the new item replaces the pending one
+    - "drop-oldest": the oldest item is evicted to make room
+    - "block": the producer waits for the consumer to make room
+
+    Items put with `sticky=True` (e.g. terminal states) are never evicted.
+
+    `counters` tracks items queued, dropped by eviction or rejected, gets
+    that lagged (more items were already waiting behind the one returned),
+    and puts that had to wait for room.
+    """
+
+    def __init__(self, policy=DROP_OLDEST, capacity=32):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown policy {policy!r}, expected one of {POLICIES}")
+        self.policy = policy
+        self.capacity = 1 if policy == LATEST else capacity
+        self.counters = {"queued": 0, "dropped": 0, "lagged": 0, "blocked": 0}
+        self.closed = False
+        self._items = deque()
+        self._cond = threading.Condition()
+        # asyncio futures of coroutines waiting in get_async/put_async
+        self._async_waiters = []
+
+    def __len__(self):
+        return len(self._items)
+
+    # -------------------------------------------------------------------------
+    # Producer side
+    # -------------------------------------------------------------------------
+    def put(self, item, sticky=False, timeout=None):
+        """
+        Adds `item`, blocking under the "block" policy while the buffer is
+        full. Returns False if the item was not queued.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            if self._full() and self.policy == BLOCK:
+                self.counters["blocked"] += 1
+            while self._full() and self.policy == BLOCK and not self.closed:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    self.counters["dropped"] += 1
+                    return False
+                self._cond.wait(remaining)
+            return self._append(item, sticky)
+
+    async def put_async(self, item, sticky=False, timeout=None):
+        """
+        put() for producers on an event loop: waits for room without
+        blocking the loop.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        blocked = False
+        while True:
+            with self._cond:
+                if not (self._full() and self.policy == BLOCK) or self.closed:
+                    return self._append(item, sticky)
+                if not blocked:
+                    self.counters["blocked"] += 1
+                    blocked = True
+                waiter = self._add_waiter(loop)
+            if not await self._wait(waiter, deadline, loop):
+                with self._cond:
+                    self.counters["dropped"] += 1
+                return False
+
+    def _full(self):
+        return len(self._items) >= self.capacity
+
+    def _append(self, item, sticky):
+        if self.closed:
+            return False
+        if self._full():
+            # Evict the oldest item that is allowed to go
+            for i, (_, pinned) in enumerate(self._items):
+                if not pinned:
+                    del self._items[i]
+                    self.counters["dropped"] += 1
+                    break
+        self._items.append((item, sticky))
+        self.counters["queued"] += 1
+        self._notify()
+        return True
+
+    # -------------------------------------------------------------------------
+    # Consumer side
+    # -------------------------------------------------------------------------
+    def get(self, timeout=None):
+        """
+        Blocks for the next item. Returns None if `timeout` expires or the
+        buffer is closed and drained.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while not self._items:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if self.closed or (remaining is not None and remaining <= 0):
+                    return None
+                self._cond.wait(remaining)
+            return self._pop()
+
+    async def get_async(self, timeout=None):
+        """
+        get() for consumers on an event loop.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while True:
+            with self._cond:
+                if self._items:
+                    return self._pop()
+                if self.closed:
+                    return None
+                waiter = self._add_waiter(loop)
+            if not await self._wait(waiter, deadline, loop):
+                return None
+
+    def _pop(self):
+        item, _ = self._items.popleft()
+        if self._items:
+            self.counters["lagged"] += 1
+        self._notify()
+        return item
+
+    # -------------------------------------------------------------------------
+    # Wake-ups
+    # -------------------------------------------------------------------------
+    def _add_waiter(self, loop):
+        waiter = loop.create_future()
+        self._async_waiters.append((loop, waiter))
+        return waiter
+
+    @staticmethod
+    async def _wait(waiter, deadline, loop):
+        timeout = None if deadline is None else deadline - loop.time()
+        if timeout is not None and timeout <= 0:
+            return False
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def _notify(self):
+        # Called with the lock held after every change of state
+        self._cond.notify_all()
+        waiters, self._async_waiters = self._async_waiters, []
+        for loop, waiter in waiters:
+            loop.call_soon_threadsafe(_wake, waiter)
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._notify()
+
+
+def _wake(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
@@ -1,18 +1,44 @@
-from slither_env import GameConnection
+import argparse
+import itertools
+import time
+from slither_env import ClientPool, GameConnection
 import asyncio
-from model import ViTExtractor
+import torch
+from model import EntityAttentionExtractor, FoveatedViTExtractor, SparseViTExtractor, ViTExtractor, set_fast_path
 from websocket_server import start_server
-from renderer import render
+from renderer import Renderer
 from stable_baselines3 import PPO
-from slither_env import SlitherEnv
+from actor_learner import OverlappedPPO
+from slither_env import ENTITIES, GRID, OBSERVATIONS, SlitherEnv
+from vec_env import SimulatorVecEnv, SlitherVecEnv
+from simulator import SimulatedConnection, SlitherSimulator
+from shm_vec_env import SharedMemoryVecEnv
+from recording import ReplayConnection, TraceRecorder
+from state_buffer import DROP_OLDEST, POLICIES
+from checkpoint import BackgroundCheckpointCallback
+from rollout_buffer import FLOAT32, STORAGES, CompactRolloutBuffer
+import metrics
+from utils import add_client_arguments, client_settings
+from metrics import METRICS, PHASE_BUCKETS
 from stable_baselines3.common.callbacks import BaseCallback
 
 GRID_SIZE = 128
+# Cells per side of each grid with --levels > 1; at 3 levels the finest
+# grid has the same cell size as a single GRID_SIZE grid
+FOVEA_GRID_SIZE = 32
 PATCH_SIZE = 8
+N_STEPS = 512
+MODEL_PATH = "output/slither_model"
+EXTRACTORS = {
+    "vit": ViTExtractor,
+    "sparse-vit": SparseViTExtractor,
+    "foveated-vit": FoveatedViTExtractor,
+    "entity-attention": EntityAttentionExtractor,
+}
 
 
 class BackpropagationCallback(BaseCallback):
-    def __init__(self, connection: GameConnection, verbose=0):
+    def __init__(self, connection: GameConnection | ClientPool, verbose=0):
         super(BackpropagationCallback, self).__init__(verbose)
         self.connection = connection
 
@@ -26,27 +52,216 @@ class BackpropagationCallback(BaseCallback):
         self.connection.rollout_state = True
 
 
-async def learn(connection, env):
+class PhaseTimerCallback(BaseCallback):
+    """
+    Records how long each rollout takes, the time from the end of one
+    rollout to the start of the next (PPO's optimization, unless it is
+    overlapped), and the number of env steps.
+    """
+
+    def __init__(self, verbose=0):
+        super().__init__(verbose)
+        self._rollout_start = None
+        self._rollout_end = None
+
+    def _on_step(self) -> bool:
+        METRICS.count("env_steps", self.training_env.num_envs)
+        return True
+
+    def _on_rollout_start(self) -> None:
+        self._rollout_start = time.perf_counter()
+        if self._rollout_end is not None:
+            METRICS.observe("optimize", self._rollout_start - self._rollout_end, PHASE_BUCKETS)
+
+    def _on_rollout_end(self) -> None:
+        self._rollout_end = time.perf_counter()
+        METRICS.observe("rollout", self._rollout_end - self._rollout_start, PHASE_BUCKETS)
+
+
+class RolloutStorageCallback(BaseCallback):
+    """
+    Logs how much memory the rollout's observations take.
+    """
+
+    def _on_step(self) -> bool:
+        return True
+
+    def _on_rollout_end(self) -> None:
+        nbytes = self.locals["rollout_buffer"].observation_nbytes()
+        self.logger.record("rollout/obs_storage_mb", nbytes / 2**20)
+
+
+def observation_kwargs(levels=1, observation=GRID):
+    """
+    SlitherEnv observation arguments: one GRID_SIZE grid, `levels`
+    concentric FOVEA_GRID_SIZE grids, or an entity table.
+    """
+    return dict(grid_size=GRID_SIZE if levels == 1 else FOVEA_GRID_SIZE, levels=levels, observation=observation)
+
+
+def simulated_env(seed, levels=1, observation=GRID, decision_interval=1):
+    """
+    Picklable factory for one simulated arena, built inside a worker process.
+    """
+    def make():
+        simulator = SlitherSimulator(num_arenas=1, seed=seed)
+        return SlitherEnv(connection=SimulatedConnection(simulator), decision_interval=decision_interval,
+                          **observation_kwargs(levels, observation))
+    return make
+
+
+async def learn(connection, env, n_steps=N_STEPS, extractor="vit", overlap=False, storage=FLOAT32,
+                checkpoint_every=0, fused_attention=False, bf16=False, compile=False):
+    extractor_kwargs = dict(num_heads=4)
+    if extractor != "entity-attention":
+        # Entity tables have no patches
+        extractor_kwargs["patch_size"] = PATCH_SIZE
     policy_kwargs = dict(
-        features_extractor_class=ViTExtractor,
-        features_extractor_kwargs=dict(num_heads=4, patch_size=PATCH_SIZE)
+        features_extractor_class=EXTRACTORS[extractor],
+        features_extractor_kwargs=extractor_kwargs
     )
 
-    model = PPO("CnnPolicy", env, verbose=1,
-                policy_kwargs=policy_kwargs, n_steps=512, batch_size=32, learning_rate=0.001)
-    await asyncio.to_thread(model.learn, total_timesteps=50000, callback=BackpropagationCallback(connection))
-    model.save("output/slither_model")
+    algorithm = OverlappedPPO if overlap else PPO
+    model = algorithm("CnnPolicy", env, verbose=1,
+                      policy_kwargs=policy_kwargs, n_steps=n_steps, batch_size=32, learning_rate=0.001,
+                      rollout_buffer_class=CompactRolloutBuffer, rollout_buffer_kwargs=dict(storage=storage))
+    if fused_attention or bf16 or compile:
+        # OverlappedPPO's actor snapshots were copied from the policy already
+        for policy in [model.policy, *getattr(model, "_snapshots", [])]:
+            set_fast_path(policy, fused_attention=fused_attention, bf16=bf16, compile=compile)
+    # Simulated arenas have no live connection to pause during optimization,
+    # and the overlapped learner keeps acting while it optimizes
+    callbacks = []
+    if connection is not None and not overlap:
+        callbacks.append(BackpropagationCallback(connection))
+    if METRICS.enabled:
+        callbacks.append(PhaseTimerCallback())
+    if storage != FLOAT32:
+        callbacks.append(RolloutStorageCallback())
+    if checkpoint_every:
+        callbacks.append(BackgroundCheckpointCallback(MODEL_PATH + ".zip", checkpoint_every, verbose=1))
+    await asyncio.to_thread(model.learn, total_timesteps=50000, callback=callbacks or None)
+    model.save(MODEL_PATH)
     env.close()
 
 
-async def main_async():
-    connection = GameConnection()
-    env = SlitherEnv(connection=connection, grid_size=GRID_SIZE)
-    await asyncio.gather(
-        start_server(connection),
-        render(connection, env),
-        learn(connection, env),
-    )
+async def main_async(num_clients=1, simulate=0, record=None, replay=None, extractor="vit",
+                     buffer_policy=DROP_OLDEST, buffer_size=32, overlap=False, subprocess=False, levels=1,
+                     storage=FLOAT32, checkpoint_every=0, observation=GRID, send_every=None, view_radius=None,
+                     client_fields=None, adapt_send_rate=False, fast_path=None, decision_interval=1):
+    env_args = dict(observation_kwargs(levels, observation), decision_interval=decision_interval)
+    options = dict(extractor=extractor, overlap=overlap, storage=storage, checkpoint_every=checkpoint_every,
+                   **(fast_path or {}))
+    if simulate:
+        # Headless: no browser, server or renderer in the loop
+        if subprocess:
+            # One arena per worker process; observations come back through shared memory
+            env = SharedMemoryVecEnv(
+                [simulated_env(seed, levels, observation, decision_interval) for seed in range(simulate)])
+        else:
+            env = SimulatorVecEnv(SlitherSimulator(num_arenas=simulate), **env_args)
+        await learn(None, env, n_steps=max(64, N_STEPS // simulate), **options)
+        return
+    if replay:
+        # Offline: step through a recorded session as fast as possible
+        env = SlitherEnv(connection=ReplayConnection(replay), **env_args)
+        await learn(None, env, **options)
+        return
+    if num_clients > 1:
+        # One env slot per browser tab; keep the rollout buffer the same size
+        recorder_factory = None
+        if record:
+            # One trace per client session: <record>.0, <record>.1, ...
+            sessions = itertools.count()
+            recorder_factory = lambda: TraceRecorder(f"{record}.{next(sessions)}")
+        connection = ClientPool(
+            num_clients, recorder_factory=recorder_factory, policy=buffer_policy, capacity=buffer_size)
+        env = SlitherVecEnv(connection, **env_args)
+        n_steps = max(64, N_STEPS // num_clients)
+    else:
+        recorder = TraceRecorder(record) if record else None
+        connection = GameConnection(recorder=recorder, policy=buffer_policy, capacity=buffer_size)
+        env = SlitherEnv(connection=connection, **env_args)
+        n_steps = N_STEPS
+    # Draws the observations the env computes, off the event loop
+    env.viewer = Renderer().start()
+    try:
+        await asyncio.gather(
+            start_server(connection, settings=client_settings(observation, send_every, view_radius, client_fields),
+                         adapt_send_rate=adapt_send_rate),
+            learn(connection, env, n_steps=n_steps, **options),
+        )
+    finally:
+        env.viewer.close()
+        # Also finishes the traces of clients still connected
+        connection.close()
 
 if __name__ == "__main__":
-    asyncio.run(main_async())
+    parser = argparse.ArgumentParser(description="Train a PPO agent on live game clients.")
+    parser.add_argument("--num-clients", type=int, default=1,
+                        help="Number of game clients to step in lockstep.")
+    parser.add_argument("--simulate", type=int, default=0, metavar="ARENAS",
+                        help="Train against this many headless simulated arenas instead of game clients.")
+    parser.add_argument("--record", type=str, default=None, metavar="PATH",
+                        help="Record the session's states and actions to a trace file; with --num-clients, "
+                             "each client session to PATH.0, PATH.1, ... Not available with --simulate or --replay.")
+    parser.add_argument("--replay", type=str, default=None, metavar="PATH",
+                        help="Train offline by replaying a recorded trace file.")
+    parser.add_argument("--extractor", choices=sorted(EXTRACTORS), default=None,
+                        help="Features extractor; sparse-vit skips empty patches. Defaults to vit, "
+                             "foveated-vit with --levels, or entity-attention with --observation entities.")
+    parser.add_argument("--levels", type=int, default=1,
+                        help="Observe this many concentric grids, fine near the head and coarse at range.")
+    parser.add_argument("--observation", choices=OBSERVATIONS, default=GRID,
+                        help="Observe grids, or a table of the entities in view.")
+    parser.add_argument("--decision-interval", type=int, default=1, metavar="K",
+                        help="Repeat each action for K game states, summing their rewards; only the last is encoded.")
+    parser.add_argument("--rollout-storage", choices=STORAGES, default=FLOAT32,
+                        help="How the rollout buffer stores observations between collection and optimization.")
+    parser.add_argument("--buffer-policy", choices=POLICIES, default=DROP_OLDEST,
+                        help="What to do with incoming states when training falls behind.")
+    parser.add_argument("--buffer-size", type=int, default=32,
+                        help="States buffered per client under drop-oldest and block.")
+    parser.add_argument("--overlap", action="store_true",
+                        help="Keep collecting the next rollout while PPO optimizes the last one.")
+    parser.add_argument("--subprocess", action="store_true",
+                        help="With --simulate, step each arena in its own process over shared memory.")
+    parser.add_argument("--checkpoint-every", type=int, default=0, metavar="STEPS",
+                        help=f"Save {MODEL_PATH}.zip from a background thread every STEPS env steps.")
+    parser.add_argument("--fused-attention", action="store_true",
+                        help="Compute attention with scaled_dot_product_attention in training too.")
+    parser.add_argument("--bf16", action="store_true",
+                        help="Run the transformer blocks' matmuls in bfloat16 autocast.")
+    parser.add_argument("--compile", action="store_true",
+                        help="torch.compile each transformer block (takes a while on the first updates).")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="Intra-op threads for torch (default: one per core).")
+    parser.add_argument("--interop-threads", type=int, default=None,
+                        help="Inter-op threads for torch.")
+    add_client_arguments(parser)
+    parser.add_argument("--adapt-send-rate", action="store_true",
+                        help="Have each client send less often while its states are dropped, and more often "
+                             "while the env waits for them.")
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+    if args.record and (args.simulate or args.replay):
+        parser.error("--record needs live game clients; it cannot be combined with --simulate or --replay")
+    if args.extractor is None:
+        if args.observation == ENTITIES:
+            args.extractor = "entity-attention"
+        else:
+            args.extractor = "vit" if args.levels == 1 else "foveated-vit"
+    metrics.configure(args.metrics_port, args.metrics_dump, args.metrics_interval)
+    # Before torch starts any parallel work; the inter-op pool can only be sized once
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    if args.interop_threads:
+        torch.set_num_interop_threads(args.interop_threads)
+
+    asyncio.run(main_async(
+        args.num_clients, args.simulate, args.record, args.replay, args.extractor,
+        args.buffer_policy, args.buffer_size, args.overlap, args.subprocess, args.levels,
+        args.rollout_storage, args.checkpoint_every, args.observation, args.send_every, args.view_radius,
+        args.client_fields, args.adapt_send_rate,
+        dict(fused_attention=args.fused_attention, bf16=args.bf16, compile=args.compile),
+        args.decision_interval))
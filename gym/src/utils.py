@@ -1,20 +1,122 @@
 import json
+import math
 import websockets
 from typing import TYPE_CHECKING
 # if TYPE_CHECKING:
-from slither_env import GameConnection
+from slither_env import GRID, GameConnection, client_caps
+from metrics import METRICS
+from protocol import (
+    CONTROL_FIELDS, DEFAULT_SEND_EVERY, WorldMirror, control, decode_message, handshake, keyframe_request,
+)
 from websockets.asyncio.server import ServerConnection
 
-async def handle_client(websocket: ServerConnection, connection: GameConnection):
+
+def add_client_arguments(parser):
+    parser.add_argument("--send-every", type=int, default=None, metavar="FRAMES",
+                        help=f"Game frames between two states sent by the client (default {DEFAULT_SEND_EVERY}).")
+    parser.add_argument("--view-radius", type=float, default=None,
+                        help="Distance from the head beyond which the client leaves entities out.")
+    parser.add_argument("--client-fields", nargs="+", choices=CONTROL_FIELDS, default=None, metavar="FIELD",
+                        help=f"State sections the client sends; the others are sent empty. "
+                             f"Any of {', '.join(CONTROL_FIELDS)}; all by default.")
+
+
+def client_settings(observation=GRID, send_every=None, view_radius=None, fields=None):
+    """
+    Keyword arguments for protocol.control, sent to every client after the
+    handshake. Empty when there is nothing to change.
+    """
+    settings = dict(send_every=send_every, view_radius=view_radius, caps=client_caps(observation) or None,
+                    fields=fields)
+    return {key: value for key, value in settings.items() if value is not None}
+
+
+class SendRateController:
+    """
+    Adapts a client's send interval to the rate at which the env consumes
+    its states. Every `window` states, it counts the ones the state buffer
+    dropped or had to block on. When more than 1 - `headroom` of them were
+    wasted, the client is asked to send less often in proportion; when none
+    were and nothing is queued, one frame more often. Windows that overlap
+    an optimization phase, which drops every state on purpose, are discarded.
+    """
+
+    def __init__(self, send_every=DEFAULT_SEND_EVERY, min_every=1, max_every=120, window=60, headroom=0.9):
+        self.send_every = send_every
+        self.min_every = min_every
+        self.max_every = max_every
+        self.window = window
+        self.headroom = headroom
+        self._received = 0
+        # (received, wasted) when the current window started
+        self._start = None
+
+    def update(self, connection: GameConnection):
+        """
+        Call after each state is handed to `connection`. Returns the new send
+        interval when it changes, otherwise None.
+        """
+        self._received += 1
+        if connection.rollout_state:
+            self._start = None
+            return None
+        counters = connection.counters
+        wasted = counters["dropped"] + counters["blocked"]
+        if self._start is None:
+            self._start = (self._received, wasted)
+            return None
+        received = self._received - self._start[0]
+        if received < self.window:
+            return None
+        wasted -= self._start[1]
+        self._start = None
+        consumed = 1 - wasted / received
+        if consumed < self.headroom:
+            target = math.ceil(self.send_every * self.headroom / max(consumed, 0.1))
+        elif wasted == 0 and len(connection.buffer) == 0:
+            target = self.send_every - 1
+        else:
+            return None
+        target = min(max(target, self.min_every), self.max_every)
+        if target == self.send_every:
+            return None
+        self.send_every = target
+        return target
+
+
+async def handle_client(websocket: ServerConnection, connection: GameConnection, settings=None,
+                        adapt_send_rate=False):
     print(f"Client connected from {websocket.remote_address}")
+    # Server-side copy of the client's world for delta-v1 clients
+    mirror = WorldMirror()
+    # protocol.control arguments sent after the handshake
+    settings = settings or {}
+    send_rate = None
+    if adapt_send_rate:
+        send_rate = SendRateController(settings.get("send_every", DEFAULT_SEND_EVERY))
     try:
         while True:
-            message = await websocket.recv()
-            data = json.loads(message)
+            with METRICS.timer("recv_wait"):
+                message = await websocket.recv()
+            with METRICS.timer("decode"):
+                kind, payload = decode_message(message, mirror)
+            METRICS.count("messages")
+
+            if kind == "init":
+                await websocket.send(json.dumps(handshake(payload)))
+                if settings:
+                    await websocket.send(json.dumps(control(**settings)))
+            elif kind == "resync":
+                await websocket.send(json.dumps(keyframe_request()))
+            elif kind == "update":
+                with METRICS.timer("put_state"):
+                    await connection.put_state_async(payload)
 
-            if data["type"] == "update":
-                payload = data["payload"]
-                connection.put_state(payload)
+                if send_rate is not None:
+                    send_every = send_rate.update(connection)
+                    if send_every is not None:
+                        print(f"Client {websocket.remote_address} now sends every {send_every} frames")
+                        await websocket.send(json.dumps(control(send_every=send_every)))
 
                 action = connection.latest_action
                 if action is None:
@@ -30,6 +132,7 @@ async def handle_client(websocket: ServerConnection, connection: GameConnection)
                         "acceleration": accelerate
                     }
                 }
-                await websocket.send(json.dumps(action_message))
+                with METRICS.timer("send"):
+                    await websocket.send(json.dumps(action_message))
     except websockets.exceptions.ConnectionClosed:
         print("Client disconnected")
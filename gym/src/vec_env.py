@@ -0,0 +1,234 @@
+import time
+import numpy as np
+from stable_baselines3.common.vec_env.base_vec_env import VecEnv
+from slither_env import GRID, ClientPool, SlitherEnv
+from simulator import SlitherSimulator
+from metrics import METRICS
+
+
+class SlitherVecEnv(VecEnv):
+    """
+    Steps one SlitherEnv per ClientPool slot in lockstep, so that PPO gathers
+    a batch of transitions per game tick instead of a single one.
+
+    Each step sends every connected client its action, then waits up to
+    `step_timeout` seconds for the next state from every client that was
+    keeping up. With `decision_interval` k, each step waits for up to k
+    states per client and `step_timeout` is per state. Clients that miss
+    the deadline (e.g. while respawning) are only polled until they catch
+    up again, so one slow tab cannot stall the others. A slot without a
+    fresh state repeats its last observation with zero reward and
+    `info["stale"] = True`; vacant slots observe zeros.
+
+    A client joining or dropping ends the slot's current episode, with the
+    previous observation in `info["terminal_observation"]`.
+    """
+
+    def __init__(self, pool: ClientPool, grid_size=50, view_range=2000, step_timeout=0.5, levels=1,
+                 observation=GRID, decision_interval=1):
+        self.pool = pool
+        self.step_timeout = step_timeout
+        self.envs = [
+            SlitherEnv(
+                connection=None, grid_size=grid_size, view_range=view_range, levels=levels, observation=observation,
+                decision_interval=decision_interval)
+            for _ in range(pool.size)
+        ]
+        env = self.envs[0]
+        super().__init__(pool.size, env.observation_space, env.action_space)
+
+        self.buf_obs = np.zeros((self.num_envs, *env.observation_space.shape), dtype=np.float32)
+        self.buf_rews = np.zeros((self.num_envs,), dtype=np.float32)
+        self.buf_dones = np.zeros((self.num_envs,), dtype=bool)
+        self.buf_infos = [{} for _ in range(self.num_envs)]
+        # Connection each slot was last stepped with, and whether it kept up
+        self._bound = [None] * self.num_envs
+        self._live = np.zeros((self.num_envs,), dtype=bool)
+        self.actions = None
+        # Optional renderer.Renderer shown slot 0's observations
+        self.viewer = None
+
+    def reset(self):
+        # Block until at least one client is connected and has sent a state
+        self._rebind_all()
+        while not self._collect():
+            self._rebind_all()
+        self.buf_dones[:] = False
+        self.buf_infos = [{} for _ in range(self.num_envs)]
+        self._reset_seeds()
+        self._reset_options()
+        return self.buf_obs.copy()
+
+    def step_async(self, actions):
+        self.actions = actions
+        for env, action in zip(self.envs, actions):
+            if env.connection is not None:
+                env.connection.set_action(action)
+
+    def step_wait(self):
+        self.buf_rews[:] = 0.0
+        self.buf_dones[:] = False
+        self.buf_infos = [{} for _ in range(self.num_envs)]
+        self._rebind_all()
+        while not self._collect():
+            self._rebind_all()
+        for i in np.flatnonzero(~self._live):
+            self.buf_infos[i]["stale"] = True
+        if self.viewer is not None:
+            connection = self._bound[0]
+            self.viewer.submit(self.buf_obs[0], connection.latest_state if connection else None)
+        return (
+            self.buf_obs.copy(),
+            self.buf_rews.copy(),
+            self.buf_dones.copy(),
+            self.buf_infos,
+        )
+
+    def _rebind_all(self):
+        for i in range(self.num_envs):
+            connection = self.pool.connections[i]
+            if connection is self._bound[i]:
+                continue
+            # Client joined, dropped or was replaced: close the slot's episode
+            self.buf_dones[i] = True
+            self.buf_infos[i]["terminal_observation"] = self.buf_obs[i].copy()
+            self.buf_infos[i]["client_changed"] = True
+            self.buf_obs[i] = 0.0
+            self._bound[i] = connection
+            self.envs[i].connection = connection
+            self._live[i] = connection is not None
+
+    def _collect(self):
+        """
+        Gathers the next state from every bound slot. Returns the number of
+        fresh states; when there are none, waits for pool activity first.
+        """
+        self.pool.activity.clear()
+        deadline = time.monotonic() + self.step_timeout * self.envs[0].decision_interval
+        fresh = 0
+        for i, env in enumerate(self.envs):
+            connection = self._bound[i]
+            if connection is None:
+                continue
+
+            def next_state(connection=connection, live=self._live[i]):
+                timeout = max(0.0, deadline - time.monotonic()) if live else 0.0
+                with METRICS.timer("queue_wait"):
+                    return connection.get_state(timeout=timeout)
+
+            frame, reward = env._repeat_action(next_state)
+            self._live[i] = frame is not None
+            if frame is None:
+                continue
+            fresh += 1
+            env.encode_state(frame, out=self.buf_obs[i])
+            self.buf_rews[i] = reward
+            env.step_counter += 1
+            if frame.dead:
+                self.buf_dones[i] = True
+                self.buf_infos[i]["terminal_observation"] = self.buf_obs[i].copy()
+        if not fresh:
+            self.pool.activity.wait(timeout=self.step_timeout)
+        return fresh
+
+    def close(self):
+        for env in self.envs:
+            env.close()
+
+    def get_attr(self, attr_name, indices=None):
+        return [getattr(self.envs[i], attr_name) for i in self._get_indices(indices)]
+
+    def set_attr(self, attr_name, value, indices=None):
+        for i in self._get_indices(indices):
+            setattr(self.envs[i], attr_name, value)
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        return [
+            getattr(self.envs[i], method_name)(*method_args, **method_kwargs)
+            for i in self._get_indices(indices)
+        ]
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return [False for _ in self._get_indices(indices)]
+
+
+class SimulatorVecEnv(VecEnv):
+    """
+    Runs every arena of a SlitherSimulator as one env, with no browser or
+    network in the loop. Each step advances all arenas in a single batched
+    simulator call and encodes the results into one observation batch.
+
+    With `decision_interval` k, each step advances the arenas k ticks with
+    the same actions and sums the rewards, but only encodes the last tick.
+    An arena that dies ends its episode there: our snake is held dead for
+    the rest of the k ticks and respawned after them, so the next episode
+    starts at the spawn as it does with k=1.
+    """
+
+    def __init__(self, simulator: SlitherSimulator, grid_size=50, view_range=2000, levels=1, observation=GRID,
+                 decision_interval=1):
+        self.simulator = simulator
+        self.env = SlitherEnv(
+            connection=None, grid_size=grid_size, view_range=view_range, levels=levels, observation=observation,
+            decision_interval=decision_interval)
+        super().__init__(simulator.num_arenas, self.env.observation_space, self.env.action_space)
+        self.buf_obs = np.zeros((self.num_envs, *self.env.observation_space.shape), dtype=np.float32)
+        self.buf_rews = np.zeros((self.num_envs,), dtype=np.float32)
+        self.buf_dones = np.zeros((self.num_envs,), dtype=bool)
+        self.actions = np.zeros((self.num_envs, 3), dtype=np.float32)
+
+    def reset(self):
+        self.simulator.reset()
+        for i in range(self.num_envs):
+            self.env.encode_state(self.simulator.frame(i), out=self.buf_obs[i])
+        self._reset_seeds()
+        self._reset_options()
+        return self.buf_obs.copy()
+
+    def step_async(self, actions):
+        self.actions = actions
+
+    def step_wait(self):
+        infos = [{} for _ in range(self.num_envs)]
+        self.buf_rews[:] = 0.0
+        self.buf_dones[:] = False
+        frames = [None] * self.num_envs
+        for _ in range(self.env.decision_interval):
+            # Arenas whose episode ended on an earlier tick wait for the
+            # respawn below
+            with METRICS.timer("simulate"):
+                self.simulator.step(self.actions, hold=self.buf_dones)
+            for i in np.flatnonzero(~self.buf_dones):
+                frames[i] = frame = self.simulator.frame(i)
+                self.buf_rews[i] += self.env.calc_reward(frame)
+                if frame.dead:
+                    self.buf_dones[i] = True
+                    infos[i]["terminal_observation"] = self.env.encode_state(frame)
+            if self.buf_dones.all():
+                break
+        for i in np.flatnonzero(~self.buf_dones):
+            self.env.encode_state(frames[i], out=self.buf_obs[i])
+        if self.buf_dones.any():
+            # Respawn straight away so the returned obs starts the next episode
+            self.simulator.respawn_dead()
+            for i in np.flatnonzero(self.buf_dones):
+                self.env.encode_state(self.simulator.frame(i), out=self.buf_obs[i])
+        return self.buf_obs.copy(), self.buf_rews.copy(), self.buf_dones.copy(), infos
+
+    def close(self):
+        self.env.close()
+
+    def get_attr(self, attr_name, indices=None):
+        return [getattr(self.env, attr_name) for _ in self._get_indices(indices)]
+
+    def set_attr(self, attr_name, value, indices=None):
+        setattr(self.env, attr_name, value)
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        return [
+            getattr(self.env, method_name)(*method_args, **method_kwargs)
+            for _ in self._get_indices(indices)
+        ]
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return [False for _ in self._get_indices(indices)]
@@ -1,11 +1,11 @@
 from typing import Awaitable, Callable
 import websockets
-from slither_env import GameConnection
+from slither_env import ClientPool, GameConnection
 from utils import handle_client as default_handle_client
 
 
 async def start_server(
-    connection: GameConnection,
+    connection: GameConnection | ClientPool,
     *,
     handle_client: Callable[
         [websockets.ServerProtocol, GameConnection], Awaitable[None]
@@ -13,9 +13,16 @@ async def start_server(
     **kwargs
 ):
     print("Starting WebSocket server...")
+    if isinstance(connection, ClientPool):
+        # Every client gets its own slot and GameConnection
+        def handler(ws):
+            return connection.serve(ws, handle_client, **kwargs)
+    else:
+        def handler(ws):
+            return handle_client(ws, connection, **kwargs)
     try:
         server = await websockets.serve(
-            lambda ws: handle_client(ws, connection, **kwargs),
+            handler,
             "127.0.0.1",
             10043,
             ping_interval=20,
@@ -0,0 +1,169 @@
+import numpy as np
+import pytest
+from encoder import FrameArrays, encode_frame
+from protocol import FLOAT32_RTOL, pack_state, unpack_state
+from slither_env import SlitherEnv
+
+GRID_SIZES = (50, 128, 256)
+VIEW_RANGE = 2000
+SEEDS = range(8)
+
+
+def random_payload(rng, entities=40, spread=1.3, dead=False):
+    """
+    A JSON payload as sent by client/script.js. Bodies reach `spread`
+    view ranges out, so some fall off the grid, and half of them are
+    snapped to a coarse lattice so that several land in the same cell.
+    Heads stay on the grid.
+    """
+    agent_x, agent_y = rng.uniform(5000, 40000, size=2)
+
+    def point(reach=spread):
+        if rng.random() < 0.5:
+            # 40 lattice points across the view range: many share a cell
+            rel = rng.integers(-20, 20, size=2) * (VIEW_RANGE / 20) * reach
+        else:
+            rel = rng.uniform(-reach * VIEW_RANGE, reach * VIEW_RANGE, size=2)
+        return {"x": float(agent_x + rel[0]), "y": float(agent_y + rel[1])}
+
+    def head():
+        rel = rng.uniform(-VIEW_RANGE, VIEW_RANGE * 0.99, size=2)
+        return {"x": float(agent_x + rel[0]), "y": float(agent_y + rel[1])}
+
+    def parts(n):
+        return [dict(point(), size=float(rng.uniform(5, 30))) for _ in range(n)]
+
+    def n():
+        return int(rng.integers(0, entities))
+
+    return {
+        "slither": {
+            "x": float(agent_x), "y": float(agent_y), "ang": float(rng.uniform(0, 2 * np.pi)),
+            "size": float(rng.uniform(10, 500)), "food_eaten": float(rng.integers(0, 50)),
+            "parts": parts(n()),
+        },
+        "target_slither": dict(head(), ang=float(rng.uniform(0, 2 * np.pi)), parts=parts(n())),
+        "foods": [dict(point(), value=float(rng.uniform(0.5, 12))) for _ in range(n())],
+        "preys": [point() for _ in range(n())],
+        "others": [
+            dict(head(), ang=float(rng.uniform(0, 2 * np.pi)), size=float(rng.uniform(10, 400)),
+                 parts=parts(n()))
+            for _ in range(int(rng.integers(0, 8)))
+        ],
+        "top_body_parts": parts(n()),
+        "dead": dead,
+    }
+
+
+def to_float32(value):
+    """
+    The payload with every number rounded to float32, as binary-v1 sends it.
+    """
+    if isinstance(value, dict):
+        return {k: to_float32(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [to_float32(v) for v in value]
+    if isinstance(value, float):
+        return float(np.float32(value))
+    return value
+
+
+def assert_same_encoding(env, payload):
+    expected = env._encode_state_loop(payload)
+    np.testing.assert_array_equal(env.encode_state(payload), expected)
+    frame = FrameArrays.from_state(payload)
+    np.testing.assert_array_equal(encode_frame(frame, env.grid_size, env.view_range), expected)
+    # Into a reused buffer holding the previous observation
+    out = np.full_like(expected, 7.0)
+    env.encode_state(payload, out=out)
+    np.testing.assert_array_equal(out, expected)
+
+
+@pytest.mark.parametrize("grid_size", GRID_SIZES)
+@pytest.mark.parametrize("seed", SEEDS)
+def test_matches_loop_encoder(grid_size, seed):
+    env = SlitherEnv(connection=None, grid_size=grid_size, view_range=VIEW_RANGE)
+    assert_same_encoding(env, random_payload(np.random.default_rng(seed)))
+
+
+@pytest.mark.parametrize("grid_size", GRID_SIZES)
+def test_duplicate_cells_last_wins(grid_size):
+    env = SlitherEnv(connection=None, grid_size=grid_size, view_range=VIEW_RANGE)
+    payload = random_payload(np.random.default_rng(0), entities=1)
+    cell = {"x": payload["slither"]["x"] + 100.0, "y": payload["slither"]["y"] - 250.0}
+    sizes = [11.0, 23.0, 17.0]
+    payload["slither"]["parts"] = [dict(cell, size=s) for s in sizes]
+    payload["top_body_parts"] = [dict(cell, size=s) for s in sizes]
+    payload["foods"] = [dict(cell, value=v) for v in (1.0, 2.5, 4.0)]
+    payload["others"] = [dict(cell, ang=1.0, size=50.0, parts=[dict(cell, size=s) for s in sizes])]
+    assert_same_encoding(env, payload)
+
+    obs = env.encode_state(payload)
+    gx, gy = np.argwhere(obs[2])[0]
+    assert obs[2, gx, gy] == 17.0
+    assert obs[3, gx, gy] == 17.0
+    assert obs[9, gx, gy] == 17.0
+    # Food sums instead
+    assert obs[0, gx, gy] == 7.5
+
+
+@pytest.mark.parametrize("grid_size", GRID_SIZES)
+def test_empty_state(grid_size):
+    env = SlitherEnv(connection=None, grid_size=grid_size, view_range=VIEW_RANGE)
+    payload = {
+        "slither": {"x": 1000.0, "y": 2000.0, "ang": 0.5, "parts": []},
+        "target_slither": None,
+        "foods": [],
+        "preys": [],
+        "others": [],
+        "top_body_parts": [],
+    }
+    assert_same_encoding(env, payload)
+    # A target without a head position only draws its parts
+    payload["target_slither"] = {"parts": [{"x": 1100.0, "y": 2100.0}]}
+    assert_same_encoding(env, payload)
+    # Another slither with no parts still marks its head
+    payload["others"] = [{"x": 900.0, "y": 1900.0, "parts": []}]
+    assert_same_encoding(env, payload)
+
+
+@pytest.mark.parametrize("grid_size", GRID_SIZES)
+def test_out_of_range_heads(grid_size):
+    env = SlitherEnv(connection=None, grid_size=grid_size, view_range=VIEW_RANGE)
+    payload = random_payload(np.random.default_rng(1))
+    agent_x = payload["slither"]["x"]
+
+    # Heads are written unchecked: up to a grid width behind the view they
+    # wrap around like a negative Python index...
+    payload["others"][:0] = [{"x": agent_x - 2.5 * VIEW_RANGE, "y": payload["slither"]["y"], "parts": []}]
+    payload["target_slither"]["x"] = agent_x - 1.5 * VIEW_RANGE
+    assert_same_encoding(env, payload)
+
+    # ...and past the far edge they raise, in both encoders
+    payload["target_slither"]["x"] = agent_x + 1.5 * VIEW_RANGE
+    with pytest.raises(IndexError):
+        env._encode_state_loop(payload)
+    with pytest.raises(IndexError):
+        env.encode_state(payload)
+
+
+@pytest.mark.parametrize("dead", (False, True))
+def test_dead_flag(dead):
+    env = SlitherEnv(connection=None, grid_size=50, view_range=VIEW_RANGE)
+    payload = random_payload(np.random.default_rng(2), dead=dead)
+    assert_same_encoding(env, payload)
+    frame = FrameArrays.from_state(payload)
+    assert frame.dead is dead
+    assert unpack_state(pack_state(frame)).dead is dead
+
+
+@pytest.mark.parametrize("grid_size", GRID_SIZES)
+@pytest.mark.parametrize("seed", SEEDS)
+def test_binary_frames(grid_size, seed):
+    env = SlitherEnv(connection=None, grid_size=grid_size, view_range=VIEW_RANGE)
+    payload = random_payload(np.random.default_rng(seed), dead=bool(seed % 2))
+    frame = unpack_state(pack_state(FrameArrays.from_state(payload)))
+    expected = env._encode_state_loop(to_float32(payload))
+    np.testing.assert_allclose(env.encode_state(frame), expected, rtol=FLOAT32_RTOL, atol=0)
+    np.testing.assert_allclose(
+        encode_frame(frame, grid_size, VIEW_RANGE), expected, rtol=FLOAT32_RTOL, atol=0)
@@ -0,0 +1,30 @@
+import numpy as np
+from protocol import WorldMirror
+
+SCALARS = (0.0, 0.0, 0.0, 10.0, 0.0, np.nan, np.nan, 0.0)
+
+
+def owned_keys(owner, ids):
+    return (np.uint64(owner) << np.uint64(32)) | np.asarray(ids, dtype=np.uint64)
+
+
+def test_snapshot_drops_orphan_parts_without_others():
+    mirror = WorldMirror()
+    mirror.sections["other_parts"].reset(owned_keys(7, [1]), np.array([[1.0, 2.0, 10.0]], np.float32))
+    frame = mirror.snapshot(SCALARS, 0)
+    assert frame.other_parts.shape == (0, 3)
+    assert frame.other_parts.dtype == np.float32
+    assert len(frame.other_heads) == 0
+    assert len(frame.other_part_counts) == 0
+
+
+def test_snapshot_drops_parts_of_owners_out_of_view():
+    mirror = WorldMirror()
+    mirror.sections["others"].reset(
+        np.array([5], np.uint64), np.array([[0.0, 0.0, 0.0, 20.0, 0.0]], np.float32))
+    keys = np.concatenate((owned_keys(5, [1, 2]), owned_keys(7, [3])))
+    values = np.array([[1.0, 1.0, 10.0], [2.0, 2.0, 10.0], [9.0, 9.0, 10.0]], np.float32)
+    mirror.sections["other_parts"].reset(keys, values)
+    frame = mirror.snapshot(SCALARS, 0)
+    np.testing.assert_array_equal(frame.other_part_counts, [2])
+    np.testing.assert_array_equal(frame.other_parts, values[:2])